@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from ..database import SessionLocal
-from ..models import Backup, Device
+from ..models import Backup, Blob, Device, JobResult
 from pathlib import Path
 from ..security import get_current_user, require_admin
 from ..services.audit_log import audit_event
+from ..services import config_history
+from ..services.backup_store import is_compressed, iter_config
 
 router = APIRouter(prefix="/backups", tags=["backups"])
 def get_db(): 
@@ -25,21 +27,52 @@ def list_backups(current_user=Depends(get_current_user), db: Session = Depends(g
             "device_name": dev.hostname if dev else str(b.device_id),
             "timestamp": b.timestamp,
             "size": b.size_bytes,
-            "hash": b.hash,
+            "hash": b.hash[:8],
+            "sha256": b.hash if len(b.hash) == 64 else None,
             "status": b.status,
             "path": b.path,
+            "verified_at": b.verified_at,
+            "stored_as": "delta" if b.delta_base_id else "full",
+            "has_raw": b.raw_blob_sha256 is not None,
         })
     return out
 
 @router.get("/{backup_id}/download")
-def download_backup(backup_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def download_backup(backup_id: int, request: Request, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     b = db.get(Backup, backup_id)
     if not b or not Path(b.path).exists():
         raise HTTPException(404, "Not found")
     dev = db.get(Device, b.device_id)
     device_name = dev.hostname if dev else str(b.device_id)
     audit_event(user=current_user.username, action="backup_download", target=f"{device_name} ({b.timestamp.strftime('%Y-%m-%d %H:%M')})", result="success")
-    return FileResponse(b.path, filename=Path(b.path).name, media_type="text/plain")
+    filename = f"{device_name}_{b.timestamp.strftime('%Y%m%d_%H%M')}.cfg" if len(b.hash) == 64 else Path(b.path).name
+    if b.delta_base_id is not None:
+        # Older version in delta mode: rebuilt (or served from the rebuild cache)
+        try:
+            content = config_history.read_config(db, b)
+        except Exception as e:
+            raise HTTPException(500, f"Failed to rebuild backup: {str(e)}")
+        return Response(content, media_type="text/plain", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    if not is_compressed(b.path):
+        return FileResponse(b.path, filename=filename, media_type="text/plain")
+    disposition = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", "").lower():
+        # Client decompresses: send the stored bytes as they are
+        return FileResponse(b.path, media_type="text/plain", headers={**disposition, "Content-Encoding": "gzip"})
+    return StreamingResponse(iter_config(b.path), media_type="text/plain", headers=disposition)
+
+@router.get("/{backup_id}/raw")
+def download_raw_backup(backup_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """The config as received, before normalization (only kept with BACKUP_STORE_RAW)."""
+    b = db.get(Backup, backup_id)
+    blob = db.get(Blob, b.raw_blob_sha256) if b and b.raw_blob_sha256 else None
+    if not blob or not Path(blob.path).exists():
+        raise HTTPException(404, "Not found")
+    dev = db.get(Device, b.device_id)
+    device_name = dev.hostname if dev else str(b.device_id)
+    audit_event(user=current_user.username, action="backup_download", target=f"{device_name} ({b.timestamp.strftime('%Y-%m-%d %H:%M')}, raw)", result="success")
+    filename = f"{device_name}_{b.timestamp.strftime('%Y%m%d_%H%M')}_raw.cfg"
+    return StreamingResponse(iter_config(blob.path), media_type="text/plain", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @router.delete("/{backup_id}")
 def delete_backup(backup_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
@@ -50,18 +83,32 @@ def delete_backup(backup_id: int, db: Session = Depends(get_db), current_user=De
     dev = db.get(Device, b.device_id)
     device_name = dev.hostname if dev else str(b.device_id)
     
-    # Delete file from filesystem
+    # Versions stored as deltas against this one become full again first
+    try:
+        stale = config_history.materialize_dependents(db, b)
+    except Exception as e:
+        db.rollback()
+        audit_event(user=current_user.username, action="backup_delete", target=f"{device_name} ({b.timestamp.strftime('%Y-%m-%d %H:%M')})", result="failed")
+        raise HTTPException(500, f"Failed to rebuild dependent backups: {str(e)}")
+
+    # Delete file from filesystem, unless another backup shares it. Blobs are only
+    # released: a running job may be about to reference the same content.
+    shared = db.query(Backup).filter(Backup.id != b.id, Backup.path == b.path).first() is not None
     try:
         file_path = Path(b.path)
-        if file_path.exists():
+        if not b.blob_sha256 and not shared and file_path.exists():
             file_path.unlink()
     except Exception as e:
         audit_event(user=current_user.username, action="backup_delete", target=f"{device_name} ({b.timestamp.strftime('%Y-%m-%d %H:%M')})", result="failed")
         raise HTTPException(500, f"Failed to delete file: {str(e)}")
     
     # Delete from database
+    blobs = [digest for digest in (b.blob_sha256, b.raw_blob_sha256) if digest]
+    db.query(JobResult).filter(JobResult.backup_id == b.id).update({"backup_id": None}, synchronize_session=False)
     db.delete(b)
     db.commit()
+    config_history.release_blobs(db, blobs)
+    config_history.remove_files(stale)
     
     audit_event(user=current_user.username, action="backup_delete", target=f"{device_name} ({b.timestamp.strftime('%Y-%m-%d %H:%M')})", result="success")
     return {"message": "Backup deleted successfully"}
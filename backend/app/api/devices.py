@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from .. import database
 from ..database import SessionLocal
-from ..models import Device
-from ..schemas import DeviceIn, DeviceOut, TestResult
-from ..utils.crypto import enc, dec
-from ..services.netmiko_worker import fetch_running_config
+from ..models import CredentialProfile, Device
+from ..schemas import BulkTestIn, DeviceIn, DeviceOut, TestResult
+from ..utils.crypto import dec, enc
+from ..services.netmiko_worker import TRANSPORTS
+from ..services import adaptive_timeouts, circuit_breaker, credentials, device_test, reachability
 from ..security import get_current_user, require_admin
 from ..services.audit_log import audit_event
+from ..utils.timeutil import tz
 
 router = APIRouter(prefix="/devices", tags=["devices"])
 
@@ -15,17 +21,39 @@ def get_db():
     try: yield db
     finally: db.close()
 
+def _device_out(d: Device) -> DeviceOut:
+    return DeviceOut.model_validate({**d.__dict__, **circuit_breaker.describe(d)})
+
+def _check_transport(transport: str | None) -> str | None:
+    if not transport:
+        return None
+    if transport.lower() not in TRANSPORTS:
+        raise HTTPException(422, f"transport must be one of: {', '.join(TRANSPORTS)}")
+    return transport.lower()
+
+def _check_credentials(db: Session, payload: DeviceIn, need_own: bool) -> int | None:
+    """The payload's profile id; need_own: without one, username and password must be given."""
+    if payload.credential_profile_id is not None:
+        if not db.get(CredentialProfile, payload.credential_profile_id):
+            raise HTTPException(422, "credential profile not found")
+        return payload.credential_profile_id
+    if need_own and not (payload.username and payload.password):
+        raise HTTPException(422, "username and password are required without a credential profile")
+    return None
+
 @router.post("", response_model=DeviceOut)
 def create_device(payload: DeviceIn, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    profile_id = _check_credentials(db, payload, need_own=True)
     dev = Device(
         hostname=payload.hostname, ip=payload.ip, vendor=payload.vendor,
         protocol=payload.protocol, port=payload.port,
         username_enc=enc(payload.username), password_enc=enc(payload.password),
-        secret_enc=enc(payload.secret) if payload.secret else None, tags=payload.tags
+        secret_enc=enc(payload.secret) if payload.secret else None, tags=payload.tags,
+        transport=_check_transport(payload.transport), credential_profile_id=profile_id,
     )
     db.add(dev); db.commit(); db.refresh(dev)
     audit_event(user=current_user.username, action="device_create", target=dev.hostname, result="success")
-    return DeviceOut.model_validate(dev.__dict__)
+    return _device_out(dev)
 
 
 @router.put("/{device_id}", response_model=DeviceOut)
@@ -34,6 +62,16 @@ def update_device(device_id: int, payload: DeviceIn, db: Session = Depends(get_d
     if not d:
         raise HTTPException(404, "Not found")
     old_hostname = d.hostname
+    session = (d.ip, d.port, d.protocol, d.vendor, d.credential_profile_id)
+    login_changed = (
+        (payload.username and payload.username != dec(d.username_enc))
+        or (payload.password and payload.password != dec(d.password_enc))
+        or (payload.secret or "") != dec(d.secret_enc or "")
+    )
+    # Clients that predate profiles never send the field: keep the device's profile
+    if "credential_profile_id" in payload.model_fields_set:
+        # a profile being detached leaves the device with its own credentials only
+        d.credential_profile_id = _check_credentials(db, payload, need_own=d.credential_profile_id is not None)
     d.hostname = payload.hostname
     d.ip = payload.ip
     d.vendor = payload.vendor
@@ -45,11 +83,16 @@ def update_device(device_id: int, payload: DeviceIn, db: Session = Depends(get_d
         d.password_enc = enc(payload.password)
     d.secret_enc = enc(payload.secret) if payload.secret else None
     d.tags = payload.tags
+    d.transport = _check_transport(payload.transport)
     if payload.enabled is not None:
         d.enabled = payload.enabled
+    if login_changed or session != (d.ip, d.port, d.protocol, d.vendor, d.credential_profile_id):
+        # Possibly a different box now: the next backup pulls in full
+        d.change_token = None
+        d.probe_skips = 0
     db.commit(); db.refresh(d)
     audit_event(user=current_user.username, action="device_update", target=old_hostname, result="success")
-    return DeviceOut.model_validate(d.__dict__)
+    return _device_out(d)
 
 
 @router.delete("/{device_id}")
@@ -64,7 +107,27 @@ def delete_device(device_id: int, db: Session = Depends(get_db), current_user=De
 
 @router.get("", response_model=list[DeviceOut])
 def list_devices(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    return [DeviceOut.model_validate(d.__dict__) for d in db.query(Device).all()]
+    return [_device_out(d) for d in db.query(Device).all()]
+
+@router.get("/reachability")
+async def device_reachability(refresh: bool = False, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """TCP reachability of every device's ip:port (cached for REACHABILITY_CACHE_TTL unless refresh)."""
+    devices = db.query(Device).all()
+    results = await reachability.sweep(((d.ip, d.port) for d in devices), refresh=refresh)
+    out = []
+    for d in devices:
+        r = results[(d.ip, d.port)]
+        out.append({
+            "id": d.id,
+            "hostname": d.hostname,
+            "ip": d.ip,
+            "port": d.port,
+            "reachable": r.reachable,
+            "latency_ms": r.latency_ms,
+            "error": r.error,
+            "checked_at": datetime.fromtimestamp(r.checked_at, tz()),
+        })
+    return out
 
 @router.get("/tags/available")
 def get_available_tags(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
@@ -79,22 +142,109 @@ def get_available_tags(current_user=Depends(get_current_user), db: Session = Dep
                     tags_set.add(tag)
     return {"tags": sorted(list(tags_set))}
 
+def _test_info(db: Session, d: Device) -> dict:
+    return {
+        'id': d.id,
+        'hostname': d.hostname,
+        'ip': d.ip,
+        'vendor': d.vendor,
+        'protocol': d.protocol,
+        'port': d.port,
+        'credentials': credentials.ref(db, d),  # decrypted when the session opens
+        'transport': d.transport,
+    }
+
+def _test_row(r: device_test.DeviceTestResult) -> dict:
+    return {**r.as_dict(), "tested_at": datetime.fromtimestamp(r.tested_at, tz()).isoformat()}
+
+@router.post("/test")
+async def test_devices(payload: BulkTestIn, request: Request, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    """
+    Test many devices at once (by device_ids and/or tags, default all enabled
+    devices) and stream each result as it completes: NDJSON, or SSE when the
+    client sends Accept: text/event-stream. The last message is a summary.
+    """
+    query = db.query(Device)
+    if payload.device_ids:
+        query = query.filter(Device.id.in_(payload.device_ids))
+    else:
+        query = query.filter_by(enabled=True)
+    devices = query.all()
+    target_tags = [t.strip().lower() for t in (payload.tags or "").split(",") if t.strip()]
+    if target_tags:
+        devices = [
+            d for d in devices
+            if any(t.strip().lower() in target_tags for t in (d.tags or "").split(","))
+        ]
+    device_list = []
+    timeouts = {}
+    for d in devices:
+        device_list.append(_test_info(db, d))
+        timeouts[d.id] = adaptive_timeouts.timeouts_for(db, d.id)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    username = current_user.username
+
+    def frame(event: str, data: dict) -> str:
+        if sse:
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps(data if event == "result" else {event: True, **data}) + "\n"
+
+    async def stream():
+        passed = []
+        failed = 0
+        async for r in device_test.test_many(device_list, timeouts, refresh=payload.refresh):
+            if r.success:
+                passed.append(r.device_id)
+            else:
+                failed += 1
+            yield frame("result", _test_row(r))
+        yield frame("done", {"total": len(device_list), "succeeded": len(passed), "failed": failed})
+        # Reachable again: let the next run try them instead of waiting out the cooldown
+        s = database.SessionLocal()
+        try:
+            for d in s.query(Device).filter(Device.id.in_(passed), Device.consecutive_failures > 0):
+                circuit_breaker.reset(d)
+            s.commit()
+        finally:
+            s.close()
+        audit_event(user=username, action="device_test_bulk", target=f"{len(device_list)} device(s)",
+                    result=f"{len(passed)}/{len(device_list)} successful")
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    # X-Accel-Buffering: nginx would otherwise hold results back until the buffer fills
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+@router.get("/test/results")
+def recent_test_results(current_user=Depends(get_current_user)):
+    """Bulk test results from the last DEVICE_TEST_CACHE_TTL seconds, newest first."""
+    return [_test_row(r) for r in device_test.recent()]
+
 @router.post("/{device_id}/test", response_model=TestResult)
-def test_device(device_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def test_device(device_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     d = db.get(Device, device_id)
     if not d: raise HTTPException(404, "Not found")
-    try:
-        decrypted_user = dec(d.username_enc)
-        decrypted_pass = dec(d.password_enc)
-        decrypted_secret = dec(d.secret_enc) if d.secret_enc else None
-        
-        fetch_running_config(
-            vendor=d.vendor, host=d.ip, username=decrypted_user,
-            password=decrypted_pass, secret=decrypted_secret,
-            protocol=d.protocol, port=d.port, cmd="show version"
-        )
-        audit_event(user=current_user.username, action="device_test", target=d.hostname, result="success")
-        return TestResult(success=True, message="OK")
-    except Exception as e:
-        audit_event(user=current_user.username, action="device_test", target=d.hostname, result=f"failed: {str(e)}")
-        return TestResult(success=False, message=f"Failed: {e}")
+    # Same interactive lane and per-host cap as the bulk test
+    r = await device_test.test_one(_test_info(db, d), adaptive_timeouts.timeouts_for(db, d.id))
+    if not r.success:
+        audit_event(user=current_user.username, action="device_test", target=d.hostname,
+                    result=f"failed: {r.message.removeprefix('Failed: ')}")
+        return TestResult(success=False, message=r.message)
+    # Reachable again: let the next run try it instead of waiting out the cooldown
+    if d.consecutive_failures:
+        circuit_breaker.reset(d)
+        db.commit()
+    audit_event(user=current_user.username, action="device_test", target=d.hostname, result="success")
+    return TestResult(success=True, message=r.message)
+
+
+@router.post("/{device_id}/breaker/reset", response_model=DeviceOut)
+def reset_breaker(device_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    """Close the device's circuit breaker so the next run tries it again."""
+    d = db.get(Device, device_id)
+    if not d:
+        raise HTTPException(404, "Not found")
+    circuit_breaker.reset(d)
+    db.commit(); db.refresh(d)
+    audit_event(user=current_user.username, action="device_breaker_reset", target=d.hostname, result="success")
+    return _device_out(d)
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from datetime import timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from .. import database
 from ..database import SessionLocal
-from ..models import Device, Job, Backup
-from ..utils.crypto import dec
-from ..utils.timeutil import tznow
-from ..services.netmiko_worker import fetch_running_config
-from ..services.job_controller import submit
-from hashlib import sha256
-from pathlib import Path
+from ..models import Device, FetchDiagnostic, Job, JobResult
+from ..schemas import ManualRunIn
+from ..services import job_controller, job_events
+from ..services.collector import INTERACTIVE, MANUAL
+from ..settings import settings
 from ..security import get_current_user, require_admin
 from ..services.audit_log import audit_event
-import asyncio
+from ..utils.timeutil import tznow
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
 def get_db():
@@ -19,102 +24,107 @@ def get_db():
     finally: db.close()
 
 @router.post("/run/manual")
-async def run_manual(db: Session = Depends(get_db), current_user=Depends(require_admin)):
-    async def task(job_id: int, device_list: list[dict]):
-        """Background task - receives job_id and device dicts, NOT ORM objects"""
-        db = SessionLocal()
-        try:
-            # Re-query job with fresh session
-            job = db.query(Job).filter(Job.id == job_id).first()
-            if not job:
-                return
-            
-            log_lines = []
-            ok = 0
-            
-            log_lines.append(f"Job started at {job.started_at.isoformat()}")
-            log_lines.append(f"Processing {len(device_list)} enabled device(s)...")
-            
-            for idx, device_info in enumerate(device_list):
-                try:
-                    log_lines.append(f"[{device_info['hostname']}] Connecting to {device_info['ip']}...")
-                    
-                    # Fetch running config
-                    path, content = fetch_running_config(
-                        vendor=device_info['vendor'], 
-                        host=device_info['ip'], 
-                        username=device_info['username'],
-                        password=device_info['password'], 
-                        secret=device_info['secret'],
-                        protocol=device_info['protocol'], 
-                        port=device_info['port']
-                    )
-                    
-                    # Save backup record
-                    b = Backup(
-                        device_id=device_info['id'], 
-                        size_bytes=len(content),
-                        hash=sha256(content).hexdigest()[:8], 
-                        path=str(path)
-                    )
-                    db.add(b)
-                    ok += 1
-                    db.commit()
-                    log_lines.append(f"[{device_info['hostname']}] Backup success ({len(content)} bytes, path={path})")
-                    
-                    # Delay between devices (rate limiting)
-                    if idx < len(device_list) - 1:
-                        log_lines.append(f"[{device_info['hostname']}] Waiting 3s before next device...")
-                        await asyncio.sleep(3)
-                    
-                except Exception as e:
-                    log_lines.append(f"[{device_info['hostname']}] Backup failed: {str(e)}")
-                    if idx < len(device_list) - 1:
-                        await asyncio.sleep(2)
-            
-            # Update job status
-            from datetime import datetime
-            log_lines.append(f"Job completed: {ok}/{len(device_list)} successful")
-            
-            job.status = "success"
-            job.devices = ok
-            job.finished_at = tznow()
-            job.log = "\n".join(log_lines)
-            db.commit()
-            
-            audit_event(user=current_user.username, action="job_run_manual", target=f"job#{job_id}", result=f"success ({ok}/{len(device_list)} devices)")
-            
-        finally:
-            db.close()
-    
-    # Create job record
-    job = Job(triggered_by="manual", status="running")
-    db.add(job)
-    db.commit()
-    db.refresh(job)
-    
-    # Get devices and extract to plain dicts
-    devices = db.query(Device).filter_by(enabled=True).all()
-    device_list = []
-    for d in devices:
-        device_list.append({
-            'id': d.id,
-            'hostname': d.hostname,
-            'ip': d.ip,
-            'vendor': d.vendor,
-            'protocol': d.protocol,
-            'port': d.port,
-            'username': dec(d.username_enc),
-            'password': dec(d.password_enc),
-            'secret': dec(d.secret_enc) if d.secret_enc else None,
+async def run_manual(payload: ManualRunIn | None = None, db: Session = Depends(get_db),
+                     current_user=Depends(require_admin)):
+    """
+    Queue a backup of all enabled devices (manual lane), or of the given
+    device_ids (interactive lane, ahead of manual and scheduled jobs).
+    """
+    # Devices are re-read by the worker when the job starts (see job_controller)
+    if payload is not None and payload.device_ids:
+        device_ids = [d.id for d in db.query(Device.id).filter(Device.id.in_(payload.device_ids)).order_by(Device.id)]
+        if not device_ids:
+            raise HTTPException(status_code=404, detail="No such devices")
+        priority, what = INTERACTIVE, f"{len(device_ids)} selected device(s)"
+    else:
+        device_ids = [d.id for d in db.query(Device.id).filter_by(enabled=True).order_by(Device.id)]
+        priority, what = MANUAL, f"{len(device_ids)} enabled device(s)"
+    job = job_controller.enqueue(
+        db, "manual", device_ids, requested_by=current_user.username,
+        log_lines=[f"Queued by {current_user.username}: {what}"], priority=priority,
+    )
+    audit_event(user=current_user.username, action="job_run_manual", target=f"job#{job.id}", result="queued")
+    return {"queued": True, "job_id": job.id, "lane": job_controller.lane(job)}
+
+
+@router.get("/queue")
+def queue_stats(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Queue depth, workers holding jobs, and wait/run times of recent jobs."""
+    return job_controller.stats(db)
+
+
+def _result_out(r: JobResult, hostname: str | None) -> dict:
+    return {
+        "job_id": r.job_id,
+        "device_id": r.device_id,
+        "hostname": hostname,
+        "finished_at": r.finished_at.isoformat() if r.finished_at else None,
+        "status": r.status,
+        "error_class": r.error_class,
+        "error": r.error,
+        "connect_s": r.connect_s,
+        "auth_s": r.auth_s,
+        "transfer_s": r.transfer_s,
+        "size_bytes": r.size_bytes,
+        "backup_id": r.backup_id,
+        "shared_from_job_id": r.shared_from_job_id,
+    }
+
+
+@router.get("/results")
+def list_results(device_id: int | None = None, status: str | None = None, days: int = Query(30, ge=1),
+                 limit: int = Query(200, ge=1, le=1000), db: Session = Depends(get_db),
+                 current_user=Depends(get_current_user)):
+    """Per-device outcomes of recent jobs, newest first (a device's history with device_id)."""
+    since = tznow() - timedelta(days=days)
+    query = (
+        db.query(JobResult, Device.hostname)
+        .outerjoin(Device, Device.id == JobResult.device_id)
+        .filter(JobResult.finished_at >= since)
+    )
+    if device_id is not None:
+        query = query.filter(JobResult.device_id == device_id)
+    if status:
+        query = query.filter(JobResult.status == status)
+    rows = query.order_by(JobResult.finished_at.desc(), JobResult.id.desc()).limit(limit).all()
+    return [_result_out(r, hostname) for r, hostname in rows]
+
+
+@router.get("/results/failures")
+def failure_report(days: int = Query(30, ge=1), db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Devices that failed in the last `days` days: how often, why, and the latest error."""
+    since = tznow() - timedelta(days=days)
+    failed = (JobResult.status == "failed", JobResult.finished_at >= since)
+    by_class = (
+        db.query(JobResult.device_id, JobResult.error_class, func.count(), func.max(JobResult.finished_at))
+        .filter(*failed)
+        .group_by(JobResult.device_id, JobResult.error_class)
+        .all()
+    )
+    latest_ids = (
+        db.query(func.max(JobResult.id)).filter(*failed).group_by(JobResult.device_id).scalar_subquery()
+    )
+    latest = {
+        r.device_id: (r, hostname)
+        for r, hostname in db.query(JobResult, Device.hostname)
+        .outerjoin(Device, Device.id == JobResult.device_id)
+        .filter(JobResult.id.in_(latest_ids))
+    }
+    report: dict[int, dict] = {}
+    for device_id, error_class, count, last_at in by_class:
+        last, hostname = latest[device_id]
+        entry = report.setdefault(device_id, {
+            "device_id": device_id,
+            "hostname": hostname,
+            "failures": 0,
+            "error_classes": {},
+            "last_failed_at": last.finished_at.isoformat() if last.finished_at else None,
+            "last_error": last.error,
+            "last_job_id": last.job_id,
         })
-    
-    audit_event(user=current_user.username, action="job_run_manual", target=f"job#{job.id}", result="started")
-    
-    # Submit task with job_id (not job object!) and device dicts
-    await submit(lambda: task(job.id, device_list))
-    
-    return {"queued": True}
+        entry["failures"] += count
+        entry["error_classes"][error_class or "other"] = count
+    return sorted(report.values(), key=lambda e: (-e["failures"], e["hostname"] or ""))
 
 
 @router.get("")
@@ -130,6 +140,11 @@ def list_jobs(db: Session = Depends(get_db), current_user=Depends(get_current_us
             "status": r.status,
             "started_at": r.started_at.isoformat() if r.started_at else None,
             "finished_at": r.finished_at.isoformat() if r.finished_at else None,
+            "enqueued_at": r.enqueued_at.isoformat() if r.enqueued_at else None,
+            "attempts": r.attempts or 0,
+            "lane": job_controller.lane(r),
+            "devices_total": r.devices_total,
+            "devices_done": r.devices_done,
             "log": r.log,
         })
     return out
@@ -140,27 +155,149 @@ def get_job(job_id: int, db: Session = Depends(get_db), current_user=Depends(get
     j = db.get(Job, job_id)
     if not j:
         raise HTTPException(status_code=404, detail="Job not found")
+    log, _ = job_events.current_log(db, j)
     return {
         "id": j.id,
         "triggered_by": j.triggered_by,
         "status": j.status,
         "started_at": j.started_at.isoformat() if j.started_at else None,
         "finished_at": j.finished_at.isoformat() if j.finished_at else None,
+        "enqueued_at": j.enqueued_at.isoformat() if j.enqueued_at else None,
+        "attempts": j.attempts or 0,
+        "lane": job_controller.lane(j),
         "devices_count": j.devices or 0,
-        "log": j.log or ""
+        "shared_devices": len(json.loads(j.payload or "{}").get("shared", {})),
+        "progress": job_events.progress(j),
+        "log": "\n".join(log)
     }
 
 
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: int, request: Request, db: Session = Depends(get_db),
+                            current_user=Depends(get_current_user)):
+    """
+    Follow a job: NDJSON, or SSE when the client sends Accept: text/event-stream.
+    First a snapshot (progress and the log so far), then each new log line,
+    progress (devices done/total, devices per minute, ETA) whenever it moves,
+    and a last "done" message once the job has ended.
+    """
+    j = db.get(Job, job_id)
+    if not j:
+        raise HTTPException(status_code=404, detail="Job not found")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    def frame(event: str, data: dict) -> str:
+        if sse:
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"type": event, **data}) + "\n"
+
+    async def stream():
+        last_id = None
+        last_progress = None
+        idle = 0.0
+        while True:
+            # Fresh session per poll: the job is written by whichever worker holds it
+            s = database.SessionLocal()
+            try:
+                job = s.get(Job, job_id)
+                if job is None:
+                    return
+                progress = job_events.progress(job)
+                counters = (progress["status"], progress["devices_total"], progress["devices_done"], progress["succeeded"])
+                if last_id is None:
+                    log, last_id = job_events.current_log(s, job)
+                    yield frame("snapshot", {**progress, "log": log})
+                    last_progress = counters
+                    events = []
+                else:
+                    events = job_events.events_since(s, job_id, last_id)
+            finally:
+                s.close()
+            for e in events:
+                last_id = e.id
+                yield frame("log", {"id": e.id, "line": e.message, "timestamp": e.timestamp.isoformat()})
+            if counters != last_progress:
+                last_progress = counters
+                yield frame("progress", progress)
+            if progress["status"] in job_events.FINAL:
+                yield frame("done", progress)
+                return
+            if events:
+                idle = 0.0
+            else:
+                idle += settings.JOB_STREAM_POLL
+                if idle >= 15:
+                    # keep proxies from closing a quiet stream
+                    idle = 0.0
+                    yield ": keepalive\n\n" if sse else "\n"
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(settings.JOB_STREAM_POLL)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+
+@router.get("/{job_id}/results")
+def job_results(job_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Outcome of each device in this job."""
+    if not db.get(Job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    rows = (
+        db.query(JobResult, Device.hostname)
+        .outerjoin(Device, Device.id == JobResult.device_id)
+        .filter(JobResult.job_id == job_id)
+        .order_by(JobResult.id)
+        .all()
+    )
+    return [_result_out(r, hostname) for r, hostname in rows]
+
+
+@router.get("/{job_id}/diagnostics")
+def list_diagnostics(job_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    """Devices that failed in this job and have a stored session log."""
+    rows = (
+        db.query(FetchDiagnostic, Device.hostname)
+        .outerjoin(Device, Device.id == FetchDiagnostic.device_id)
+        .filter(FetchDiagnostic.job_id == job_id)
+        .order_by(FetchDiagnostic.id)
+        .all()
+    )
+    return [
+        {
+            "id": d.id,
+            "device_id": d.device_id,
+            "hostname": hostname,
+            "timestamp": d.timestamp.isoformat() if d.timestamp else None,
+            "error": d.error,
+            "size": len(d.session_log or ""),
+        }
+        for d, hostname in rows
+    ]
+
+
+@router.get("/{job_id}/diagnostics/{device_id}", response_class=PlainTextResponse)
+def get_diagnostic(job_id: int, device_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    """Session log of a device's failed fetch in this job."""
+    d = (
+        db.query(FetchDiagnostic)
+        .filter(FetchDiagnostic.job_id == job_id, FetchDiagnostic.device_id == device_id)
+        .order_by(FetchDiagnostic.id.desc())
+        .first()
+    )
+    if not d:
+        raise HTTPException(status_code=404, detail="No session log for this device in this job")
+    return PlainTextResponse(d.session_log or "")
+
+
 @router.post("/{job_id}/cancel")
 def cancel_job(job_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
     j = db.get(Job, job_id)
     if not j:
         return {"error": "not found"}
-    if j.status != 'running':
+    status = job_controller.cancel(db, job_id)
+    if status is None:
         return {"ok": False, "detail": "job not running"}
-    j.status = 'failed'
-    from datetime import datetime
-    j.finished_at = tznow()
-    db.commit()
-    audit_event(user=current_user.username, action="job_cancel", target=f"job#{job_id}", result="success")
-    return {"ok": True}
+    audit_event(user=current_user.username, action="job_cancel", target=f"job#{job_id}", result=status)
+    return {"ok": True, "status": status}
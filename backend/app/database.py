@@ -1,9 +1,49 @@
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 from .settings import settings
 
+logger = logging.getLogger(__name__)
+
 engine = create_engine(settings.DB_URL, connect_args={"check_same_thread": False} if settings.DB_URL.startswith("sqlite") else {})
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 class Base(DeclarativeBase): ...
+
+
+# Unique indexes whose duplicate rows may be deleted when the index is added:
+# job_results held one row per device and attempt before a retry kept them
+DEDUPE_BEFORE_INDEX = {"ux_job_results_job_device"}
+
+
+def ensure_schema():
+    """
+    create_all() only creates missing tables. Add columns and indexes
+    introduced since a table was created (columns always as nullable; model
+    defaults apply to new rows). Before a new unique index listed in
+    DEDUPE_BEFORE_INDEX is created, rows that would break it are deleted,
+    keeping the oldest (lowest id).
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    ddl = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl}"))
+            indexes = {i["name"] for i in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in DEDUPE_BEFORE_INDEX and index.name not in indexes:
+                    cols = ", ".join(c.name for c in index.columns)
+                    removed = conn.execute(text(
+                        f"DELETE FROM {table.name} WHERE id NOT IN "
+                        f"(SELECT keep FROM (SELECT MIN(id) AS keep FROM {table.name} GROUP BY {cols}) AS k)"
+                    )).rowcount
+                    if removed:
+                        logger.warning(f"Removed {removed} duplicate {table.name} row(s) before adding {index.name}")
+                index.create(conn, checkfirst=True)
@@ -1,12 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .settings import settings
-from .database import Base, engine
+from .database import Base, engine, ensure_schema
 from .api import devices, jobs, backups
-from .services import scheduler
-from .routers import users as users_router, schedules as schedules_router, audit as audit_router, auth as auth_router
+from .services import job_controller, scheduler, netmiko_worker, session_pool, vendor_profiles
+from .routers import users as users_router, schedules as schedules_router, audit as audit_router, auth as auth_router, credentials as credentials_router
 
 Base.metadata.create_all(bind=engine)
+ensure_schema()
 
 app = FastAPI(title="ABS Backend")
 app.add_middleware(
@@ -25,6 +26,7 @@ app.include_router(users_router.router)
 app.include_router(schedules_router.router)
 app.include_router(audit_router.router)
 app.include_router(auth_router.router)
+app.include_router(credentials_router.router)
 
 @app.on_event("startup")
 async def on_startup():
@@ -32,4 +34,12 @@ async def on_startup():
     users_router._ensure_default_users()
     schedules_router._ensure_default_schedule()
     audit_router._ensure_example_audit()
+    vendor_profiles.load()
     scheduler.start()
+    job_controller.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await job_controller.stop()
+    netmiko_worker.shutdown_executor()
+    session_pool.pool.close_all()
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Integer, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import String, Integer, Boolean, DateTime, Float, ForeignKey, Index, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 from .utils.timeutil import tznow
@@ -25,26 +25,121 @@ class Device(Base):
     secret_enc: Mapped[str | None] = mapped_column(Text, nullable=True)
     tags: Mapped[str | None] = mapped_column(String(256))
     enabled: Mapped[bool] = mapped_column(Boolean, default=True)
+    transport: Mapped[str | None] = mapped_column(String(16), nullable=True)  # netmiko/asyncssh, None = global default
+    change_token: Mapped[str | None] = mapped_column(String(256), nullable=True)  # last change-probe result
+    probe_skips: Mapped[int | None] = mapped_column(Integer, nullable=True)  # runs skipped on the probe since the last full pull
+    consecutive_failures: Mapped[int | None] = mapped_column(Integer, nullable=True)  # circuit breaker
+    last_failure_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    credential_profile_id: Mapped[int | None] = mapped_column(ForeignKey("credential_profiles.id"), nullable=True, index=True)  # shared credentials instead of the device's own
+
+class CredentialProfile(Base):
+    # One set of credentials shared by many devices (e.g. an AAA account)
+    __tablename__ = "credential_profiles"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(128), unique=True)
+    username_enc: Mapped[str] = mapped_column(Text)
+    password_enc: Mapped[str] = mapped_column(Text)
+    secret_enc: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=tznow)
 
 class Job(Base):
     __tablename__ = "jobs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     triggered_by: Mapped[str] = mapped_column(String(64))  # manual/schedule:Name
-    status: Mapped[str] = mapped_column(String(16), default="running")  # running/success/failed/queued
+    status: Mapped[str] = mapped_column(String(16), default="running", index=True)  # queued/running/success/failed/cancelled
     started_at: Mapped[datetime] = mapped_column(DateTime, default=tznow)
     finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     devices: Mapped[int] = mapped_column(Integer, default=0)
     log: Mapped[str | None] = mapped_column(Text)
+    # Durable queue (see services/job_controller)
+    payload: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON: {"device_ids": [...], "shared": {device_id: job_id}}
+    requested_by: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    priority: Mapped[int | None] = mapped_column(Integer, default=1, nullable=True)  # lane: 0 interactive, 1 manual, 2 scheduled
+    enqueued_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    attempts: Mapped[int | None] = mapped_column(Integer, default=0, nullable=True)  # claims so far
+    lease_owner: Mapped[str | None] = mapped_column(String(128), nullable=True)  # worker holding the job
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    cancel_requested_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # running job asked to stop
+    # Live progress, updated while the job runs (see services/job_events)
+    devices_total: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    devices_done: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+class JobEvent(Base):
+    __tablename__ = "job_events"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id"), index=True)
+    attempt: Mapped[int] = mapped_column(Integer, default=1)  # claim that wrote it
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=tznow)
+    message: Mapped[str] = mapped_column(Text)  # one log line
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)  # full hex digest
+    path: Mapped[str] = mapped_column(String(512))
+    size: Mapped[int] = mapped_column(Integer)  # uncompressed
+    stored_size: Mapped[int | None] = mapped_column(Integer, nullable=True)  # on disk
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=tznow)
+    # set when the last backup using it let go of it (see config_history.release_blobs)
+    released_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
 
 class Backup(Base):
     __tablename__ = "backups"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"))
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True)
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=tznow)
     size_bytes: Mapped[int] = mapped_column(Integer)
-    hash: Mapped[str] = mapped_column(String(64))
+    hash: Mapped[str] = mapped_column(String(64))  # full sha256 (8 chars on legacy rows)
     status: Mapped[str] = mapped_column(String(16), default="success")
     path: Mapped[str] = mapped_column(String(512))
+    blob_sha256: Mapped[str | None] = mapped_column(ForeignKey("blobs.sha256"), nullable=True, index=True)
+    verified_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # last run that found the content unchanged
+    delta_base_id: Mapped[int | None] = mapped_column(ForeignKey("backups.id"), nullable=True, index=True)  # path is a reverse delta against this backup
+    raw_blob_sha256: Mapped[str | None] = mapped_column(ForeignKey("blobs.sha256"), nullable=True, index=True)  # output before normalization (BACKUP_STORE_RAW)
+
+class FetchSample(Base):
+    # Durations of one successful collection run (adaptive timeouts)
+    __tablename__ = "fetch_samples"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=tznow)
+    connect_s: Mapped[float | None] = mapped_column(Float, nullable=True)  # None when a pooled session was reused
+    auth_s: Mapped[float | None] = mapped_column(Float, nullable=True)  # None when the transport logs in as part of connect
+    transfer_s: Mapped[float | None] = mapped_column(Float, nullable=True)  # None when the full pull was skipped
+    size_bytes: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+class FetchDiagnostic(Base):
+    # Session log of a fetch that failed (see services/session_trace)
+    __tablename__ = "fetch_diagnostics"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int | None] = mapped_column(ForeignKey("jobs.id"), nullable=True, index=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"), index=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=tznow)
+    error: Mapped[str] = mapped_column(String(512))
+    session_log: Mapped[str] = mapped_column(Text)
+
+class JobResult(Base):
+    # Outcome of one device in one job (see services/collector)
+    __tablename__ = "job_results"
+    __table_args__ = (
+        Index("ix_job_results_device_finished", "device_id", "finished_at"),  # per-device history
+        Index("ix_job_results_status_finished", "status", "finished_at"),  # failure reports
+        Index("ux_job_results_job_device", "job_id", "device_id", unique=True),  # one row per job and device
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id"), index=True)
+    device_id: Mapped[int] = mapped_column(ForeignKey("devices.id"))
+    finished_at: Mapped[datetime] = mapped_column(DateTime, default=tznow)
+    status: Mapped[str] = mapped_column(String(16))  # success/unchanged/failed/skipped/cancelled
+    error_class: Mapped[str | None] = mapped_column(String(32), nullable=True)  # see circuit_breaker.error_class
+    error: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    connect_s: Mapped[float | None] = mapped_column(Float, nullable=True)
+    auth_s: Mapped[float | None] = mapped_column(Float, nullable=True)
+    transfer_s: Mapped[float | None] = mapped_column(Float, nullable=True)
+    size_bytes: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    backup_id: Mapped[int | None] = mapped_column(ForeignKey("backups.id"), nullable=True)  # new or verified backup
+    shared_from_job_id: Mapped[int | None] = mapped_column(ForeignKey("jobs.id"), nullable=True)  # copied from the job that fetched it
 
 class Schedule(Base):
     __tablename__ = "schedules"
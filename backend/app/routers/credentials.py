@@ -0,0 +1,84 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import CredentialProfile, Device
+from ..schemas import CredentialProfileIn, CredentialProfileOut
+from ..security import get_current_user, require_admin
+from ..services.audit_log import audit_event
+from ..utils.crypto import enc
+
+router = APIRouter(prefix="/credentials", tags=["credentials"])
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _out(db: Session, p: CredentialProfile) -> CredentialProfileOut:
+    devices = db.query(func.count(Device.id)).filter(Device.credential_profile_id == p.id).scalar()
+    return CredentialProfileOut(
+        id=p.id, name=p.name, has_secret=bool(p.secret_enc), devices=devices or 0, created_at=p.created_at,
+    )
+
+
+@router.get("", response_model=list[CredentialProfileOut])
+def list_profiles(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """Shared credential profiles (names only, never the credentials)."""
+    return [_out(db, p) for p in db.query(CredentialProfile).order_by(CredentialProfile.name).all()]
+
+
+@router.post("", response_model=CredentialProfileOut)
+def create_profile(payload: CredentialProfileIn, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    if not (payload.username and payload.password):
+        raise HTTPException(status_code=422, detail="username and password are required")
+    if db.query(CredentialProfile).filter_by(name=payload.name).first():
+        raise HTTPException(status_code=400, detail="name exists")
+    p = CredentialProfile(
+        name=payload.name, username_enc=enc(payload.username), password_enc=enc(payload.password),
+        secret_enc=enc(payload.secret) if payload.secret else None,
+    )
+    db.add(p)
+    db.commit()
+    db.refresh(p)
+    audit_event(user=current_user.username, action="credential_profile_create", target=p.name, result="success")
+    return _out(db, p)
+
+
+@router.put("/{profile_id}", response_model=CredentialProfileOut)
+def update_profile(profile_id: int, payload: CredentialProfileIn, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    """Rotate a shared account: every device using the profile picks it up on its next session."""
+    p = db.get(CredentialProfile, profile_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="not found")
+    if payload.name != p.name and db.query(CredentialProfile).filter_by(name=payload.name).first():
+        raise HTTPException(status_code=400, detail="name exists")
+    p.name = payload.name
+    if payload.username:
+        p.username_enc = enc(payload.username)
+    if payload.password:
+        p.password_enc = enc(payload.password)
+    p.secret_enc = enc(payload.secret) if payload.secret else None
+    db.commit()
+    db.refresh(p)
+    audit_event(user=current_user.username, action="credential_profile_update", target=p.name, result="success")
+    return _out(db, p)
+
+
+@router.delete("/{profile_id}")
+def delete_profile(profile_id: int, db: Session = Depends(get_db), current_user=Depends(require_admin)):
+    p = db.get(CredentialProfile, profile_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="not found")
+    in_use = db.query(Device).filter(Device.credential_profile_id == p.id).count()
+    if in_use:
+        raise HTTPException(status_code=409, detail=f"profile is used by {in_use} device(s)")
+    name = p.name
+    db.delete(p)
+    db.commit()
+    audit_event(user=current_user.username, action="credential_profile_delete", target=name, result="success")
+    return {"deleted": True}
@@ -9,11 +9,13 @@ class DeviceIn(BaseModel):
     vendor: str
     protocol: str = "SSH"
     port: int = 22
-    username: str
-    password: str
+    username: str = ""  # may stay empty with a credential profile
+    password: str = ""
     secret: Optional[str] = None
     tags: Optional[str] = None
     enabled: Optional[bool] = None
+    transport: Optional[str] = None  # netmiko/asyncssh, None = global default
+    credential_profile_id: Optional[int] = None  # shared credentials, overrides the fields above
 
 
 class DeviceOut(BaseModel):
@@ -25,6 +27,13 @@ class DeviceOut(BaseModel):
     port: int
     tags: Optional[str] = None
     enabled: bool = True
+    transport: Optional[str] = None
+    credential_profile_id: Optional[int] = None
+    # circuit breaker (see services/circuit_breaker)
+    breaker_state: str = "closed"
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    retry_at: Optional[datetime] = None
 
 
 class TestResult(BaseModel):
@@ -32,6 +41,33 @@ class TestResult(BaseModel):
     message: str
 
 
+class ManualRunIn(BaseModel):
+    device_ids: Optional[list[int]] = None  # back up just these, in the interactive lane
+
+
+class BulkTestIn(BaseModel):
+    device_ids: Optional[list[int]] = None
+    tags: Optional[str] = None  # comma-separated, any match
+    refresh: bool = False  # ignore cached results
+
+
+# --- Credential profiles ---
+class CredentialProfileIn(BaseModel):
+    name: str
+    # username/password are required on create; empty on update keeps the stored value
+    username: Optional[str] = None
+    password: Optional[str] = None
+    secret: Optional[str] = None
+
+
+class CredentialProfileOut(BaseModel):
+    id: int
+    name: str
+    has_secret: bool
+    devices: int
+    created_at: datetime
+
+
 # --- Users ---
 class UserCreate(BaseModel):
     username: str
@@ -0,0 +1,86 @@
+"""
+Per-device timeouts learned from fetch history.
+
+Every successful collection records its connect, auth and transfer durations
+and the config size (FetchSample). The next run derives each timeout as the
+p99 of the device's recent samples times ADAPTIVE_TIMEOUT_MARGIN plus a
+fixed slack, between a floor and ADAPTIVE_TIMEOUT_MAX. A small switch that
+always answers in under a second is declared dead after a few seconds, while
+a core router whose config takes two minutes to print is not cut off at 60.
+
+Devices with fewer than ADAPTIVE_TIMEOUT_MIN_SAMPLES samples keep the
+transport defaults.
+"""
+import math
+
+from sqlalchemy.orm import Session
+
+from ..models import FetchSample
+from ..settings import settings
+from .netmiko_worker import FetchTiming, Timeouts
+
+# (slack, floor) in seconds per phase
+_CONNECT = (2.0, 3.0)
+_AUTH = (3.0, 5.0)
+_TRANSFER = (5.0, 10.0)
+
+
+def p99(values: list[float]) -> float:
+    """Nearest-rank 99th percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(0.99 * len(ordered)) - 1)]
+
+
+def _derive(values: list[float | None], phase: tuple[float, float]) -> float | None:
+    samples = [v for v in values if v is not None]
+    if len(samples) < max(1, settings.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+        return None
+    slack, floor = phase
+    value = p99(samples) * settings.ADAPTIVE_TIMEOUT_MARGIN + slack
+    return round(min(settings.ADAPTIVE_TIMEOUT_MAX, max(floor, value)), 1)
+
+
+def _recent(db: Session, device_id: int) -> list[FetchSample]:
+    return (
+        db.query(FetchSample)
+        .filter(FetchSample.device_id == device_id)
+        .order_by(FetchSample.id.desc())
+        .limit(settings.ADAPTIVE_TIMEOUT_HISTORY)
+        .all()
+    )
+
+
+def timeouts_for(db: Session, device_id: int) -> Timeouts:
+    if not settings.ADAPTIVE_TIMEOUTS:
+        return Timeouts()
+    samples = _recent(db, device_id)
+    return Timeouts(
+        connect=_derive([s.connect_s for s in samples], _CONNECT),
+        auth=_derive([s.auth_s for s in samples], _AUTH),
+        transfer=_derive([s.transfer_s for s in samples], _TRANSFER),
+    )
+
+
+def record(db: Session, device_id: int, timing: FetchTiming, size: int | None):
+    """Add a sample (caller commits) and drop the ones past the history window."""
+    if timing.connect_s is None and timing.auth_s is None and timing.transfer_s is None:
+        return
+    db.add(FetchSample(
+        device_id=device_id,
+        connect_s=timing.connect_s,
+        auth_s=timing.auth_s,
+        transfer_s=timing.transfer_s,
+        size_bytes=size,
+    ))
+    db.flush()
+    keep = (
+        db.query(FetchSample.id)
+        .filter(FetchSample.device_id == device_id)
+        .order_by(FetchSample.id.desc())
+        .offset(max(0, settings.ADAPTIVE_TIMEOUT_HISTORY - 1))
+        .first()
+    )
+    if keep is not None:
+        db.query(FetchSample).filter(
+            FetchSample.device_id == device_id, FetchSample.id < keep[0],
+        ).delete(synchronize_session=False)
@@ -0,0 +1,284 @@
+"""
+On-disk storage of fetched configs.
+
+Configs are stored as content-addressed blobs keyed by their full SHA-256
+(of the uncompressed config), sharded as BACKUP_DIR/objects/ab/cd/<sha256>.cfg,
+plus .gz when BACKUP_COMPRESSION is "gzip". Backup rows reference a blob, so
+identical configs (same device on later runs, or different devices) share one
+file. Readers go through open_config(), which decompresses on the fly and
+also reads older plain files.
+
+The collector streams output chunks into a ConfigWriter: each chunk updates
+a SHA-256 incrementally and goes to a temp file in BACKUP_DIR, which is
+renamed into place only once complete. Peak memory does not depend on config
+size, and a half-written file never appears under its final name.
+
+When the writer is given the device's last blob (base_path), chunks are
+first compared against it instead of written. If the whole output matches,
+nothing is written at all and the result is flagged unchanged; on the first
+difference the matched prefix is copied from the base and writing carries on.
+With keep=False the output is only hashed, and its first PREVIEW_BYTES are
+kept for callers that parse short command output.
+
+make_delta()/apply_delta() implement the line-based delta format used for
+reverse-delta history (see config_history).
+"""
+import gzip
+import os
+import tempfile
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from hashlib import sha256
+from pathlib import Path
+
+from ..settings import settings
+
+
+@dataclass(frozen=True)
+class StoredConfig:
+    path: str
+    sha256: str  # full hex digest
+    size: int  # uncompressed
+    unchanged: bool = False  # identical to base_path, nothing written
+    stored_size: int | None = None  # bytes on disk
+    preview: bytes = b""  # start of the output, keep=False only
+    raw: "StoredConfig | None" = None  # output before normalization, BACKUP_STORE_RAW only
+
+
+CODECS = ("none", "gzip")
+
+
+def _codec() -> str:
+    codec = (settings.BACKUP_COMPRESSION or "none").lower()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown BACKUP_COMPRESSION: {codec}")
+    return codec
+
+
+def blob_path(digest: str, codec: str | None = None) -> Path:
+    suffix = ".cfg.gz" if (codec or _codec()) == "gzip" else ".cfg"
+    return Path(settings.BACKUP_DIR) / "objects" / digest[:2] / digest[2:4] / f"{digest}{suffix}"
+
+
+def find_blob(digest: str) -> Path | None:
+    """Existing blob for digest, whatever codec it was written with."""
+    for codec in CODECS:
+        path = blob_path(digest, codec)
+        if path.exists():
+            return path
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    return str(path).endswith(".gz")
+
+
+def open_config(path: str):
+    """Binary file object yielding the uncompressed config."""
+    if is_compressed(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_config(path: str, chunk_size: int = 1 << 16):
+    """Stream the uncompressed config in chunks (for responses)."""
+    with open_config(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+PREVIEW_BYTES = 4096
+
+
+class ConfigWriter:
+    """Streaming sink for one fetched config. Use commit() or abort() exactly once."""
+
+    def __init__(self, base_path: str | None = None, keep: bool = True):
+        self.size = 0
+        self._hash = sha256()
+        self._keep = keep
+        self._base_path = base_path
+        self._base = open_config(base_path) if keep and base_path and os.path.exists(base_path) else None
+        self._matched = 0
+        self._raw = None
+        self._file = None
+        self._tmp: str | None = None
+        self._codec = _codec()
+        self._preview = bytearray()
+        if keep and self._base is None:
+            self._open_tmp()
+
+    def _open_tmp(self):
+        tmp_dir = Path(settings.BACKUP_DIR)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=tmp_dir, prefix=".tmp-", suffix=".part")
+        self._raw = os.fdopen(fd, "wb")
+        if self._codec == "gzip":
+            # mtime=0 keeps the compressed bytes deterministic
+            self._file = gzip.GzipFile(
+                fileobj=self._raw, mode="wb", compresslevel=settings.BACKUP_COMPRESSION_LEVEL, mtime=0,
+            )
+        else:
+            self._file = self._raw
+
+    def _diverge(self):
+        """Output differs from the base: materialise the matched prefix and keep writing."""
+        self._open_tmp()
+        self._base.seek(0)
+        remaining = self._matched
+        while remaining:
+            block = self._base.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            self._file.write(block)
+            remaining -= len(block)
+        self._base.close()
+        self._base = None
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if not self._keep:
+            if len(self._preview) < PREVIEW_BYTES:
+                self._preview += chunk[:PREVIEW_BYTES - len(self._preview)]
+            return
+        if self._base is not None:
+            if self._base.read(len(chunk)) == chunk:
+                self._matched += len(chunk)
+                return
+            self._diverge()
+        self._file.write(chunk)
+
+    def commit(self) -> StoredConfig:
+        """Flush to disk and atomically move the file to its blob path."""
+        digest = self._hash.hexdigest()
+        if not self._keep:
+            return StoredConfig(path="", sha256=digest, size=self.size, preview=bytes(self._preview))
+        if self._base is not None:
+            if not self._base.read(1):
+                self._base.close()
+                self._base = None
+                return StoredConfig(path=self._base_path, sha256=digest, size=self.size, unchanged=True)
+            self._diverge()
+        try:
+            if self._file is not self._raw:
+                self._file.close()  # writes the gzip trailer
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        finally:
+            self._raw.close()
+        existing = find_blob(digest)
+        if existing is not None:
+            # Same content already stored (e.g. by another device). Touch it so a
+            # released blob is not swept before our backup references it.
+            os.remove(self._tmp)
+            os.utime(existing)
+            fullpath = existing
+        else:
+            fullpath = blob_path(digest, self._codec)
+            fullpath.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp, fullpath)
+        return StoredConfig(path=str(fullpath), sha256=digest, size=self.size, stored_size=fullpath.stat().st_size)
+
+    def abort(self):
+        if self._base is not None:
+            self._base.close()
+        if self._raw is not None:
+            try:
+                self._raw.close()
+            finally:
+                try:
+                    os.remove(self._tmp)
+                except FileNotFoundError:
+                    pass
+
+
+
+def delta_path(digest: str, base_digest: str) -> Path:
+    suffix = ".delta.gz" if _codec() == "gzip" else ".delta"
+    return Path(settings.BACKUP_DIR) / "deltas" / digest[:2] / f"{digest}-{base_digest[:16]}{suffix}"
+
+
+def make_delta(target: bytes, base: bytes) -> bytes:
+    """
+    Line-based delta that rebuilds target from base.
+
+    Ops, one per line: b"C <start> <count>" copies base lines, b"I <nbytes>"
+    is followed by that many literal bytes. The common prefix and suffix are
+    matched directly, so a few changed lines in a large config stay cheap.
+    """
+    old = base.splitlines(keepends=True)
+    new = target.splitlines(keepends=True)
+    head = 0
+    limit = min(len(old), len(new))
+    while head < limit and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+
+    ops = []
+
+    def copy(start, count):
+        if count:
+            ops.append(b"C %d %d\n" % (start, count))
+
+    def insert(lines):
+        data = b"".join(lines)
+        if data:
+            ops.append(b"I %d\n" % len(data) + data)
+
+    copy(0, head)
+    old_mid, new_mid = old[head:len(old) - tail], new[head:len(new) - tail]
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_mid, new_mid).get_opcodes():
+        if tag == "equal":
+            copy(head + i1, i2 - i1)
+        else:
+            insert(new_mid[j1:j2])
+    copy(len(old) - tail, tail)
+    return b"".join(ops)
+
+
+def apply_delta(delta: bytes, base: bytes) -> bytes:
+    old = base.splitlines(keepends=True)
+    out = []
+    pos = 0
+    while pos < len(delta):
+        end = delta.index(b"\n", pos)
+        op = delta[pos:end].split()
+        pos = end + 1
+        if op[0] == b"C":
+            start, count = int(op[1]), int(op[2])
+            out.extend(old[start:start + count])
+        elif op[0] == b"I":
+            n = int(op[1])
+            out.append(delta[pos:pos + n])
+            pos += n
+        else:
+            raise ValueError(f"Bad delta op: {op[0]!r}")
+    return b"".join(out)
+
+
+def write_delta(path: Path, delta: bytes) -> int:
+    """Atomically write a delta file; returns its size on disk."""
+    data = gzip.compress(delta, compresslevel=settings.BACKUP_COMPRESSION_LEVEL, mtime=0) if is_compressed(path) else delta
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    return len(data)
@@ -0,0 +1,86 @@
+"""
+Cheap "has the config changed?" probes.
+
+A probe is a short command whose output carries a marker that moves whenever
+the configuration changes: IOS and NX-OS print the last configuration change
+in the running-config header, ASA has a running-config checksum, and JunOS
+lists commits. The collector runs the probe before the full pull and skips
+the pull when the marker matches the one stored on the device
+(Device.change_token).
+
+Vendors without a probe, a probe that fails, or output the pattern does not
+match (e.g. an older image without the marker) all mean "pull in full".
+"""
+import re
+import threading
+from dataclasses import dataclass
+
+from . import credentials
+from .netmiko_worker import FetchTiming, Timeouts, fetch_running_config_async
+from .session_trace import SessionTrace
+from .vendor_profiles import profile_for
+
+
+@dataclass(frozen=True)
+class ChangeProbe:
+    command: str
+    pattern: re.Pattern  # group 1 is the change marker
+
+
+CHANGE_PROBES = {
+    "cisco_ios": ChangeProbe(
+        "show running-config | include Last configuration change",
+        re.compile(rb"Last configuration change at ([^\r\n]+)"),
+    ),
+    "cisco_nxos": ChangeProbe(
+        "show running-config | include last.done.at",
+        re.compile(rb"last done at:?\s*([^\r\n]+)"),
+    ),
+    "cisco_asa": ChangeProbe(
+        "show checksum",
+        re.compile(rb"Cryptochecksum:\s*([0-9a-fA-F ]+)"),
+    ),
+    "juniper": ChangeProbe(
+        'show system commit | match "^0 "',
+        re.compile(rb"^\s*0\s+(\S[^\r\n]*)", re.MULTILINE),
+    ),
+}
+
+
+def probe_for(vendor: str) -> ChangeProbe | None:
+    return CHANGE_PROBES.get(profile_for(vendor).device_type)
+
+
+def parse_token(probe: ChangeProbe, output: bytes) -> str | None:
+    match = probe.pattern.search(output)
+    if not match:
+        return None
+    return match.group(1).decode(errors="replace").strip()[:256] or None
+
+
+async def read_token(
+    probe: ChangeProbe, device_info: dict, timeouts: Timeouts = Timeouts(), timing: FetchTiming | None = None,
+    session_log: SessionTrace | None = None, cancel: threading.Event | None = None,
+) -> str | None:
+    """
+    Run probe on the device; None when the output has no marker. session_log
+    and cancel work as for fetch_running_config.
+    """
+    creds = credentials.resolve(device_info)
+    result = await fetch_running_config_async(
+        vendor=device_info['vendor'],
+        host=device_info['ip'],
+        username=creds.username,
+        password=creds.password,
+        secret=creds.secret,
+        protocol=device_info['protocol'],
+        port=device_info['port'],
+        transport=device_info.get('transport'),
+        cmd=probe.command,
+        keep_output=False,
+        timeouts=timeouts,
+        timing=timing,
+        session_log=session_log,
+        cancel=cancel,
+    )
+    return parse_token(probe, result.preview)
@@ -0,0 +1,106 @@
+"""
+Retry policy and per-device circuit breaker for the collector.
+
+Transient failures (timeouts, refused or reset connections) are retried up
+to RETRY_ATTEMPTS times with exponential backoff and jitter. Failures that a
+retry cannot fix, such as rejected credentials, are not retried.
+
+After BREAKER_THRESHOLD consecutive failed runs the device's breaker opens:
+runs skip it without connecting until BREAKER_COOLDOWN seconds have passed,
+then a single trial attempt is made (half-open). Success closes the breaker,
+failure keeps it open for another cooldown. The counters live on the Device
+row, so the state survives restarts and is visible in /devices.
+"""
+import random
+import re
+from datetime import datetime, timedelta
+
+from ..models import Device
+from ..settings import settings
+from ..utils.timeutil import tznow
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Errors where trying again right away cannot help
+_PERMANENT = re.compile(
+    r"authentication|login rejected|secret rejected|permission denied|unknown transport|not installed",
+    re.IGNORECASE,
+)
+
+
+def is_transient(error: Exception) -> bool:
+    return not _PERMANENT.search(str(error))
+
+
+# Failure classes for job results, first match wins
+_ERROR_CLASSES = (
+    ("auth", re.compile(r"authentication|login rejected|secret rejected|permission denied", re.IGNORECASE)),
+    ("unreachable", re.compile(r"unreachable|no route to host|name or service not known", re.IGNORECASE)),
+    ("timeout", re.compile(r"timed out|timeout", re.IGNORECASE)),
+    ("refused", re.compile(r"refused", re.IGNORECASE)),
+    ("disconnected", re.compile(r"reset by peer|connection closed|session closed|eof", re.IGNORECASE)),
+    ("unsupported", re.compile(r"unknown transport|not installed|unsupported", re.IGNORECASE)),
+)
+
+
+def error_class(error: str) -> str:
+    """Coarse failure class of an error message, "other" when none fits."""
+    for name, pattern in _ERROR_CLASSES:
+        if pattern.search(error):
+            return name
+    return "other"
+
+
+def backoff(attempt: int) -> float:
+    """Delay before retry number attempt (1-based): base * 2^(attempt-1), capped, with jitter."""
+    delay = min(settings.RETRY_BACKOFF_MAX, settings.RETRY_BACKOFF_BASE * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _naive(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; tznow() is aware
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+
+def retry_at(device: Device) -> datetime | None:
+    if (device.consecutive_failures or 0) < settings.BREAKER_THRESHOLD or device.last_failure_at is None:
+        return None
+    return _naive(device.last_failure_at) + timedelta(seconds=settings.BREAKER_COOLDOWN)
+
+
+def state(device: Device) -> str:
+    if settings.BREAKER_THRESHOLD <= 0:
+        return CLOSED
+    until = retry_at(device)
+    if until is None:
+        return CLOSED
+    return OPEN if _naive(tznow()) < until else HALF_OPEN
+
+
+def record_success(device: Device):
+    device.consecutive_failures = 0
+    device.last_error = None
+
+
+def record_failure(device: Device, error: str):
+    device.consecutive_failures = (device.consecutive_failures or 0) + 1
+    device.last_failure_at = tznow()
+    device.last_error = error[:512]
+
+
+def reset(device: Device):
+    record_success(device)
+    device.last_failure_at = None
+
+
+def describe(device: Device) -> dict:
+    until = retry_at(device) if state(device) == OPEN else None
+    return {
+        "breaker_state": state(device),
+        "consecutive_failures": device.consecutive_failures or 0,
+        "last_error": device.last_error,
+        "last_failure_at": device.last_failure_at,
+        "retry_at": until,
+    }
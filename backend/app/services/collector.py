@@ -0,0 +1,579 @@
+"""
+Shared collection engine for backup jobs.
+
+Both the scheduled job (scheduler.run_scheduled_backup) and the manual job
+(api/jobs.run_manual) hand their device list to run_backup(), which fetches
+many devices at once under three caps:
+
+- a global cap (COLLECTOR_MAX_WORKERS)
+- a per-vendor cap (COLLECTOR_PER_VENDOR_LIMIT)
+- a per-target-host cap (COLLECTOR_PER_HOST_LIMIT), because several
+  console-server ports often share one IP
+
+The caps are shared by every run and device test in the process (see
+shared_limiter()), and slots go out by priority lane: interactive work
+(device tests, backups of picked devices), then manual runs, then scheduled
+sweeps. A sweep holds a slot for one device at a time, so a device of a
+higher lane waits for at most one device session to end, never for the
+sweep. COLLECTOR_RESERVED_SLOTS global slots are kept off limits to
+scheduled runs altogether.
+
+Where the vendor has a change probe (see change_probe), the probe runs first
+and the full pull is skipped when it reports no change since the last backup,
+except every CHANGE_PROBE_FULL_EVERY-th run.
+
+Before any session is opened, a TCP reachability sweep of all devices runs
+(REACHABILITY_PREFLIGHT); devices that do not answer are failed right away.
+Transient fetch errors are retried with backoff, and devices that keep
+failing are skipped by a per-device circuit breaker (see circuit_breaker).
+The session log of a device that still fails is kept as a diagnostic for
+the job (see session_trace).
+
+A job is cancelled through the cancel event given to run_backup(). Devices
+not started yet are skipped. In-flight transfers stop at their next read
+(FetchCancelled). Whatever is still running JOB_CANCEL_GRACE seconds later,
+e.g. a session stuck in login, is abandoned: the run ends, but the session
+keeps its limiter slot until its thread really exits, and it stores
+nothing. A run whose caller gives up on it (worker shutdown) stops its
+sessions the same way.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ..models import Backup, Blob, Device, JobResult
+from ..settings import settings
+from ..utils.timeutil import tznow
+from . import adaptive_timeouts, change_probe, circuit_breaker, config_history, credentials, reachability, session_trace
+from .netmiko_worker import FetchCancelled, FetchTiming, fetch_running_config_async
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, most urgent first
+INTERACTIVE, MANUAL, SCHEDULED = 0, 1, 2
+LANES = {"interactive": INTERACTIVE, "manual": MANUAL, "scheduled": SCHEDULED}
+
+
+class PrioritySemaphore:
+    """
+    Semaphore that wakes waiters lowest priority value first (FIFO within a
+    priority). `reserved` permits are only given to priorities below SCHEDULED.
+    """
+
+    def __init__(self, value: int, reserved: int = 0):
+        self._value = value
+        self.reserved = reserved
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def _free_for(self, priority: int) -> bool:
+        return self._value > (self.reserved if priority >= SCHEDULED else 0)
+
+    def _prune(self):
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)  # cancelled while waiting
+
+    async def acquire(self, priority: int = MANUAL):
+        self._prune()
+        if self._free_for(priority) and (not self._waiters or priority < self._waiters[0][0]):
+            self._value -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # woken and cancelled at once: pass the permit on
+            raise
+
+    def release(self):
+        self._value += 1
+        self._prune()
+        while self._waiters and self._free_for(self._waiters[0][0]):
+            _, _, fut = heapq.heappop(self._waiters)
+            self._value -= 1
+            fut.set_result(None)
+            self._prune()
+
+
+class Slot:
+    """A held DeviceLimiter slot. hold_until() keeps it past the `async with` until a future is done."""
+
+    def __init__(self):
+        self.until: asyncio.Future | None = None
+
+    def hold_until(self, future: asyncio.Future):
+        self.until = future
+
+
+class DeviceLimiter:
+    """Global + per-vendor + per-host concurrency caps for device sessions, served by priority."""
+
+    def __init__(self, max_workers: int, per_vendor: int, per_host: int, reserved: int = 0):
+        self.max_workers = max(1, max_workers)
+        self.per_vendor = per_vendor
+        self.per_host = per_host
+        # scheduled runs always get at least one slot
+        self._global = PrioritySemaphore(self.max_workers, max(0, min(reserved, self.max_workers - 1)))
+        self._vendors: dict[str, PrioritySemaphore] = {}
+        self._hosts: dict[str, PrioritySemaphore] = {}
+
+    def _keyed(self, pool: dict[str, PrioritySemaphore], key: str, limit: int):
+        if limit <= 0:
+            return None
+        sem = pool.get(key)
+        if sem is None:
+            sem = pool[key] = PrioritySemaphore(limit)
+        return sem
+
+    @asynccontextmanager
+    async def slot(self, vendor: str, host: str, priority: int = MANUAL):
+        """
+        Hold one session slot for a device.
+
+        The narrow caps (host, then vendor) are taken before the global one so
+        a device waiting on a busy console server does not sit on a global slot.
+        """
+        sems = [
+            self._keyed(self._hosts, host, self.per_host),
+            self._keyed(self._vendors, vendor, self.per_vendor),
+            self._global,
+        ]
+        acquired = []
+        held = Slot()
+
+        def release(_=None):
+            for sem in reversed(acquired):
+                sem.release()
+
+        try:
+            for sem in sems:
+                if sem is None:
+                    continue
+                await sem.acquire(priority)
+                acquired.append(sem)
+            yield held
+        finally:
+            if held.until is not None and not held.until.done():
+                held.until.add_done_callback(release)  # the session outlives the task
+            else:
+                release()
+
+
+@dataclass
+class DeviceResult:
+    """How one device fared in a run; stored as a job_results row."""
+    device_id: int
+    status: str = "failed"  # success/unchanged/failed/skipped/cancelled
+    error: str | None = None
+    error_class: str | None = None
+    timing: FetchTiming | None = None
+    size_bytes: int | None = None
+    backup_id: int | None = None
+    finished_at: datetime | None = None
+
+    def fail(self, error: str, status: str = "failed", error_class: str | None = None):
+        self.status = status
+        self.error = error
+        self.error_class = error_class or circuit_breaker.error_class(error)
+
+    def row(self, job_id: int) -> dict:
+        timing = self.timing or FetchTiming()
+        return {
+            "job_id": job_id,
+            "device_id": self.device_id,
+            "finished_at": self.finished_at or tznow(),
+            "status": self.status,
+            "error_class": self.error_class,
+            "error": self.error[:512] if self.error else None,
+            "connect_s": timing.connect_s,
+            "auth_s": timing.auth_s,
+            "transfer_s": timing.transfer_s,
+            "size_bytes": self.size_bytes,
+            "backup_id": self.backup_id,
+        }
+
+
+def new_limiter() -> DeviceLimiter:
+    return DeviceLimiter(
+        max_workers=settings.COLLECTOR_MAX_WORKERS,
+        per_vendor=settings.COLLECTOR_PER_VENDOR_LIMIT,
+        per_host=settings.COLLECTOR_PER_HOST_LIMIT,
+        reserved=settings.COLLECTOR_RESERVED_SLOTS,
+    )
+
+
+_shared: tuple[tuple, DeviceLimiter] | None = None
+
+
+def shared_limiter() -> DeviceLimiter:
+    """The limiter all runs and tests on the running event loop share (rebuilt when the caps change)."""
+    global _shared
+    key = (
+        asyncio.get_running_loop(), settings.COLLECTOR_MAX_WORKERS, settings.COLLECTOR_PER_VENDOR_LIMIT,
+        settings.COLLECTOR_PER_HOST_LIMIT, settings.COLLECTOR_RESERVED_SLOTS,
+    )
+    if _shared is None or _shared[0] != key:
+        _shared = (key, new_limiter())
+    return _shared[1]
+
+
+def _last_backup(db: Session, device_id: int) -> Backup | None:
+    return (
+        db.query(Backup)
+        .filter(Backup.device_id == device_id, Backup.status == "success")
+        .order_by(Backup.timestamp.desc(), Backup.id.desc())
+        .first()
+    )
+
+
+async def _compact(db: Session, prev: Backup, new: Backup, hostname: str, log_lines: list[str]) -> str | None:
+    """Rewrite the previous version as a reverse delta against the new one. Returns the blob it released."""
+    try:
+        path = await asyncio.to_thread(
+            config_history.write_reverse_delta, prev.path, prev.hash, new.path, new.hash,
+        )
+        released = config_history.record_delta(db, prev, new, path)
+        db.commit()
+        return released
+    except Exception as e:
+        db.rollback()
+        # the previous version just stays a full blob
+        log_lines.append(f"[{hostname}] History compaction skipped: {str(e)}")
+        return None
+
+
+def _ignore_result(fetch: asyncio.Future):
+    if not fetch.cancelled():
+        fetch.exception()  # retrieved: an abandoned fetch's error is not "never retrieved"
+
+
+async def _held(slot: Slot, session):
+    """Await a device session; if this task is abandoned, the slot stays held until the session ends."""
+    fetch = asyncio.ensure_future(session)
+    try:
+        return await asyncio.shield(fetch)
+    except asyncio.CancelledError:
+        # A thread cannot be interrupted: the session keeps its slot until it ends
+        slot.hold_until(fetch)
+        fetch.add_done_callback(_ignore_result)
+        raise
+
+
+async def _gather_cancellable(tasks: list[asyncio.Task], cancel: threading.Event) -> int:
+    """Wait for tasks; once cancel is set, give them JOB_CANCEL_GRACE seconds, then cancel the rest."""
+    pending = set(tasks)
+    while pending and not cancel.is_set():
+        _, pending = await asyncio.wait(pending, timeout=0.2)
+    if pending:
+        _, pending = await asyncio.wait(pending, timeout=settings.JOB_CANCEL_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    done = [t for t in tasks if not t.cancelled()]
+    await asyncio.gather(*done)  # re-raise errors like a plain gather would
+    return len(pending)
+
+
+async def run_backup(db: Session, device_list: list[dict], log_lines: list[str], job_id: int | None = None,
+                     cancel: threading.Event | None = None,
+                     progress: Callable[[int, int], None] | None = None, priority: int = MANUAL) -> int:
+    """
+    Back up every device in device_list concurrently and record Backup rows.
+
+    device_list holds plain dicts (id, hostname, ip, vendor, protocol, port,
+    transport, and credentials: a CredentialRef decrypted only when the
+    device's session opens, or plain username/password/secret). Progress is
+    appended to log_lines.
+    With a job_id, each device's outcome becomes a job_results row (bulk
+    inserted, JOB_EVENT_BATCH rows at a time) and session logs of failed
+    devices are stored against the job. Setting
+    cancel stops the run (see above). progress is called with the number of
+    devices settled so far and the number of successes after each device.
+    priority is the lane the device sessions queue in (see above).
+    Returns the number of successful backups.
+    """
+    limiter = shared_limiter()
+    if cancel is None:
+        cancel = threading.Event()  # only set when the caller gives up on the run
+    ok = 0
+    released = []
+    skipped = 0
+    aborted = 0
+
+    def cancelled() -> bool:
+        return cancel.is_set()
+
+    def device_failed(device: Device | None, hostname: str, error: str, trace: session_trace.SessionTrace | None = None):
+        if device is None:
+            return
+        circuit_breaker.record_failure(device, error)
+        try:
+            if trace is not None:
+                session_trace.save(db, device.id, error, trace, job_id=job_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            return
+        if circuit_breaker.state(device) == circuit_breaker.OPEN:
+            log_lines.append(
+                f"[{hostname}] Circuit open after {device.consecutive_failures} consecutive failures, "
+                f"next try after {circuit_breaker.retry_at(device):%Y-%m-%d %H:%M}"
+            )
+
+    async def one(device_info: dict, result: DeviceResult):
+        nonlocal ok, skipped, aborted
+        if cancelled():
+            skipped += 1
+            result.status = "cancelled"
+            return
+        hostname = device_info['hostname']
+        target = (device_info['ip'], device_info['port'])
+        if target in unreachable:
+            error = f"Unreachable: {target[0]}:{target[1]} ({unreachable[target].error})"
+            log_lines.append(f"[{hostname}] Backup failed: {error}")
+            device_failed(db.get(Device, device_info['id']), hostname, error)
+            result.fail(error, error_class="unreachable")
+            return
+        attempts = 1 + max(0, settings.RETRY_ATTEMPTS)
+        probe = change_probe.probe_for(device_info['vendor']) if settings.CHANGE_PROBE_ENABLED else None
+        token = None
+        last = device = timeouts = None
+        timing = FetchTiming()
+        trace = session_trace.SessionTrace()
+        result.timing = timing
+        connected = False
+        attempt = 0
+
+        while attempt < attempts:
+            attempt += 1
+            try:
+                async with limiter.slot(device_info['vendor'], device_info['ip'], priority) as slot:
+                    if cancelled():
+                        if attempt == 1:
+                            skipped += 1
+                        else:
+                            aborted += 1
+                        result.status = "cancelled"
+                        return
+                    if attempt == 1:
+                        # Read once the slot is ours: a device may wait hours for it
+                        last = _last_backup(db, device_info['id'])
+                        device = db.get(Device, device_info['id'])
+                        breaker = circuit_breaker.state(device) if device is not None else circuit_breaker.CLOSED
+                        if breaker == circuit_breaker.OPEN:
+                            log_lines.append(
+                                f"[{hostname}] Skipped: circuit open after {device.consecutive_failures} consecutive "
+                                f"failures, next try after {circuit_breaker.retry_at(device):%Y-%m-%d %H:%M} "
+                                f"(last error: {device.last_error})"
+                            )
+                            result.fail(device.last_error or "circuit open", status="skipped", error_class="circuit_open")
+                            return
+                        if breaker == circuit_breaker.HALF_OPEN:
+                            attempts = 1  # a single trial attempt
+                        timeouts = adaptive_timeouts.timeouts_for(db, device_info['id'])
+                    trace.note(f"attempt {attempt}/{attempts}")
+                    connected = True
+                    log_lines.append(f"[{hostname}] Connecting to {device_info['ip']}...")
+                    creds = credentials.resolve(device_info)
+                    trace.mask(creds.password, creds.secret)
+                    if probe is not None and device is not None and attempt == 1:
+                        try:
+                            token = await _held(slot, change_probe.read_token(
+                                probe, device_info, timeouts, timing, session_log=trace, cancel=cancel,
+                            ))
+                        except FetchCancelled:
+                            raise
+                        except Exception as e:
+                            log_lines.append(f"[{hostname}] Change probe failed, pulling full config: {str(e)}")
+                        skips = device.probe_skips or 0
+                        if (
+                            last is not None and token is not None and token == device.change_token
+                            and skips + 1 < settings.CHANGE_PROBE_FULL_EVERY
+                        ):
+                            device.probe_skips = skips + 1
+                            last.verified_at = tznow()
+                            circuit_breaker.record_success(device)
+                            # the probe's own transfer says nothing about the config's
+                            timing.transfer_s = None
+                            try:
+                                adaptive_timeouts.record(db, device_info['id'], timing, None)
+                                db.commit()
+                            except Exception as e:
+                                db.rollback()
+                                log_lines.append(f"[{hostname}] Backup failed: {str(e)}")
+                                result.fail(str(e))
+                                return
+                            ok += 1
+                            result.status = "unchanged"
+                            result.backup_id = last.id
+                            result.size_bytes = last.size_bytes
+                            log_lines.append(f"[{hostname}] Backup unchanged since {last.timestamp.isoformat()} (change probe: {token})")
+                            return
+                    stored = await _held(slot, fetch_running_config_async(
+                        vendor=device_info['vendor'],
+                        host=device_info['ip'],
+                        username=creds.username,
+                        password=creds.password,
+                        secret=creds.secret,
+                        protocol=device_info['protocol'],
+                        port=device_info['port'],
+                        transport=device_info.get('transport'),
+                        base_path=last.path if last else None,
+                        timeouts=timeouts,
+                        timing=timing,
+                        session_log=trace,
+                        cancel=cancel,
+                    ))
+                break
+            except asyncio.CancelledError:
+                # abandoned after JOB_CANCEL_GRACE, possibly still waiting for a slot
+                if connected:
+                    aborted += 1
+                else:
+                    skipped += 1
+                result.status = "cancelled"
+                raise
+            except FetchCancelled:
+                # not the device's fault: no breaker failure, no diagnostic
+                aborted += 1
+                log_lines.append(f"[{hostname}] Cancelled during transfer")
+                result.status = "cancelled"
+                return
+            except Exception as e:
+                if cancelled():
+                    aborted += 1
+                    log_lines.append(f"[{hostname}] Cancelled: {str(e)}")
+                    result.status = "cancelled"
+                    return
+                if attempt < attempts and circuit_breaker.is_transient(e):
+                    # Back off outside the limiter slot so other devices can use it
+                    delay = circuit_breaker.backoff(attempt)
+                    log_lines.append(f"[{hostname}] Attempt {attempt}/{attempts} failed, retrying in {delay:.1f}s: {str(e)}")
+                    await asyncio.sleep(delay)
+                    continue
+                log_lines.append(f"[{hostname}] Backup failed: {str(e)}")
+                device_failed(device, hostname, str(e), trace)
+                result.fail(str(e))
+                return
+
+        # DB writes happen on the event loop thread, one device at a time
+        result.size_bytes = stored.size
+        try:
+            adaptive_timeouts.record(db, device_info['id'], timing, stored.size)
+            if device is not None:
+                circuit_breaker.record_success(device)
+                if probe is not None:
+                    device.change_token = token
+                    device.probe_skips = 0
+            if stored.unchanged and last:
+                # Same content as the last backup: no new file, no new row
+                last.verified_at = tznow()
+                db.commit()
+                ok += 1
+                result.status = "unchanged"
+                result.backup_id = last.id
+                log_lines.append(f"[{hostname}] Backup unchanged since {last.timestamp.isoformat()} ({stored.size} bytes)")
+                return
+            for blob in (stored, stored.raw):
+                if blob is None:
+                    continue
+                row = db.get(Blob, blob.sha256)
+                if row is None:
+                    db.add(Blob(sha256=blob.sha256, path=blob.path, size=blob.size, stored_size=blob.stored_size))
+                else:
+                    row.released_at = None  # in use again
+            b = Backup(
+                device_id=device_info['id'],
+                size_bytes=stored.size,
+                hash=stored.sha256,
+                path=stored.path,
+                blob_sha256=stored.sha256,
+                raw_blob_sha256=stored.raw.sha256 if stored.raw else None,
+            )
+            db.add(b)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            log_lines.append(f"[{hostname}] Backup failed: {str(e)}")
+            result.fail(str(e))
+            return
+        ok += 1
+        result.status = "success"
+        result.backup_id = b.id
+        log_lines.append(f"[{hostname}] Backup success ({stored.size} bytes, path={stored.path})")
+        if last is not None and config_history.enabled() and config_history.can_compact(db, last):
+            digest = await _compact(db, last, b, hostname, log_lines)
+            if digest:
+                released.append(digest)
+
+    unreachable = {}
+    if settings.REACHABILITY_PREFLIGHT and device_list:
+        results = await reachability.sweep((d['ip'], d['port']) for d in device_list)
+        unreachable = {target: r for target, r in results.items() if not r.reachable}
+        log_lines.append(f"Pre-flight: {len(results) - len(unreachable)}/{len(results)} targets reachable")
+
+    done = 0
+    device_results: list[DeviceResult] = []
+
+    def write_results():
+        rows = [r.row(job_id) for r in device_results]
+        device_results.clear()
+        if job_id is None or not rows:
+            return
+        try:
+            # one executemany per batch (Core insert: the ORM would split rows by which values are None)
+            db.execute(insert(JobResult.__table__), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"job#{job_id}: could not record {len(rows)} device result(s): {e}")
+
+    async def tracked(device_info: dict):
+        nonlocal done
+        result = DeviceResult(device_info['id'])
+        try:
+            await one(device_info, result)
+        finally:
+            result.finished_at = tznow()
+            device_results.append(result)
+        done += 1
+        if progress is not None:
+            progress(done, ok)
+        if len(device_results) >= settings.JOB_EVENT_BATCH:
+            write_results()
+
+    tasks = [asyncio.ensure_future(tracked(d)) for d in device_list]
+    try:
+        abandoned = await _gather_cancellable(tasks, cancel)
+    except asyncio.CancelledError:
+        # The caller gave up on the run: transfers stop at their next read, nothing more starts
+        cancel.set()
+        for task in tasks:
+            task.cancel()
+        raise
+    if abandoned:
+        db.rollback()
+    if cancelled():
+        log_lines.append(
+            f"Cancelled: {skipped} device(s) not started, {aborted} in-flight session(s) aborted"
+        )
+    write_results()
+    try:
+        if released:
+            config_history.release_blobs(db, released)
+        config_history.sweep_released_blobs(db)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Could not drop unused blobs: {e}")
+    return ok
@@ -0,0 +1,221 @@
+"""
+Reverse-delta config history (BACKUP_STORAGE_MODE = "delta").
+
+The latest backup of a device is always a full blob. When a newer, different
+config is stored, the previous version is rewritten as a delta against its
+successor (Backup.delta_base_id), and its full blob is released unless another
+backup still uses it (deleted after BACKUP_BLOB_GRACE, see release_blobs). Older versions are rebuilt on demand by walking forward
+to the nearest full version and applying deltas back.
+
+BACKUP_DELTA_MAX_CHAIN bounds how many deltas one rebuild applies: when
+compacting would make a chain longer, the previous version stays full and
+starts a new chain. Rebuilt versions are kept in a small LRU cache keyed by
+content hash, so browsing neighbouring versions does not replay the chain.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from hashlib import sha256
+
+from sqlalchemy.orm import Session
+
+from ..models import Backup, Blob
+from ..settings import settings
+from ..utils.timeutil import tznow
+from .backup_store import ConfigWriter, apply_delta, delta_path, make_delta, open_config, write_delta
+
+logger = logging.getLogger(__name__)
+
+
+class RebuildCache:
+    """LRU of rebuilt config contents keyed by sha256."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> bytes | None:
+        with self._lock:
+            content = self._entries.get(digest)
+            if content is not None:
+                self._entries.move_to_end(digest)
+            return content
+
+    def put(self, digest: str, content: bytes):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = content
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+rebuild_cache = RebuildCache(settings.BACKUP_REBUILD_CACHE_SIZE)
+
+
+def enabled() -> bool:
+    return settings.BACKUP_STORAGE_MODE == "delta"
+
+
+def _read(path: str) -> bytes:
+    with open_config(path) as f:
+        return f.read()
+
+
+def chain_length(db: Session, backup: Backup) -> int:
+    """Number of deltas that are rebuilt through backup."""
+    n = 0
+    cur = backup
+    while True:
+        cur = db.query(Backup).filter(Backup.delta_base_id == cur.id).first()
+        if cur is None:
+            return n
+        n += 1
+
+
+def can_compact(db: Session, prev: Backup) -> bool:
+    """prev is a full, content-addressed version whose chain may grow by one."""
+    if prev.delta_base_id is not None or not prev.blob_sha256 or len(prev.hash) != 64:
+        return False
+    return chain_length(db, prev) + 1 <= settings.BACKUP_DELTA_MAX_CHAIN
+
+
+def write_reverse_delta(prev_path: str, prev_hash: str, new_path: str, new_hash: str) -> str:
+    """Encode the previous version against its successor. File I/O only, safe off the event loop."""
+    path = delta_path(prev_hash, new_hash)
+    write_delta(path, make_delta(_read(prev_path), _read(new_path)))
+    return str(path)
+
+
+def record_delta(db: Session, prev: Backup, new: Backup, path: str) -> str:
+    """Point prev at its delta. Returns the blob it no longer uses (see release_blobs)."""
+    blob_sha = prev.blob_sha256
+    prev.path = path
+    prev.delta_base_id = new.id
+    prev.blob_sha256 = None
+    return blob_sha
+
+
+def _referenced(db: Session, digest: str) -> bool:
+    return db.query(Backup.id).filter((Backup.blob_sha256 == digest) | (Backup.raw_blob_sha256 == digest)).first() is not None
+
+
+def release_blobs(db: Session, digests) -> int:
+    """
+    Mark blobs no backup references any more for deletion; nothing is removed here.
+
+    Another job, or another worker sharing BACKUP_DIR, may just have been
+    handed the same blob by ConfigWriter.commit() and not yet recorded its
+    backup. sweep_released_blobs() deletes them once BACKUP_BLOB_GRACE has passed.
+    """
+    released = 0
+    for digest in set(digests):
+        blob = db.get(Blob, digest)
+        if blob is not None and blob.released_at is None and not _referenced(db, digest):
+            blob.released_at = tznow()
+            released += 1
+    db.commit()
+    return released
+
+
+def sweep_released_blobs(db: Session) -> int:
+    """
+    Delete blobs released more than BACKUP_BLOB_GRACE seconds ago, rows and files.
+
+    A blob referenced again in the meantime is kept. So is one whose file was
+    reused (ConfigWriter.commit() touches it) within the grace period, as its
+    backup may not be committed yet.
+    """
+    cutoff = tznow() - timedelta(seconds=settings.BACKUP_BLOB_GRACE)
+    paths = []
+    for blob in db.query(Blob).filter(Blob.released_at.isnot(None), Blob.released_at <= cutoff).all():
+        if _referenced(db, blob.sha256):
+            blob.released_at = None
+            continue
+        try:
+            if os.path.getmtime(blob.path) > cutoff.timestamp():
+                continue
+        except FileNotFoundError:
+            pass
+        paths.append(blob.path)
+        db.delete(blob)
+    db.commit()
+    remove_files(paths)
+    return len(paths)
+
+
+def read_config(db: Session, backup: Backup) -> bytes:
+    """Full content of a backup, rebuilding it from deltas if needed."""
+    if backup.delta_base_id is None:
+        return _read(backup.path)
+    content = rebuild_cache.get(backup.hash)
+    if content is not None:
+        return content
+
+    chain = []
+    cur = backup
+    while cur.delta_base_id is not None:
+        content = rebuild_cache.get(cur.hash)
+        if content is not None:
+            break
+        chain.append(cur)
+        cur = db.get(Backup, cur.delta_base_id)
+        if cur is None:
+            raise Exception(f"Broken delta chain for backup {backup.id}")
+    if content is None:
+        content = _read(cur.path)
+
+    for row in reversed(chain):
+        content = apply_delta(_read(row.path), content)
+        if sha256(content).hexdigest() != row.hash:
+            raise Exception(f"Rebuilt backup {row.id} does not match its hash")
+    rebuild_cache.put(backup.hash, content)
+    return content
+
+
+def materialize_dependents(db: Session, backup: Backup) -> list[str]:
+    """
+    Before backup is deleted, store the versions rebuilt through it in full
+    again. Returns delta files that are no longer referenced (remove after commit).
+    """
+    stale = []
+    for dep in db.query(Backup).filter(Backup.delta_base_id == backup.id).all():
+        content = read_config(db, dep)
+        writer = ConfigWriter()
+        try:
+            writer.write(content)
+            stored = writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        if db.get(Blob, stored.sha256) is None:
+            db.add(Blob(sha256=stored.sha256, path=stored.path, size=stored.size, stored_size=stored.stored_size))
+        old_path = dep.path
+        dep.path = stored.path
+        dep.blob_sha256 = stored.sha256
+        dep.delta_base_id = None
+        db.flush()
+        if db.query(Backup).filter(Backup.path == old_path).first() is None:
+            stale.append(old_path)
+    return stale
+
+
+def remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
@@ -0,0 +1,100 @@
+"""
+Device credentials, decrypted when a session opens.
+
+Job paths put a CredentialRef in each device dict: the Fernet ciphertexts
+of the device's own credentials, or of its shared CredentialProfile. Nothing
+is decrypted up front. resolve() decrypts right before the connection, so
+plaintext only exists while a device is being worked on.
+
+Decrypted credentials are cached for CREDENTIAL_CACHE_TTL seconds (up to
+CREDENTIAL_CACHE_SIZE entries; a TTL of 0 turns the cache off). The cache
+key is the ciphertext itself, so devices sharing a profile decrypt once,
+and a rotated password (new ciphertext) never hits a stale entry.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy.orm import Session
+
+from ..models import CredentialProfile, Device
+from ..settings import settings
+from ..utils.crypto import dec
+
+
+@dataclass(frozen=True)
+class Credentials:
+    username: str
+    password: str
+    secret: str | None
+
+
+@dataclass(frozen=True)
+class CredentialRef:
+    """Encrypted credentials of a device, resolved on demand."""
+    username_enc: str
+    password_enc: str
+    secret_enc: str | None
+    profile_id: int | None = None
+
+    def __repr__(self) -> str:
+        return f"CredentialRef(profile_id={self.profile_id})"
+
+
+class CredentialCache:
+    """Bounded TTL cache of decrypted credentials, safe across collector threads."""
+
+    def __init__(self):
+        self._entries: OrderedDict[CredentialRef, tuple[float, Credentials]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ref: CredentialRef) -> Credentials:
+        ttl = settings.CREDENTIAL_CACHE_TTL
+        now = time.monotonic()
+        if ttl > 0:
+            with self._lock:
+                entry = self._entries.get(ref)
+                if entry is not None and now - entry[0] < ttl:
+                    self._entries.move_to_end(ref)
+                    self.hits += 1
+                    return entry[1]
+        creds = Credentials(
+            username=dec(ref.username_enc),
+            password=dec(ref.password_enc),
+            secret=dec(ref.secret_enc) if ref.secret_enc else None,
+        )
+        with self._lock:
+            self.misses += 1
+            if ttl > 0:
+                self._entries[ref] = (now, creds)
+                self._entries.move_to_end(ref)
+                while len(self._entries) > max(1, settings.CREDENTIAL_CACHE_SIZE):
+                    self._entries.popitem(last=False)
+        return creds
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = CredentialCache()
+
+
+def ref(db: Session, device: Device) -> CredentialRef:
+    """The device's credentials as stored: its profile's when it has one."""
+    if device.credential_profile_id is not None:
+        profile = db.get(CredentialProfile, device.credential_profile_id)
+        if profile is not None:
+            return CredentialRef(profile.username_enc, profile.password_enc, profile.secret_enc, profile.id)
+    return CredentialRef(device.username_enc, device.password_enc, device.secret_enc)
+
+
+def resolve(device_info: dict) -> Credentials:
+    """Plaintext credentials for a device dict (a CredentialRef, or plain username/password/secret)."""
+    credentials = device_info.get('credentials')
+    if credentials is None:
+        return Credentials(device_info['username'], device_info['password'], device_info.get('secret'))
+    return cache.get(credentials)
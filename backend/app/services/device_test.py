@@ -0,0 +1,127 @@
+"""
+Bulk device tests.
+
+A device test logs in and runs `show version`, the same as
+POST /devices/{id}/test. test_many() runs many of them at once under the
+collector's DeviceLimiter caps, in the interactive lane (ahead of running
+jobs), and yields each result as soon as it is known, so the API can stream
+results back while the rest are still running.
+
+Devices whose ip:port does not answer the reachability sweep fail right
+away without a login attempt. Results are kept for DEVICE_TEST_CACHE_TTL
+seconds, so a repeated request (or a reloaded page) answers from the cache
+instead of logging in to every device again.
+"""
+import asyncio
+import time
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator
+
+from ..settings import settings
+from . import credentials, reachability
+from .collector import INTERACTIVE, shared_limiter
+from .netmiko_worker import Timeouts, fetch_running_config_async
+
+
+@dataclass(frozen=True)
+class DeviceTestResult:
+    device_id: int
+    hostname: str
+    success: bool
+    message: str
+    duration_ms: float
+    tested_at: float  # time.time()
+    cached: bool = False
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+_cache: dict[int, DeviceTestResult] = {}
+
+
+def cached(device_id: int) -> DeviceTestResult | None:
+    result = _cache.get(device_id)
+    if result is None or time.time() - result.tested_at > settings.DEVICE_TEST_CACHE_TTL:
+        return None
+    return result
+
+
+def recent() -> list[DeviceTestResult]:
+    """All results still inside DEVICE_TEST_CACHE_TTL, newest first."""
+    results = [r for r in (cached(device_id) for device_id in list(_cache)) if r is not None]
+    return sorted(results, key=lambda r: r.tested_at, reverse=True)
+
+
+def clear_cache():
+    _cache.clear()
+
+
+async def test_one(device_info: dict, timeouts: Timeouts = Timeouts(), limiter=None,
+                   unreachable: str | None = None) -> DeviceTestResult:
+    started = time.monotonic()
+    try:
+        if unreachable:
+            raise Exception(f"Unreachable: {device_info['ip']}:{device_info['port']} ({unreachable})")
+        limiter = limiter or shared_limiter()
+        async with limiter.slot(device_info['vendor'], device_info['ip'], INTERACTIVE):
+            creds = credentials.resolve(device_info)
+            await fetch_running_config_async(
+                vendor=device_info['vendor'], host=device_info['ip'],
+                username=creds.username, password=creds.password,
+                secret=creds.secret, protocol=device_info['protocol'],
+                port=device_info['port'], cmd="show version",
+                transport=device_info.get('transport'), keep_output=False,
+                timeouts=timeouts,
+            )
+        success, message = True, "OK"
+    except Exception as e:
+        success, message = False, f"Failed: {e}"
+    result = DeviceTestResult(
+        device_id=device_info['id'],
+        hostname=device_info['hostname'],
+        success=success,
+        message=message,
+        duration_ms=round((time.monotonic() - started) * 1000, 1),
+        tested_at=time.time(),
+    )
+    _cache[result.device_id] = result
+    return result
+
+
+async def test_many(device_list: list[dict], timeouts: dict[int, Timeouts] | None = None,
+                    refresh: bool = False) -> AsyncIterator[DeviceTestResult]:
+    """
+    Test every device in device_list (same dicts as run_backup) and yield
+    results in completion order. Cached results come first unless refresh.
+    If the consumer stops early, tests still waiting for a slot are cancelled.
+    """
+    timeouts = timeouts or {}
+    pending = []
+    for d in device_list:
+        hit = None if refresh else cached(d['id'])
+        if hit is not None:
+            yield DeviceTestResult(**{**hit.as_dict(), "cached": True})
+        else:
+            pending.append(d)
+    if not pending:
+        return
+
+    unreachable = {}
+    if settings.REACHABILITY_PREFLIGHT:
+        results = await reachability.sweep(((d['ip'], d['port']) for d in pending), refresh=refresh)
+        unreachable = {target: r.error for target, r in results.items() if not r.reachable}
+
+    limiter = shared_limiter()
+    tasks = [
+        asyncio.ensure_future(test_one(
+            d, timeouts.get(d['id'], Timeouts()), limiter, unreachable.get((d['ip'], d['port'])),
+        ))
+        for d in pending
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,20 +1,592 @@
+"""
+Durable backup job queue, kept in the jobs table.
+
+A job is enqueued as a row with status "queued" and a JSON payload holding
+the device ids to back up, so nothing exists only in process memory. The
+worker (one per process, started with the app) claims the oldest queued
+job with a conditional UPDATE. Only one claimer can move a row out of
+"queued", so several app processes can share the table.
+
+Jobs are claimed by priority lane, then oldest first: interactive (a
+backup of picked devices), manual, scheduled. A worker runs up to
+JOB_CONCURRENCY jobs at once, of which at most JOB_BULK_CONCURRENCY
+scheduled ones. One place is kept for interactive jobs, so a manual
+all-device run beside a nightly sweep never holds every place: urgent work
+is claimed within seconds of being queued. Inside the collector its
+devices also go ahead of the sweep's for session slots (see collector).
+
+A claimed job is "running" under a lease of JOB_LEASE_SECONDS, held by its
+worker (lease_owner) and renewed every JOB_HEARTBEAT_SECONDS while the job
+runs. If the process dies, the heartbeats stop and the lease runs out.
+reclaim_expired() runs at every poll and puts such a job back in the queue,
+up to JOB_MAX_ATTEMPTS claims, then fails it. Legacy "running" rows without
+a lease fail the same way. On a clean shutdown the worker hands its job
+back right away. A job run again keeps the job_results of the devices its
+earlier attempt finished and only runs the rest, so each device has one
+result row per job.
+
+cancel() ends a queued job at once. For a running job it sets
+cancel_requested_at. In this process it also trips the job's cancel event.
+Another process trips it at its next heartbeat, which the request makes
+fail. run_backup() then skips the devices it has not started and aborts
+the in-flight sessions (see collector). The job ends as "cancelled" and
+the worker moves on to the next job.
+
+Enqueueing is single-flight per device: a device that a queued or running
+job of the same or a more urgent lane will fetch (and has not fetched yet)
+is left out of the new job's
+devices and recorded under "shared" in its payload instead. When the new
+job runs it copies that job's result for the device into its own
+job_results (shared_from_job_id), waiting for it while the other job runs.
+If the other job ends without a result for the device, or has not started
+yet, the new job fetches the device itself.
+
+While a job runs its log lines and device counters are written as they
+come (see job_events), so /jobs/{id}/events can follow it and a dead
+worker's log survives.
+
+Queue depth and wait/run times come from the same rows (see stats()).
+"""
 import asyncio
-from typing import Callable, Awaitable
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..models import Device, Job, JobResult
+from ..settings import settings
+from ..utils.timeutil import tznow
+from . import credentials, job_events
+from .audit_log import audit_event
+from .collector import INTERACTIVE, LANES, MANUAL, SCHEDULED, run_backup
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_worker_task: asyncio.Task | None = None
+_wake: asyncio.Event | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+# Cancel events of the jobs running in this process
+_cancels: dict[int, threading.Event] = {}
+
+
+# Legacy rows have no priority: treat them as manual
+_priority = func.coalesce(Job.priority, MANUAL)
+
+
+def lane(job: Job) -> str:
+    priority = MANUAL if job.priority is None else job.priority
+    return next(name for name, p in LANES.items() if p == priority)
+
+
+def _now():
+    # Lease columns hold naive local time (SQLite drops the zone)
+    return tznow().replace(tzinfo=None)
+
+
+def _naive(value):
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo else value
+
+
+def device_info(db: Session, d: Device) -> dict:
+    """The plain dict run_backup works on (no ORM objects in the collector)."""
+    return {
+        'id': d.id,
+        'hostname': d.hostname,
+        'ip': d.ip,
+        'vendor': d.vendor,
+        'protocol': d.protocol,
+        'port': d.port,
+        'credentials': credentials.ref(db, d),  # decrypted when the session opens
+        'transport': d.transport,
+    }
+
+
+def _pending_owners(db: Session, device_ids: list[int], priority: int) -> dict[int, int]:
+    """
+    Devices among device_ids that a queued or running job is still to fetch,
+    with the first such job. Only jobs at least as urgent count: an
+    interactive job must not wait for a sweep to get to its devices.
+    """
+    wanted = set(device_ids)
+    pending = (
+        db.query(Job)
+        .filter(Job.status.in_(("queued", "running")), _priority <= priority)
+        .order_by(Job.id)
+        .all()
+    )
+    running = [j.id for j in pending if j.status == "running"]
+    fetched = {
+        (r.job_id, r.device_id)
+        for r in db.query(JobResult.job_id, JobResult.device_id).filter(JobResult.job_id.in_(running))
+    } if running else set()
+    owners: dict[int, int] = {}
+    for job in pending:
+        for device_id in json.loads(job.payload or "{}").get("device_ids", []):
+            if device_id in wanted and device_id not in owners and (job.id, device_id) not in fetched:
+                owners[device_id] = job.id
+    return owners
+
+
+def enqueue(db: Session, triggered_by: str, device_ids: list[int], requested_by: str = "system",
+            log_lines: list[str] | None = None, priority: int = MANUAL) -> Job:
+    """Persist a backup job in a lane (collector.LANES); the worker picks it up. Commits."""
+    now = _now()
+    log_lines = list(log_lines or [])
+    shared = _pending_owners(db, device_ids, priority) if settings.JOB_COALESCE else {}
+    payload = {"device_ids": [d for d in device_ids if d not in shared]}
+    if shared:
+        payload["shared"] = {str(d): owner for d, owner in shared.items()}
+        owners = ", ".join(f"job#{owner}" for owner in sorted(set(shared.values())))
+        log_lines.append(f"{len(shared)} device(s) already queued or running, sharing the result of {owners}")
+    job = Job(
+        triggered_by=triggered_by,
+        status="queued",
+        requested_by=requested_by,
+        priority=priority,
+        payload=json.dumps(payload),
+        enqueued_at=now,
+        started_at=now,
+        attempts=0,
+        log="\n".join(log_lines) or None,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    wake()
+    return job
+
+
+def claim(db: Session, worker_id: str = WORKER_ID, up_to: int = SCHEDULED) -> Job | None:
+    """
+    Take the most urgent, then oldest, queued job in lanes up to `up_to`
+    (e.g. MANUAL: no scheduled jobs), or None. Safe against concurrent claimers.
+    """
+    while True:
+        query = db.query(Job.id).filter(Job.status == "queued")
+        if up_to < SCHEDULED:
+            query = query.filter(_priority <= up_to)
+        job_id = query.order_by(_priority, Job.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        now = _now()
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(
+                status="running", lease_owner=worker_id, started_at=now, heartbeat_at=now,
+                lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                attempts=Job.attempts + 1,
+            )
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(Job, job_id)
+        # another worker got there first
+
+
+def heartbeat(db: Session, job_id: int, worker_id: str = WORKER_ID) -> bool:
+    """Renew the lease; False when this worker no longer holds the job or it is being cancelled."""
+    now = _now()
+    renewed = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "running", Job.lease_owner == worker_id,
+               Job.cancel_requested_at.is_(None))
+        .values(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS))
+    ).rowcount
+    db.commit()
+    return bool(renewed)
+
 
-_lock = asyncio.Lock()
-_queue: asyncio.Queue[Callable[[], Awaitable[None]]] = asyncio.Queue()
+def reclaim_expired(db: Session) -> int:
+    """Requeue (or fail, after JOB_MAX_ATTEMPTS) running jobs whose lease ran out."""
+    now = _now()
+    stale = (
+        db.query(Job)
+        .filter(Job.status == "running", or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now))
+        .all()
+    )
+    for job in stale:
+        owner = job.lease_owner or "unknown worker"
+        # keep what the dead attempt logged
+        job.log = "\n".join(job_events.current_log(db, job)[0]) or None
+        if job.cancel_requested_at is not None:
+            job.status = "cancelled"
+            job.finished_at = tznow()
+            note = f"Job cancelled ({owner} stopped before it finished)"
+        elif job.payload and (job.attempts or 0) < settings.JOB_MAX_ATTEMPTS:
+            job.status = "queued"
+            note = f"Lease of {owner} expired, job requeued"
+        else:
+            job.status = "failed"
+            job.finished_at = tznow()
+            note = f"Job interrupted ({owner} stopped) and not retried"
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.log = "\n".join(filter(None, [job.log, note]))
+        logger.warning(f"job#{job.id}: {note}")
+    db.commit()
+    return len(stale)
 
-async def submit(job_coro: Callable[[], Awaitable[None]]):
-    await _queue.put(job_coro)
-    asyncio.create_task(_runner())
 
-async def _runner():
-    if _lock.locked(): 
-        return
-    async with _lock:
-        while not _queue.empty():
-            coro = await _queue.get()
+def release(db: Session, worker_id: str = WORKER_ID) -> int:
+    """Hand this worker's running jobs back to the queue (clean shutdown); ones being cancelled end cancelled."""
+    for job in db.query(Job).filter(Job.status == "running", Job.lease_owner == worker_id):
+        job.log = "\n".join(job_events.current_log(db, job)[0]) or None
+    db.flush()
+    db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.lease_owner == worker_id, Job.cancel_requested_at.isnot(None))
+        .values(status="cancelled", finished_at=tznow(), lease_owner=None, lease_expires_at=None)
+    )
+    released = db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.lease_owner == worker_id)
+        .values(status="queued", lease_owner=None, lease_expires_at=None, attempts=Job.attempts - 1)
+    ).rowcount
+    db.commit()
+    return released
+
+
+def cancel(db: Session, job_id: int) -> str | None:
+    """
+    Cancel a queued or running job. Returns "cancelled" (it never started),
+    "cancelling" (the worker is stopping it) or None (not queued or running).
+    """
+    job = db.get(Job, job_id)
+    if job is None:
+        return None
+    if job.status == "queued":
+        done = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="cancelled", finished_at=tznow())
+        ).rowcount
+        db.commit()
+        if done:
+            return "cancelled"
+        db.refresh(job)  # claimed in the meantime
+    if job.status != "running":
+        return None
+    if job.cancel_requested_at is None:
+        job.cancel_requested_at = _now()
+        db.commit()
+    event = _cancels.get(job_id)
+    if event is not None:
+        event.set()
+    return "cancelling"
+
+
+def _finish(db: Session, job_id: int, worker_id: str, status: str, devices: int, log_lines: list[str]) -> bool:
+    """Record the outcome, unless the lease was lost to another worker meanwhile."""
+    if isinstance(log_lines, job_events.JobLog):
+        log_lines.flush()  # streams get every line before the final status
+    done = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.lease_owner == worker_id)
+        .values(status=status, devices=devices, finished_at=tznow(), log="\n".join(log_lines),
+                lease_owner=None, lease_expires_at=None)
+    ).rowcount
+    db.commit()
+    job_events.sweep_ended(db)
+    return bool(done)
+
+
+def _audit(job: Job, result: str):
+    scheduled = job.triggered_by.startswith("schedule:")
+    audit_event(
+        user=job.requested_by or "system",
+        action="job_run_scheduled" if scheduled else "job_run_manual",
+        target=job.triggered_by if scheduled else f"job#{job.id}",
+        result=result,
+    )
+
+
+async def _keep_lease(job_id: int, worker_id: str, cancel_event: threading.Event):
+    while True:
+        await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+        db = database.SessionLocal()
+        try:
+            if not heartbeat(db, job_id, worker_id):
+                # cancel requested from another process, or the job is no longer ours: stop either way
+                logger.warning(f"job#{job_id}: lease not renewed, stopping")
+                cancel_event.set()
+                return
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"job#{job_id}: heartbeat failed: {e}")
+        finally:
+            db.close()
+
+
+async def _share_results(db: Session, job_id: int, shared: dict[int, int], log_lines: job_events.JobLog,
+                         cancel_event: threading.Event, done: int, ok: int, priority: int = MANUAL) -> int:
+    """
+    Copy the other jobs' results for the shared devices, waiting while those
+    jobs are queued or running; fetch only the devices they end without.
+    done/ok are the counts so far, for progress. Returns the successes.
+    """
+    hostnames = dict(db.query(Device.id, Device.hostname).filter(Device.id.in_(list(shared))).all())
+    waiting = dict(shared)
+    refetch: list[int] = []
+    succeeded = 0
+    while waiting and not cancel_event.is_set():
+        owner_ids = set(waiting.values())
+        # statuses first: a job seen running may finish, but its results are read after
+        status = dict(db.query(Job.id, Job.status).filter(Job.id.in_(owner_ids)).all())
+        results = {
+            (r.job_id, r.device_id): r
+            for r in db.query(JobResult).filter(JobResult.job_id.in_(owner_ids), JobResult.device_id.in_(list(waiting)))
+        }
+        for device_id, owner in list(waiting.items()):
+            r = results.get((owner, device_id))
+            if r is not None and r.status != "cancelled":
+                db.add(JobResult(
+                    job_id=job_id, device_id=device_id, finished_at=r.finished_at, status=r.status,
+                    error_class=r.error_class, error=r.error, size_bytes=r.size_bytes, backup_id=r.backup_id,
+                    shared_from_job_id=owner,
+                ))
+                log_lines.append(f"[{hostnames.get(device_id, device_id)}] Shared result of job#{owner}: {r.status}")
+                if r.status in ("success", "unchanged"):
+                    succeeded += 1
+                done += 1
+                del waiting[device_id]
+            elif status.get(owner) not in ("queued", "running"):
+                refetch.append(device_id)
+                del waiting[device_id]
+        db.commit()
+        log_lines.progress(done, ok + succeeded)
+        if waiting:
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+    if refetch and not cancel_event.is_set():
+        log_lines.append(f"Fetching {len(refetch)} device(s) the other job(s) did not back up")
+        devices = db.query(Device).filter(Device.id.in_(refetch)).order_by(Device.id).all()
+        base_ok = ok + succeeded
+        succeeded += await run_backup(
+            db, [device_info(db, d) for d in devices], log_lines, job_id=job_id, cancel=cancel_event,
+            progress=lambda d, o: log_lines.progress(done + d, base_ok + o), priority=priority,
+        )
+    return succeeded
+
+
+def _settled_devices(db: Session, job_id: int) -> dict[int, str]:
+    """
+    Devices an earlier attempt of the job already has a result for, and its
+    status. Their rows are kept and they are not run again; rows of devices
+    that attempt cancelled are dropped so they are.
+    """
+    db.query(JobResult).filter(JobResult.job_id == job_id, JobResult.status == "cancelled").delete(
+        synchronize_session=False
+    )
+    db.commit()
+    return dict(db.query(JobResult.device_id, JobResult.status).filter(JobResult.job_id == job_id).all())
+
+
+async def execute(job_id: int, worker_id: str = WORKER_ID):
+    """Run a claimed job to completion (or cancellation), renewing its lease meanwhile."""
+    db = database.SessionLocal()
+    cancel_event = _cancels[job_id] = threading.Event()
+    lease = asyncio.create_task(_keep_lease(job_id, worker_id, cancel_event))
+    log_lines: list[str] = []
+    flusher = None
+    job = None
+    try:
+        job = db.get(Job, job_id)
+        if job is None:
+            return
+        log_lines = job_events.JobLog(job_id, job.attempts or 1, (job.log or "").splitlines())
+        flusher = asyncio.create_task(log_lines.keep_flushing())
+        payload = json.loads(job.payload or "{}")
+        device_ids = payload.get("device_ids", [])
+        shared = {int(d): owner for d, owner in payload.get("shared", {}).items()}
+        settled = _settled_devices(db, job_id)
+        if settled:
+            device_ids = [d for d in device_ids if d not in settled]
+            shared = {d: owner for d, owner in shared.items() if d not in settled}
+        devices = db.query(Device).filter(Device.id.in_(device_ids)).order_by(Device.id).all() if device_ids else []
+        device_list = [device_info(db, d) for d in devices]
+        total = len(device_list) + len(shared) + len(settled)
+        wait = (_naive(job.started_at) - _naive(job.enqueued_at)).total_seconds() if job.enqueued_at else 0
+        log_lines.append(
+            f"Job started at {job.started_at.isoformat()} (queued {wait:.1f}s, attempt {job.attempts}, {lane(job)} lane)"
+        )
+        prior_ok = sum(1 for status in settled.values() if status in ("success", "unchanged"))
+        if settled:
+            log_lines.append(f"{len(settled)} device(s) already done by an earlier attempt ({prior_ok} successful)")
+        if shared:
+            log_lines.append(f"Processing {len(device_list)} device(s), {len(shared)} shared with other jobs...")
+        else:
+            log_lines.append(f"Processing {len(device_list)} device(s)...")
+        log_lines.start(total)
+        if settled:
+            log_lines.progress(len(settled), prior_ok)
+
+        if job.cancel_requested_at is not None:
+            cancel_event.set()
+        priority = MANUAL if job.priority is None else job.priority
+        ok = prior_ok + await run_backup(
+            db, device_list, log_lines, job_id=job_id, cancel=cancel_event,
+            progress=lambda d, o: log_lines.progress(len(settled) + d, prior_ok + o), priority=priority,
+        )
+        if shared:
+            ok += await _share_results(db, job_id, shared, log_lines, cancel_event, len(settled) + len(device_list),
+                                       ok, priority)
+
+        if cancel_event.is_set():
+            log_lines.append(f"Job cancelled: {ok}/{total} backed up before it stopped")
+            _finish(db, job_id, worker_id, "cancelled", ok, log_lines)
+            _audit(job, f"cancelled ({ok}/{total} devices)")
+            return
+        log_lines.append(f"Job completed: {ok}/{total} successful")
+        _finish(db, job_id, worker_id, "success", ok, log_lines)
+        _audit(job, f"success ({ok}/{total} devices)")
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"job#{job_id} failed")
+        log_lines.append(f"Job failed: {str(e)}")
+        _finish(db, job_id, worker_id, "failed", 0, log_lines)
+        if job is not None:
+            _audit(job, f"failed: {str(e)}")
+    finally:
+        _cancels.pop(job_id, None)
+        lease.cancel()
+        if flusher is not None:
+            flusher.cancel()
+            log_lines.flush()  # interrupted: keep what was logged
+        db.close()
+
+
+async def run_next(worker_id: str = WORKER_ID) -> bool:
+    """Reclaim expired leases, then claim and run one job. False when the queue is empty."""
+    db = database.SessionLocal()
+    try:
+        reclaim_expired(db)
+        job = claim(db, worker_id)
+        job_id = job.id if job else None
+    finally:
+        db.close()
+    if job_id is None:
+        return False
+    await execute(job_id, worker_id)
+    return True
+
+
+def wake():
+    """Nudge the worker instead of waiting for the next poll (callable from any thread)."""
+    if _loop is not None and _wake is not None:
+        _loop.call_soon_threadsafe(_wake.set)
+
+
+def _claim_more(running: dict[asyncio.Task, int]) -> list[tuple[int, int]]:
+    """Claim jobs for the free places: (job id, priority) pairs."""
+    claimed: list[tuple[int, int]] = []
+    db = database.SessionLocal()
+    try:
+        reclaim_expired(db)
+        places = max(1, settings.JOB_CONCURRENCY)
+        while len(running) + len(claimed) < places:
+            priorities = [*running.values(), *(p for _, p in claimed)]
+            if places > 1 and sum(1 for p in priorities if p > INTERACTIVE) >= places - 1:
+                up_to = INTERACTIVE  # the last place is kept for interactive jobs
+            elif sum(1 for p in priorities if p >= SCHEDULED) >= settings.JOB_BULK_CONCURRENCY:
+                up_to = MANUAL
+            else:
+                up_to = SCHEDULED
+            job = claim(db, WORKER_ID, up_to=up_to)
+            if job is None:
+                break
+            claimed.append((job.id, MANUAL if job.priority is None else job.priority))
+    finally:
+        db.close()
+    return claimed
+
+
+async def _worker():
+    logger.info(f"Job worker {WORKER_ID} started")
+    running: dict[asyncio.Task, int] = {}
+    try:
+        while True:
             try:
-                await coro()
-            finally:
-                _queue.task_done()
+                for job_id, priority in _claim_more(running):
+                    running[asyncio.create_task(execute(job_id))] = priority
+            except Exception as e:
+                logger.error(f"Job worker: {e}")
+            # until a job is queued (wake()), one of ours ends, or the next poll
+            woken = asyncio.ensure_future(_wake.wait())
+            await asyncio.wait({woken, *running}, timeout=settings.JOB_POLL_INTERVAL,
+                               return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            _wake.clear()
+            for task in [t for t in running if t.done()]:
+                del running[task]
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+def start():
+    global _worker_task, _wake, _loop
+    if _worker_task is None or _worker_task.done():
+        _loop = asyncio.get_running_loop()
+        _wake = asyncio.Event()
+        _worker_task = _loop.create_task(_worker())
+
+
+async def stop():
+    global _worker_task, _wake, _loop
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = _wake = _loop = None
+    db = database.SessionLocal()
+    try:
+        released = release(db)
+    finally:
+        db.close()
+    if released:
+        logger.info(f"Handed {released} running job(s) back to the queue")
+
+
+def stats(db: Session, recent: int = 100) -> dict:
+    """Queue depth now, and wait/run times of the last `recent` finished jobs."""
+    now = _now()
+    queued = db.query(Job).filter(Job.status == "queued").order_by(Job.id).all()
+    running = db.query(Job).filter(Job.status == "running").all()
+    finished = (
+        db.query(Job)
+        .filter(Job.finished_at.isnot(None), Job.enqueued_at.isnot(None))
+        .order_by(Job.id.desc())
+        .limit(recent)
+        .all()
+    )
+    waits = [(_naive(j.started_at) - _naive(j.enqueued_at)).total_seconds() for j in finished]
+    runs = [(_naive(j.finished_at) - _naive(j.started_at)).total_seconds() for j in finished]
+    return {
+        "queued": len(queued),
+        "running": len(running),
+        "lanes": {
+            name: {
+                "queued": sum(1 for j in queued if lane(j) == name),
+                "running": sum(1 for j in running if lane(j) == name),
+            }
+            for name in LANES
+        },
+        "workers": sorted({j.lease_owner for j in running if j.lease_owner}),
+        "oldest_queued_s": round((now - _naive(queued[0].enqueued_at)).total_seconds(), 1)
+        if queued and queued[0].enqueued_at else None,
+        "recent_jobs": len(finished),
+        "avg_wait_s": round(sum(waits) / len(waits), 1) if waits else None,
+        "max_wait_s": round(max(waits), 1) if waits else None,
+        "avg_run_s": round(sum(runs) / len(runs), 1) if runs else None,
+    }
@@ -0,0 +1,137 @@
+"""
+Job progress written while the job runs.
+
+The collector appends its progress lines to log_lines. For a job run by the
+worker that list is a JobLog: every line appended is also kept for the
+job_events table, and the job's devices_total/devices_done/devices counters
+follow each device that settles. A flusher task writes what has piled up
+every JOB_EVENT_FLUSH_SECONDS, or as soon as JOB_EVENT_BATCH lines wait, in
+one commit. Writes only happen from that task, at the collector's await
+points, never in the middle of its own DB work.
+
+Job.log still receives the whole log when the job ends. If the worker dies
+first, the lines of its attempt are already in job_events; reclaiming the
+job folds them into Job.log (see job_controller.reclaim_expired). Once a job
+has ended, its events only repeat Job.log: sweep_ended() deletes them
+JOB_EVENT_RETENTION seconds later, leaving open streams time to catch up.
+
+GET /jobs/{id}/events streams the same rows to the UI (see api/jobs).
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..models import Job, JobEvent
+from ..settings import settings
+from ..utils.timeutil import tznow
+
+logger = logging.getLogger(__name__)
+
+FINAL = ("success", "failed", "cancelled")
+
+
+class JobLog(list):
+    """log_lines of a running job, written to job_events in batches."""
+
+    def __init__(self, job_id: int, attempt: int = 1, lines: list[str] = ()):
+        super().__init__(lines)  # earlier lines (Job.log) are not events again
+        self.job_id = job_id
+        self.attempt = attempt
+        self._pending: list[JobEvent] = []
+        self._counters: dict | None = None
+        self._full = asyncio.Event()
+
+    def append(self, line: str):
+        super().append(line)
+        self._pending.append(JobEvent(job_id=self.job_id, attempt=self.attempt, timestamp=tznow(), message=line))
+        if len(self._pending) >= settings.JOB_EVENT_BATCH:
+            self._full.set()
+
+    def start(self, total: int):
+        self._counters = {"devices_total": total, "devices_done": 0, "devices": 0}
+
+    def progress(self, done: int, ok: int):
+        """run_backup's progress callback: devices settled so far, and how many succeeded."""
+        self._counters = {**(self._counters or {}), "devices_done": done, "devices": ok}
+
+    def flush(self):
+        """Write pending lines and counters in one commit; kept for the next try if that fails."""
+        if not self._pending and self._counters is None:
+            return
+        db = database.SessionLocal()
+        try:
+            db.add_all(self._pending)
+            if self._counters:
+                db.execute(update(Job).where(Job.id == self.job_id).values(**self._counters))
+            db.commit()
+            self._pending = []
+            self._counters = None
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"job#{self.job_id}: could not write progress: {e}")
+        finally:
+            db.close()
+
+    async def keep_flushing(self):
+        """Flusher task: runs until cancelled; the caller flushes once more at the end."""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), settings.JOB_EVENT_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            self.flush()
+
+
+def sweep_ended(db: Session) -> int:
+    """Delete the events of jobs that ended more than JOB_EVENT_RETENTION seconds ago."""
+    cutoff = tznow() - timedelta(seconds=settings.JOB_EVENT_RETENTION)
+    ended = select(Job.id).where(Job.status.in_(FINAL), Job.finished_at <= cutoff)
+    removed = db.query(JobEvent).filter(JobEvent.job_id.in_(ended)).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def events_since(db: Session, job_id: int, after_id: int = 0, attempt: int | None = None) -> list[JobEvent]:
+    query = db.query(JobEvent).filter(JobEvent.job_id == job_id, JobEvent.id > after_id)
+    if attempt is not None:
+        query = query.filter(JobEvent.attempt == attempt)
+    return query.order_by(JobEvent.id).all()
+
+
+def current_log(db: Session, job: Job) -> tuple[list[str], int]:
+    """
+    The job's log so far and the id of the last event it includes. While the
+    job runs, Job.log holds what came before this attempt and the rest is in
+    job_events.
+    """
+    lines = (job.log or "").splitlines()
+    last_id = db.query(JobEvent.id).filter(JobEvent.job_id == job.id).order_by(JobEvent.id.desc()).limit(1).scalar() or 0
+    if job.status == "running":
+        lines += [e.message for e in events_since(db, job.id, attempt=job.attempts or 1)]
+    return lines, last_id
+
+
+def progress(job: Job) -> dict:
+    """Devices done/total, throughput and ETA of a job."""
+    total = job.devices_total
+    done = job.devices_done or 0
+    rate = eta = None
+    if job.status == "running" and done and job.started_at is not None:
+        started = job.started_at.replace(tzinfo=None)
+        elapsed = (tznow().replace(tzinfo=None) - started).total_seconds()
+        if elapsed > 0:
+            rate = done / elapsed
+            eta = (total - done) / rate if total else None
+    return {
+        "status": job.status,
+        "devices_total": total,
+        "devices_done": done,
+        "succeeded": job.devices or 0,
+        "rate_per_min": round(rate * 60, 1) if rate else None,
+        "eta_s": round(eta) if eta is not None else None,
+    }
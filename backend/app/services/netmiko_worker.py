@@ -1,134 +1,315 @@
 from netmiko import ConnectHandler
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from hashlib import sha256
-from pathlib import Path
+from dataclasses import dataclass
 from ..settings import settings
+from .session_pool import PooledSession, pool as session_pool
+from .backup_store import StoredConfig
+from .normalize import NormalizingWriter
+from .session_trace import NetmikoSessionLog, SessionTrace
+from .vendor_profiles import VendorProfile, profile_for
+import asyncio
+import re
+import threading
 
-# device_type hanya untuk SSH
-VENDOR_MAP = {
-    "Cisco (IOS Router/Switch)": "cisco_ios",
-    "Cisco (ASA Firewall)": "cisco_asa",
-    "Cisco (NXOS Data Center)": "cisco_nxos",
-    "Cisco (WLC Controller)": "cisco_wlc_ssh",
-    "Allied Telesis (AWPlus)": "cisco_ios",
-    "Aruba (AOS-CX Switch)": "aruba_aoscx",
-    "Aruba (AOS AP/Controller)": "aruba_os",
-    "MikroTik (RouterOS)": "mikrotik_routeros",
-    "MikroTik (SwitchOS)": "mikrotik_switchos",
-    "Huawei (Switch/AP)": "huawei",
-    "Huawei (OLT)": "huawei_olt",
-    "Huawei (SmartAX)": "huawei_smartax",
-    "Fortinet (FortiGate)": "fortinet",
-    "Juniper (JunOS)": "juniper",
-    # legacy
-    "Cisco": "cisco_ios",
-    "Juniper": "juniper",
-    "Mikrotik": "mikrotik_routeros",
-    "Fortinet": "fortinet",
-}
-
-def _device_type_ssh(vendor: str) -> str:
-    return VENDOR_MAP.get(vendor, "cisco_ios")
-
-
-def _get_config_command(vendor: str) -> str:
-    """Get the appropriate command to retrieve configuration based on vendor."""
-    vendor_lower = vendor.lower()
-    
-    # MikroTik uses /export
-    if "mikrotik" in vendor_lower:
-        return "/export"
-    
-    # Juniper uses show configuration
-    elif "juniper" in vendor_lower or "junos" in vendor_lower:
-        return "show configuration"
-    
-    # Fortinet uses show (without running-config)
-    elif "fortinet" in vendor_lower or "fortigate" in vendor_lower:
-        return "show"
-    
-    # Huawei uses display current-configuration
-    elif "huawei" in vendor_lower:
-        return "display current-configuration"
-    
-    # Aruba AOS-CX uses show running-config
-    elif "aruba" in vendor_lower and "aoscx" in vendor_lower:
-        return "show running-config"
-    
-    # Aruba AOS uses show running-config
-    elif "aruba" in vendor_lower:
-        return "show running-config"
-    
-    # Cisco and Allied Telesis (default)
-    else:
-        return "show running-config"
-
-
-def _read_all(tn, timeout=3):
-    """Read until connection is idle for 'timeout' seconds. Handles large configs."""
+
+@dataclass(frozen=True)
+class Timeouts:
+    """
+    Per-fetch timeouts in seconds; None keeps the vendor profile's default.
+
+    connect: TCP connect (SSH: connect + key exchange), auth: each login step,
+    transfer: wait for command output (first byte, then between chunks; the
+    gap never drops below the profile's idle_timeout, see idle_for()).
+    """
+    connect: float | None = None
+    auth: float | None = None
+    transfer: float | None = None
+
+    def idle_for(self, profile: VendorProfile) -> float:
+        """Quiet time allowed between output chunks before a prompt-less read gives up."""
+        return max(profile.idle_timeout, self.transfer or 0)
+
+
+class FetchCancelled(Exception):
+    """The job was cancelled while this fetch was transferring (see job_controller)."""
+
+
+def _check_cancel(cancel: threading.Event | None):
+    if cancel is not None and cancel.is_set():
+        raise FetchCancelled("cancelled")
+
+
+@dataclass
+class FetchTiming:
+    """Durations measured during a fetch; connect/auth stay None on a pooled session."""
+    connect_s: float | None = None
+    auth_s: float | None = None
+    transfer_s: float | None = None
+
+
+def _expect(tn, patterns: list[re.Pattern], timeout: float, step: str, log: SessionTrace | None = None):
+    """Wait for the first matching prompt; fail fast instead of guessing."""
+    index, match, text = tn.expect(patterns, timeout=timeout)
+    if log is not None:
+        log.write(text)
+    if index < 0:
+        tail = text[-80:].decode("ascii", errors="ignore").strip()
+        raise Exception(f"Telnet timeout waiting for {step} prompt (last output: {tail!r})")
+    return index, match
+
+
+_PAGER = re.compile(rb"(?:-+ ?\(?more[^\r\n]{0,20}?\)? ?-+|<--- More --->|Press any key to continue)[ \t]*$", re.IGNORECASE)
+_PAGER_ERASE = re.compile(rb"(?:\x08+ +\x08+|\x1b\[\d*[A-Za-z])")
+
+
+class _OutputStream:
+    """
+    Command output passed on to a sink as it arrives.
+
+    Only the last HOLD bytes are kept back, so the prompt or a pager at the
+    end of the stream can be recognised (and the pager cut out) before it is
+    emitted. Nothing else is retained: memory stays flat and multi-MB configs
+    are never rescanned. Without a sink the output is collected for getvalue().
+    """
+    HOLD = 256
+
+    def __init__(self, prompt: bytes, sink=None):
+        self.prompt = prompt
+        self.done = False
+        self.total = 0
+        self._pending = b""
+        self._chunks: list[bytes] = []
+        self._sink = sink or self._chunks.append
+
+    def feed(self, data: bytes) -> str | None:
+        """Add a chunk; returns 'prompt' when the command finished, 'pager' when a keypress is due."""
+        self.total += len(data)
+        pending = _PAGER_ERASE.sub(b"", self._pending + data)
+        state = None
+
+        # Device prompt alone on the last line -> command finished
+        end = pending.rstrip(b" \t")
+        if end.endswith(self.prompt) and end[:-len(self.prompt)][-1:] in (b"\n", b"\r"):
+            self.done = True
+            state = "prompt"
+        else:
+            # Pager waiting for a keypress
+            m = _PAGER.search(pending, max(0, len(pending) - self.HOLD))
+            if m:
+                pending = pending[:m.start()] + pending[m.end():]
+                state = "pager"
+
+        if len(pending) > self.HOLD:
+            self._sink(pending[:-self.HOLD])
+            pending = pending[-self.HOLD:]
+        self._pending = pending
+        return state
+
+    def close(self):
+        if self._pending:
+            self._sink(self._pending)
+            self._pending = b""
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._chunks)
+
+
+class _CliLineFilter:
+    """
+    Streaming cleanup of a session's output before it is stored: drop
+    everything up to the command echo, normalise line endings to \\n, and drop
+    leading blank lines plus the trailing prompt. drop_prompt_lines (Telnet
+    and interactive shells) also drops prompt lines inside the output.
+    Volatile content is left to the vendor normalizer (see normalize).
+    """
+    ECHO_WINDOW = 4096
+
+    def __init__(self, command: bytes, prompt: bytes | None, sink, drop_prompt_lines: bool = False):
+        self._echo = command
+        self._prompt = prompt
+        self._sink = sink
+        self._drop_prompt_lines = drop_prompt_lines
+        self._head = b""
+        self._echo_done = not command
+        self._partial = b""
+        self._blanks = 0
+        self._last: tuple[int, bytes] | None = None  # (blank lines before it, line)
+
+    def feed(self, data: bytes):
+        if not self._echo_done:
+            self._head += data
+            i = self._head.find(self._echo)
+            if i >= 0:
+                data = self._head[i + len(self._echo):]
+            elif len(self._head) > self.ECHO_WINDOW:
+                data = self._head
+            else:
+                return
+            self._head = b""
+            self._echo_done = True
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line.rstrip(b"\r"))
+
+    def close(self):
+        if not self._echo_done:
+            self._echo_done = True
+            self.feed(self._head)
+        if self._partial.strip():
+            self._line(self._partial.rstrip(b"\r"))
+        self._partial = b""
+        if self._last is not None and self._last[1].strip() != self._prompt:
+            self._emit(*self._last)
+        self._last = None
+
+    def _line(self, line: bytes):
+        stripped = line.strip()
+        if self._drop_prompt_lines and self._prompt and stripped == self._prompt:
+            return
+        if not stripped:
+            if self._last is not None:
+                self._blanks += 1
+            return
+        if self._last is not None:
+            self._emit(*self._last)
+        self._last = (self._blanks, line)
+        self._blanks = 0
+
+    def _emit(self, blanks: int, line: bytes):
+        self._sink(b"\n" * blanks + line + b"\n")
+
+
+def _read_until_prompt(
+    tn,
+    prompt: bytes,
+    sink=None,
+    timeout: float = 60,
+    idle_timeout: float = 3,
+    log: SessionTrace | None = None,
+    cancel: threading.Event | None = None,
+) -> _OutputStream:
+    """
+    Read command output until the CLI prompt comes back, passing it to sink.
+
+    timeout is the wait for the first byte; after idle_timeout without data
+    the read gives up with stream.done False, which callers treat as a
+    timeout (the output is incomplete).
+    log, when given, also receives the raw output. Setting cancel stops the
+    read with FetchCancelled.
+    """
+    import select
     import time
-    buf = b""
-    last = time.time()
 
-    while time.time() - last < timeout:
-        data = tn.read_very_eager()
-        if data:
-            buf += data
-            last = time.time()
-        time.sleep(0.2)
+    stream = _OutputStream(prompt, sink)
+    sock = tn.get_socket()
+    started = last = time.monotonic()
+
+    while True:
+        _check_cancel(cancel)
+        now = time.monotonic()
+        if (not stream.total and now - started > timeout) or (stream.total and now - last > idle_timeout):
+            break
+        if not tn.sock_avail():
+            select.select([sock], [], [], 0.05)
+        try:
+            data = tn.read_very_eager()
+        except EOFError:
+            break
+        if not data:
+            continue
+        last = time.monotonic()
+        if log is not None:
+            log.write(data)
+        state = stream.feed(data)
+        if state == "prompt":
+            break
+        if state == "pager":
+            tn.write(b" ")
 
-    return buf
+    stream.close()
+    return stream
 
 
 def _connect_telnet_manual(
+    vendor: str,
     host: str,
     username: str,
     password: str,
     secret: str | None,
     port: int,
-    session_log: str,
+    session_log: SessionTrace | None,
+    timeouts: Timeouts = Timeouts(),
+    timing: FetchTiming | None = None,
 ):
-    """Telnet login manual using raw telnetlib - PROVEN WORKING!"""
+    """
+    Prompt-driven Telnet login using raw telnetlib.
+
+    Each step is sent as soon as the expected prompt arrives, so a fast device
+    logs in in a few round trips instead of fixed sleeps. The dialogue goes
+    to session_log (passwords masked) when one is given.
+    """
     import telnetlib  # type: ignore  # deprecated but still works in Python 3.11
     import time
-    
-    # Use telnetlib directly
-    tn = telnetlib.Telnet(host, port, timeout=30)
-    time.sleep(1)
-    
-    # FLEXIBLE login prompt detection (Username, login, User Name, etc)
-    index, match, text = tn.expect([
-        b"Username:", b"username:", b"User Name:", b"User:", 
-        b"Login:", b"login:", b"USER:"
-    ], timeout=15)
-    
-    # Send username
-    tn.write(username.encode('ascii') + b"\n")
-    time.sleep(1)
-    
-    # Wait for password prompt (flexible detection)
-    tn.expect([b"Password:", b"password:", b"PASS:"], timeout=15)
-    tn.write(password.encode('ascii') + b"\n")
-    time.sleep(2)
-    
+
+    profile = profile_for(vendor)
+    prompts = profile.prompts
+    login_timeout = timeouts.auth or prompts.login_timeout * profile.delay_factor
+    command_timeout = prompts.command_timeout * profile.delay_factor
+    started = time.monotonic()
+    tn = telnetlib.Telnet(host, port, timeout=timeouts.connect or 30)
+    connected = time.monotonic()
+    waiting = [prompts.login, prompts.password, prompts.cli]
+    log = session_log or None
+
+    def send(line: str, shown: str | None = None):
+        if log is not None:
+            log.sent(line if shown is None else shown)
+        tn.write(line.encode('ascii') + b"\n")
+
+    # Some console servers only print the banner after a keypress
+    index, match, text = tn.expect(waiting, timeout=min(3, login_timeout))
+    if log is not None:
+        log.write(text)
+    if index < 0:
+        send("")
+        index, match = _expect(tn, waiting, login_timeout, "login", log)
+
+    if index == 0:
+        send(username)
+        index, match = _expect(tn, waiting, login_timeout, "password", log)
+        if index == 0:
+            raise Exception("Telnet login rejected")
+
+    if index == 1:
+        send(password, shown="********")
+        index, match = _expect(tn, [prompts.login, prompts.cli], login_timeout, "CLI", log)
+        if index == 0:
+            raise Exception("Telnet authentication failed")
+
     # Enter enable mode if secret provided
     if secret:
-        tn.write(b"enable\n")
-        time.sleep(1)
-        tn.expect([b"Password:", b"password:"], timeout=15)
-        tn.write(secret.encode('ascii') + b"\n")
-        time.sleep(2)
-    
-    # Disable paging (try multiple times for reliability)
-    tn.write(b"terminal length 0\n")
-    time.sleep(1)
-    tn.read_very_eager()  # Clear buffer
-    
-    # Double-send for stubborn devices
-    tn.write(b"terminal length 0\n")
-    time.sleep(0.5)
-    tn.read_very_eager()
-    
-    return tn
+        send("enable")
+        index, match = _expect(tn, [prompts.password, prompts.cli], command_timeout, "enable", log)
+        if index == 0:
+            send(secret, shown="********")
+            index, match = _expect(tn, [prompts.password, prompts.cli], command_timeout, "enable", log)
+            if index == 0:
+                raise Exception("Telnet enable secret rejected")
+
+    # Disable paging once; the pager fallback in the read path covers the rest
+    if prompts.paging_cmd:
+        send(prompts.paging_cmd)
+        _, match = _expect(tn, [prompts.cli], command_timeout, "CLI", log)
+
+    # The last CLI match is the exact prompt the read path waits for
+    prompt = match.group(0).strip()
+    if timing is not None:
+        timing.connect_s = connected - started
+        timing.auth_s = time.monotonic() - connected
+    return tn, prompt
 
 
 def _connect_ssh_normal(
@@ -138,29 +319,104 @@ def _connect_ssh_normal(
     password: str,
     secret: str | None,
     port: int,
-    session_log: str,
+    session_log: SessionTrace | None,
+    timeouts: Timeouts = Timeouts(),
+    timing: FetchTiming | None = None,
 ):
-    """SSH biasa pakai mapping vendor."""
-    device_type = _device_type_ssh(vendor)
+    """SSH biasa pakai vendor profile. netmiko's session log goes to session_log, not a file."""
+    import time
+
+    profile = profile_for(vendor)
     device = {
-        "device_type": device_type,
+        "device_type": profile.device_type,
         "host": host,
         "username": username,
         "password": password,
         "secret": secret,
         "port": port,
-        "session_log": session_log,
-        "fast_cli": False,
+        "session_log": NetmikoSessionLog(session_log or None),
+        "fast_cli": profile.fast_cli,
+        "global_delay_factor": profile.delay_factor,
     }
+    if timeouts.connect:
+        device["conn_timeout"] = timeouts.connect
+    if timeouts.auth:
+        device["auth_timeout"] = timeouts.auth
 
+    # netmiko does TCP connect and authentication in one call
+    started = time.monotonic()
     conn = ConnectHandler(**device)
 
     if secret:
         conn.enable()
 
+    if timing is not None:
+        timing.connect_s = time.monotonic() - started
     return conn
 
 
+def _session_key(proto, vendor, host, port, username, password, secret) -> tuple:
+    # Credentials are part of the key (hashed) so a rotated password or a
+    # different account never picks up someone else's session
+    cred = sha256(f"{username}\0{password}\0{secret or ''}".encode()).hexdigest()
+    return (proto, vendor, host, port, cred)
+
+
+def _telnet_session(tn, prompt: bytes) -> PooledSession:
+    def alive() -> bool:
+        # A bare newline must bring the prompt straight back
+        tn.read_very_eager()
+        tn.write(b"\n")
+        return _read_until_prompt(tn, prompt, timeout=2, idle_timeout=1).done
+
+    def close():
+        try:
+            tn.write(b"exit\n")
+        finally:
+            tn.close()
+
+    return PooledSession(conn=tn, prompt=prompt, alive=alive, close=close)
+
+
+def _ssh_session(conn) -> PooledSession:
+    def close():
+        try:
+            conn.disconnect()
+        finally:
+            # hard-close socket
+            if hasattr(conn, "remote_conn"):
+                conn.remote_conn.close()
+
+    return PooledSession(conn=conn, prompt=conn.find_prompt().strip().encode(), alive=conn.is_alive, close=close)
+
+
+def _send_command_streaming(conn, prompt: bytes, command: str, sink, timeout: float = 60,
+                            cancel: threading.Event | None = None) -> bool:
+    """
+    netmiko send_command() without buffering the whole output as one str:
+    chunks from read_channel() go straight to sink. Returns True once the
+    prompt is back, False if the device went quiet for timeout seconds.
+    """
+    import time
+
+    stream = _OutputStream(prompt, sink)
+    conn.write_channel(command + conn.RETURN)
+    last = time.monotonic()
+    while not stream.done:
+        _check_cancel(cancel)
+        data = conn.read_channel()
+        if data:
+            last = time.monotonic()
+            if stream.feed(data.encode()) == "pager":
+                conn.write_channel(" ")
+        elif time.monotonic() - last > timeout:
+            break
+        else:
+            time.sleep(0.02)
+    stream.close()
+    return stream.done
+
+
 def fetch_running_config(
     *,
     vendor: str,
@@ -171,129 +427,381 @@ def fetch_running_config(
     protocol: str,
     port: int,
     cmd: str | None = None,
-) -> tuple[str, bytes]:
+    base_path: str | None = None,
+    keep_output: bool = True,
+    timeouts: Timeouts = Timeouts(),
+    timing: FetchTiming | None = None,
+    session_log: SessionTrace | None = None,
+    cancel: threading.Event | None = None,
+) -> StoredConfig:
     """
     - Kalau protocol = 'Telnet'  -> pakai terminal_server + login manual
     - Kalau protocol = 'SSH'     -> pakai Netmiko normal (device_type dari vendor)
+
+    Output is streamed into the blob store as it arrives (see backup_store).
+    base_path is the device's last stored config: if the output is identical
+    nothing is written and the result comes back unchanged. keep_output=False
+    only hashes the output (connectivity tests).
+
+    timeouts overrides the transport defaults (see adaptive_timeouts);
+    timing, when given, receives the measured durations. session_log
+    collects the device dialogue in memory (see session_trace); nothing is
+    written to disk for it. cancel, once set, aborts the transfer with
+    FetchCancelled, and nothing is stored (connect and login still end
+    within their timeouts).
     """
-    import tempfile
-    import os
-    import traceback
+    import time
 
-    session_log = os.path.join(tempfile.gettempdir(), f"netmiko_{host}.log")
+    profile = profile_for(vendor)
+    transfer_timeout = timeouts.transfer or profile.transfer_timeout
 
-    conn = None
-    output = ""
-    tn = None  # For telnetlib connection
+    # SAFE protocol detection (strip whitespace)
+    proto = (protocol or "").strip().lower()
+    key = _session_key(proto, vendor, host, port, username, password, secret)
+    session = session_pool.acquire(key)
+    reusable = False
+    writer = NormalizingWriter(vendor, base_path, keep=keep_output)
 
     try:
-        # SAFE protocol detection (strip whitespace)
-        proto = (protocol or "").strip().lower()
-
         if proto == "telnet":
-            tn = _connect_telnet_manual(
-                host=host,
-                username=username,
-                password=password,
-                secret=secret,
-                port=port,
-                session_log=session_log,
-            )
+            if session is None:
+                tn, prompt = _connect_telnet_manual(
+                    vendor=vendor,
+                    host=host,
+                    username=username,
+                    password=password,
+                    secret=secret,
+                    port=port,
+                    session_log=session_log,
+                    timeouts=timeouts,
+                    timing=timing,
+                )
+                session = _telnet_session(tn, prompt)
+            tn, prompt = session.conn, session.prompt
             
             # Send command to get config using telnetlib
-            command = cmd or _get_config_command(vendor)
+            _check_cancel(cancel)
+            command = cmd or profile.config_command
+            started = time.monotonic()
+            if session_log is not None:
+                session_log.sent(command)
             tn.write(command.encode('ascii') + b"\n")
-            import time
-            time.sleep(2)  # Initial wait
-            
-            # Read ALL output using robust method (handles large configs)
-            raw_output = _read_all(tn, timeout=3)
-            
-            # Handle --More-- prompts if paging not fully disabled
-            while b"--More--" in raw_output or b"-- More --" in raw_output:
-                tn.write(b" ")
-                time.sleep(1)
-                additional = _read_all(tn, timeout=2)
-                raw_output += additional
-                if not additional:
-                    break
-            
-            # Decode output
-            output = raw_output.decode('ascii', errors='ignore')
-            
-            # Clean up output - remove command echo by splitting on command
-            if command in output:
-                output = output.split(command, 1)[-1]
-            
-            # Remove trailing prompt/garbage
-            output = output.strip()
             
-            # Remove lines that are just prompts (but keep config lines with #)
-            lines = output.split('\n')
-            cleaned = []
-            for line in lines:
-                stripped = line.strip()
-                # Skip empty lines and pure prompt lines
-                if not stripped or (stripped.endswith('#') and len(stripped) < 20) or (stripped.endswith('>') and len(stripped) < 20):
-                    continue
-                cleaned.append(line)
-            output = '\n'.join(cleaned)
+            # Read until the prompt returns (pagers are answered on the fly)
+            lines = _CliLineFilter(command.encode('ascii'), prompt, writer.write, drop_prompt_lines=True)
+            stream = _read_until_prompt(
+                tn, prompt, sink=lines.feed, timeout=transfer_timeout, idle_timeout=timeouts.idle_for(profile),
+                log=session_log, cancel=cancel,
+            )
+            lines.close()
+            if not stream.done:
+                # went quiet before the prompt: what we have is not the whole config
+                raise Exception(f"Timed out waiting for prompt {prompt.decode(errors='ignore')!r}")
+            reusable = True
             
         else:
-            conn = _connect_ssh_normal(
-                vendor=vendor,
-                host=host,
-                username=username,
-                password=password,
-                secret=secret,
-                port=port,
-                session_log=session_log,
-            )
+            if session is None:
+                conn = _connect_ssh_normal(
+                    vendor=vendor,
+                    host=host,
+                    username=username,
+                    password=password,
+                    secret=secret,
+                    port=port,
+                    session_log=session_log,
+                    timeouts=timeouts,
+                    timing=timing,
+                )
+                session = _ssh_session(conn)
+            conn = session.conn
+            if isinstance(conn.session_log, NetmikoSessionLog):
+                # a pooled connection still points at the trace of the fetch that opened it
+                conn.session_log.target = session_log
             
-            # Get appropriate command for this vendor
-            config_cmd = cmd or _get_config_command(vendor)
-            output = conn.send_command(config_cmd, read_timeout=60)
+            config_cmd = cmd or profile.config_command
+            started = time.monotonic()
+            lines = _CliLineFilter(config_cmd.encode(), session.prompt, writer.write)
+            _check_cancel(cancel)
+            if not _send_command_streaming(conn, session.prompt, config_cmd, lines.feed, timeout=transfer_timeout,
+                                           cancel=cancel):
+                raise Exception(f"Timed out waiting for prompt {session.prompt.decode(errors='ignore')!r}")
+            lines.close()
+            reusable = True
+
+        if timing is not None:
+            timing.transfer_s = time.monotonic() - started
+        # an abandoned fetch (see collector) stores nothing
+        _check_cancel(cancel)
+        return writer.commit()
+
+    except FetchCancelled:
+        writer.abort()
+        if session_log is not None:
+            session_log.note("cancelled")
+        raise
 
     except Exception as e:
+        writer.abort()
         error_msg = str(e)
-        # Session log available at: session_log (for debugging if needed)
+        if session_log is not None:
+            session_log.note(f"error: {error_msg}")
         raise Exception(f"Connection failed: {host} | Error: {error_msg}")
 
     finally:
-        # Cleanup connections
-        if tn:
-            try:
-                tn.write(b"exit\n")
-                import time
-                time.sleep(1)
-                tn.close()
-            except Exception:
-                pass
-        
-        if conn:
-            try:
-                conn.disconnect()
-            except Exception:
-                pass
-            # hard-close socket
-            try:
-                if hasattr(conn, "remote_conn"):
-                    conn.remote_conn.close()
-            except Exception:
-                pass
+        # Hand the session back for the next operation on this device, or close it
+        if session is not None:
+            if reusable:
+                if isinstance(getattr(session.conn, "session_log", None), NetmikoSessionLog):
+                    session.conn.session_log.target = None
+                session_pool.release(key, session)
+            else:
+                session_pool.discard(session)
+
+
+# Dedicated pool for the blocking collector (netmiko/telnetlib/time.sleep), so
+# device I/O never runs on the asyncio event loop and does not compete with the
+# default executor used by the rest of the app.
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.COLLECTOR_MAX_WORKERS),
+            thread_name_prefix="collector",
+        )
+    return _executor
 
+
+def shutdown_executor():
+    """Stop the collector pool (app shutdown). Running fetches are left to finish."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+TRANSPORTS = ("netmiko", "asyncssh")
+
+
+def _resolve_transport(protocol: str, transport: str | None) -> str:
+    """Per-device transport wins over COLLECTOR_TRANSPORT; Telnet always uses telnetlib."""
+    name = (transport or settings.COLLECTOR_TRANSPORT or "netmiko").strip().lower()
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown transport: {name}")
+    if (protocol or "").strip().lower() == "telnet":
+        return "netmiko"
+    return name
+
+
+async def fetch_running_config_async(*, transport: str | None = None, **kwargs) -> StoredConfig:
+    """
+    Awaitable fetch_running_config.
+
+    The netmiko/telnetlib transport runs in the collector thread pool; the
+    asyncssh transport runs natively on the event loop. Both return the same
+    StoredConfig.
+    """
+    if _resolve_transport(kwargs.get("protocol", ""), transport) == "asyncssh":
+        return await _fetch_asyncssh(**kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fetch_running_config, **kwargs))
+
+
+async def _expect_async(process, patterns: list[re.Pattern], timeout: float, step: str,
+                        log: SessionTrace | None = None):
+    """asyncssh twin of _expect: read the shell until one of patterns matches its tail."""
+    tail = b""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise Exception(f"SSH timeout waiting for {step} prompt")
         try:
-            if os.path.exists(session_log):
-                os.remove(session_log)
-        except Exception:
-            pass
-
-    # Simpan ke file
-    content = output.encode()
-    filehash = sha256(content).hexdigest()[:8]
-    Path(settings.BACKUP_DIR).mkdir(parents=True, exist_ok=True)
-    filename = f"{host}_{filehash}.cfg"
-    fullpath = Path(settings.BACKUP_DIR) / filename
-    fullpath.write_bytes(content)
-
-    return str(fullpath), content
+            data = await asyncio.wait_for(process.stdout.read(65536), timeout=remaining)
+        except asyncio.TimeoutError:
+            continue
+        if not data:
+            raise Exception(f"SSH session closed waiting for {step} prompt")
+        if log is not None:
+            log.write(data)
+        tail = (tail + data)[-512:]
+        for index, pattern in enumerate(patterns):
+            match = pattern.search(tail)
+            if match:
+                return index, match
+
+
+class _ThreadedSink:
+    """Collects output on the event loop; drain() hands it to write in a worker thread."""
+
+    def __init__(self, write):
+        self._write = write
+        self._pending = bytearray()
+
+    def feed(self, chunk: bytes):
+        self._pending += chunk
+
+    async def drain(self):
+        if self._pending:
+            chunk, self._pending = bytes(self._pending), bytearray()
+            await asyncio.to_thread(self._write, chunk)
+
+
+async def _read_until_prompt_async(
+    process, prompt: bytes, sink=None, timeout: float = 60, idle_timeout: float = 3, log: SessionTrace | None = None,
+    cancel: threading.Event | None = None, drain=None,
+) -> _OutputStream:
+    """asyncssh twin of _read_until_prompt; drain, when given, is awaited after each chunk."""
+    stream = _OutputStream(prompt, sink)
+    wait = timeout
+    while True:
+        _check_cancel(cancel)
+        try:
+            data = await asyncio.wait_for(process.stdout.read(65536), timeout=wait)
+        except asyncio.TimeoutError:
+            break
+        if not data:
+            break
+        wait = idle_timeout
+        if log is not None:
+            log.write(data)
+        state = stream.feed(data)
+        if drain is not None:
+            await drain()
+        if state == "prompt":
+            break
+        if state == "pager":
+            process.stdin.write(b" ")
+    stream.close()
+    return stream
+
+
+async def _fetch_asyncssh(
+    *,
+    vendor: str,
+    host: str,
+    username: str,
+    password: str,
+    secret: str | None,
+    protocol: str,
+    port: int,
+    cmd: str | None = None,
+    base_path: str | None = None,
+    keep_output: bool = True,
+    timeouts: Timeouts = Timeouts(),
+    timing: FetchTiming | None = None,
+    session_log: SessionTrace | None = None,
+    cancel: threading.Event | None = None,
+) -> StoredConfig:
+    """
+    asyncssh transport: hundreds of sessions on one event loop, no thread each.
+
+    Without an enable secret the command runs on an exec channel (no pty, so
+    no paging and no prompt parsing). With a secret we need an interactive
+    shell to enter enable mode first.
+    """
+    try:
+        import asyncssh  # type: ignore
+    except ImportError:
+        raise Exception(f"Connection failed: {host} | Error: asyncssh transport selected but asyncssh is not installed")
+
+    profile = profile_for(vendor)
+    prompts = profile.prompts
+    command = cmd or profile.config_command
+    # normalizing, compression and file I/O stay off the event loop
+    writer = await asyncio.to_thread(NormalizingWriter, vendor, base_path, keep=keep_output)
+    sink = _ThreadedSink(writer.write)
+    transfer_timeout = timeouts.transfer or profile.transfer_timeout
+    command_timeout = prompts.command_timeout * profile.delay_factor
+    loop = asyncio.get_running_loop()
+
+    try:
+        started = loop.time()
+        # connect_timeout covers TCP connect, key exchange and authentication
+        connect_timeout = (timeouts.connect + (timeouts.auth or 0)) if timeouts.connect else 30
+        async with asyncssh.connect(
+            host, port=port, username=username, password=password,
+            known_hosts=None, connect_timeout=connect_timeout,
+        ) as conn:
+            if timing is not None:
+                timing.connect_s = loop.time() - started
+            started = loop.time()
+            if not secret:
+                lines = _CliLineFilter(b"", None, sink.feed)
+                if session_log is not None:
+                    session_log.sent(command)
+                async with conn.create_process(command, encoding=None) as process:
+                    while True:
+                        _check_cancel(cancel)
+                        try:
+                            data = await asyncio.wait_for(process.stdout.read(65536), timeout=transfer_timeout)
+                        except asyncio.TimeoutError:
+                            raise TimeoutError(f"Timed out: no output from {host} within {transfer_timeout}s")
+                        if not data:
+                            break
+                        if session_log is not None:
+                            session_log.write(data)
+                        lines.feed(data)
+                        await sink.drain()
+                lines.close()
+                await sink.drain()
+            else:
+                process = await conn.create_process(term_type="vt100", encoding=None)
+
+                def send(line: str, shown: str | None = None):
+                    if session_log is not None:
+                        session_log.sent(line if shown is None else shown)
+                    process.stdin.write(line.encode("ascii") + b"\n")
+
+                try:
+                    login_timeout = timeouts.auth or prompts.login_timeout * profile.delay_factor
+                    await _expect_async(process, [prompts.cli], login_timeout, "CLI", session_log)
+                    send("enable")
+                    # already privileged, or no password asked: straight back to the CLI prompt
+                    index, match = await _expect_async(
+                        process, [prompts.password, prompts.cli], command_timeout, "enable", session_log,
+                    )
+                    if index == 0:
+                        send(secret, shown="********")
+                        index, match = await _expect_async(
+                            process, [prompts.password, prompts.cli], command_timeout, "enable", session_log,
+                        )
+                        if index == 0:
+                            raise Exception("SSH enable secret rejected")
+                    if prompts.paging_cmd:
+                        send(prompts.paging_cmd)
+                        _, match = await _expect_async(process, [prompts.cli], command_timeout, "CLI", session_log)
+                    prompt = match.group(0).strip()
+                    send(command)
+                    lines = _CliLineFilter(command.encode("ascii"), prompt, sink.feed, drop_prompt_lines=True)
+                    stream = await _read_until_prompt_async(
+                        process, prompt, sink=lines.feed, timeout=transfer_timeout,
+                        idle_timeout=timeouts.idle_for(profile), log=session_log, cancel=cancel, drain=sink.drain,
+                    )
+                    if not stream.total:
+                        raise TimeoutError(f"Timed out: no output from {host} within {transfer_timeout}s")
+                    if not stream.done:
+                        # same rule as the netmiko SSH path: no prompt, no complete config
+                        raise TimeoutError(f"Timed out waiting for prompt {prompt.decode(errors='ignore')!r}")
+                    lines.close()
+                    await sink.drain()
+                finally:
+                    process.close()
+            if timing is not None:
+                timing.transfer_s = loop.time() - started
+        _check_cancel(cancel)
+        # fsync/rename off the event loop
+        return await asyncio.to_thread(writer.commit)
+    except (FetchCancelled, asyncio.CancelledError):
+        writer.abort()
+        raise
+    except Exception as e:
+        writer.abort()
+        # asyncio/asyncssh timeouts carry no message of their own
+        error_msg = str(e) or type(e).__name__
+        if session_log is not None:
+            session_log.note(f"error: {error_msg}")
+        raise Exception(f"Connection failed: {host} | Error: {error_msg}")
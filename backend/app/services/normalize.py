@@ -0,0 +1,237 @@
+"""
+Per-vendor config normalization before hashing.
+
+Running configs carry lines that change on every pull without the
+configuration changing: "! Last configuration change at ...", the IOS
+"ntp clock-period", ASA checksums, JunOS/RouterOS/Huawei timestamp headers,
+FortiGate "#conf_file_ver" and ENC values (re-salted on every "show"). Left
+in, they give every backup a new hash, so change detection and blob dedup
+never kick in.
+
+Each platform's rules are compiled once into a single anchored regex, so a
+line costs one match() whatever the number of rules. A rule either drops
+the line or keeps what it matched and masks the rest of the line.
+NormalizingWriter sits between the CLI line filter and the ConfigWriter and
+does this while the output streams in. With BACKUP_STORE_RAW the bytes as
+received are stored as well (see Backup.raw_blob_sha256).
+
+Masked values (FortiGate ENC passwords, PSKs, keys) are needed to restore
+the config, so they are only masked for the change check: the stored blob
+keeps them, and the output is compared with the last backup read back
+through the same rules (see ChangeDigest).
+
+Only full config pulls are normalized: probe and test commands
+(keep_output=False) are passed through untouched.
+"""
+import os
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from hashlib import sha256
+
+from ..settings import settings
+from .backup_store import ConfigWriter, StoredConfig, iter_config
+from .vendor_profiles import profile_for
+
+MASK = b"<masked>"
+
+
+@dataclass(frozen=True)
+class Rule:
+    pattern: bytes  # regex anchored at the start of the line
+    mask: bool = False  # keep the matched part and mask the rest, instead of dropping the line
+
+
+_ANY = (
+    # uptime banners ("R1 uptime is 4 weeks, 2 days"), never an indented config line
+    Rule(rb"(?i:\S.* uptime is \d)"),
+)
+_IOS = (
+    Rule(rb"! Last configuration change at "),
+    Rule(rb"! NVRAM config last updated at "),
+    Rule(rb"! No configuration change since last restart"),
+    Rule(rb"Building configuration\.\.\."),
+    Rule(rb"Current configuration ?: ?\d+ bytes"),
+    Rule(rb"ntp clock-period \d+"),
+)
+_NXOS = _IOS + (
+    Rule(rb"!Time: "),
+    Rule(rb"!Running configuration last done at"),
+)
+_ASA = (
+    Rule(rb": Written by "),
+    Rule(rb": Saved\s*$"),
+    Rule(rb"Cryptochecksum:"),
+    Rule(rb"Building configuration\.\.\."),
+)
+_JUNOS = (
+    Rule(rb"## Last (commit|changed): "),
+)
+_ROUTEROS = (
+    # "# jan/02/2024 12:00:00 by RouterOS 6.49" / "# 2024-01-02 12:00:00 by RouterOS 7.13"
+    Rule(rb"# \S+ \d\d:\d\d:\d\d by RouterOS"),
+)
+_HUAWEI = (
+    Rule(rb"!Last configuration was (updated|saved) at "),
+)
+_FORTIOS = (
+    Rule(rb"#conf_file_ver="),
+    Rule(rb"\s*set \S+ ENC ", mask=True),
+)
+
+RULES: dict[str, tuple[Rule, ...]] = {
+    "cisco_ios": _IOS,
+    "cisco_nxos": _NXOS,
+    "cisco_asa": _ASA,
+    "cisco_wlc_ssh": _IOS,
+    "aruba_aoscx": _IOS,
+    "aruba_os": _IOS,
+    "juniper": _JUNOS,
+    "mikrotik_routeros": _ROUTEROS,
+    "mikrotik_switchos": _ROUTEROS,
+    "huawei": _HUAWEI,
+    "huawei_olt": _HUAWEI,
+    "huawei_smartax": _HUAWEI,
+    "fortinet": _FORTIOS,
+}
+
+
+class Normalizer:
+    """Compiled rules of one platform."""
+
+    def __init__(self, rules: tuple[Rule, ...]):
+        self.rules = rules
+        # Some lines lose data the config needs (see ChangeDigest)
+        self.lossy = any(r.mask for r in rules)
+        # One named group per rule; lastgroup tells which one matched
+        self._regex = re.compile(b"|".join(b"(?P<r%d>%s)" % (i, r.pattern) for i, r in enumerate(rules)))
+
+    def line(self, line: bytes, mask: bool = True) -> bytes | None:
+        """The line normalized (without its newline), or None to drop it. mask=False leaves masked lines as they are."""
+        m = self._regex.match(line)
+        if m is None:
+            return line
+        if not self.rules[int(m.lastgroup[1:])].mask:
+            return None
+        return line[:m.end()] + MASK if mask else line
+
+    def apply(self, data: bytes) -> bytes:
+        """Normalize a whole config at once."""
+        lines = (self.line(line) for line in data.split(b"\n"))
+        return b"\n".join(line for line in lines if line is not None)
+
+
+@lru_cache(maxsize=None)
+def _compiled(device_type: str) -> Normalizer:
+    return Normalizer(_ANY + RULES.get(device_type, ()))
+
+
+def normalizer_for(vendor: str | None) -> Normalizer:
+    return _compiled(profile_for(vendor).device_type)
+
+
+class ChangeDigest:
+    """
+    sha256 of a config as the change check sees it, volatile lines dropped
+    and masked, fed in chunks. premasked tells that the input already held
+    masked values (stored before they were kept).
+    """
+
+    def __init__(self, normalizer: Normalizer):
+        self._normalizer = normalizer
+        self._hash = sha256()
+        self._partial = b""
+        self.premasked = False
+
+    def _line(self, line: bytes, end: bytes):
+        if line.endswith(MASK):
+            self.premasked = True
+        kept = self._normalizer.line(line)
+        if kept is not None:
+            self._hash.update(kept + end)
+
+    def write(self, chunk: bytes):
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line, b"\n")
+
+    def hexdigest(self) -> str:
+        if self._partial:
+            self._line(self._partial, b"")
+            self._partial = b""
+        return self._hash.hexdigest()
+
+
+class NormalizingWriter:
+    """
+    ConfigWriter front end for a config pull: normalizes the output line by
+    line on its way to the blob store, and with BACKUP_STORE_RAW also keeps
+    the raw bytes. Same write()/commit()/abort() contract as ConfigWriter.
+    """
+
+    def __init__(self, vendor: str | None, base_path: str | None = None, keep: bool = True):
+        enabled = keep and settings.BACKUP_NORMALIZE
+        self._normalizer = normalizer_for(vendor) if enabled else None
+        self._raw = ConfigWriter() if enabled and settings.BACKUP_STORE_RAW else None
+        self._partial = b""
+        self._changes = None
+        if self._normalizer is not None and self._normalizer.lossy:
+            # Stored bytes keep the masked values: compared with the base by ChangeDigest
+            self._changes = ChangeDigest(self._normalizer)
+            self._base_path = base_path
+            base_path = None
+        self._writer = ConfigWriter(base_path, keep=keep)
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        if self._raw is not None:
+            self._raw.write(chunk)
+        if self._normalizer is None:
+            self._writer.write(chunk)
+            return
+        if self._changes is not None:
+            self._changes.write(chunk)
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        out = []
+        for line in lines:
+            kept = self._normalizer.line(line, mask=False)
+            if kept is not None:
+                out.append(kept + b"\n")
+        self._writer.write(b"".join(out))
+
+    def _same_as_base(self) -> bool:
+        if not self._base_path or not os.path.exists(self._base_path):
+            return False
+        base = ChangeDigest(self._normalizer)
+        for chunk in iter_config(self._base_path):
+            base.write(chunk)
+        # a base stored with masked values is replaced by one that has them
+        return base.hexdigest() == self._changes.hexdigest() and not base.premasked
+
+    def commit(self) -> StoredConfig:
+        if self._partial:
+            kept = self._normalizer.line(self._partial, mask=False)
+            self._partial = b""
+            if kept is not None:
+                self._writer.write(kept)
+        if self._changes is not None and self._same_as_base():
+            size = self._writer.size
+            self.abort()
+            return StoredConfig(path=self._base_path, sha256=self._changes.hexdigest(), size=size, unchanged=True)
+        stored = self._writer.commit()
+        if self._raw is None:
+            return stored
+        if stored.unchanged:
+            # Only new versions get a raw copy
+            self._raw.abort()
+            return stored
+        raw = self._raw.commit()
+        return replace(stored, raw=raw if raw.sha256 != stored.sha256 else None)
+
+    def abort(self):
+        self._writer.abort()
+        if self._raw is not None:
+            self._raw.abort()
@@ -0,0 +1,73 @@
+"""
+Fleet-wide TCP reachability sweep.
+
+One short asyncio connect to each device's ip:port, many at once. It runs
+as the pre-flight stage of run_backup, so a device that is down costs one
+REACHABILITY_TIMEOUT instead of a full netmiko/telnetlib timeout plus
+retries, and it backs the /devices/reachability endpoint.
+
+Results are cached per ip:port for REACHABILITY_CACHE_TTL seconds. The cache
+only holds plain values and is only touched from the event loop.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+
+from ..settings import settings
+
+
+@dataclass(frozen=True)
+class Reachability:
+    reachable: bool
+    latency_ms: float | None  # TCP handshake time
+    error: str | None
+    checked_at: float  # time.time()
+
+
+_cache: dict[tuple[str, int], Reachability] = {}
+
+
+def cached(host: str, port: int) -> Reachability | None:
+    result = _cache.get((host, port))
+    if result is None or time.time() - result.checked_at > settings.REACHABILITY_CACHE_TTL:
+        return None
+    return result
+
+
+def clear_cache():
+    _cache.clear()
+
+
+async def check(host: str, port: int, timeout: float | None = None) -> Reachability:
+    timeout = timeout or settings.REACHABILITY_TIMEOUT
+    started = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+    except asyncio.TimeoutError:
+        return Reachability(False, None, f"no answer within {timeout:g}s", time.time())
+    except OSError as e:
+        return Reachability(False, None, e.strerror or str(e), time.time())
+    latency = (time.monotonic() - started) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return Reachability(True, round(latency, 1), None, time.time())
+
+
+async def sweep(targets, refresh: bool = False) -> dict[tuple[str, int], Reachability]:
+    """Check every (host, port) in targets, REACHABILITY_CONCURRENCY at a time."""
+    sem = asyncio.Semaphore(max(1, settings.REACHABILITY_CONCURRENCY))
+    results: dict[tuple[str, int], Reachability] = {}
+
+    async def one(host: str, port: int):
+        result = None if refresh else cached(host, port)
+        if result is None:
+            async with sem:
+                result = await check(host, port)
+            _cache[(host, port)] = result
+        results[(host, port)] = result
+
+    await asyncio.gather(*(one(host, port) for host, port in set(targets)))
+    return results
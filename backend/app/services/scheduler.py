@@ -1,16 +1,14 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from datetime import datetime, time
+from datetime import datetime
 from ..utils.timeutil import tznow
 from ..settings import settings
 from ..database import SessionLocal
-from ..models import Schedule, Device, Job, Backup
-from ..utils.crypto import dec
-from .netmiko_worker import fetch_running_config
+from ..models import Schedule, Device, Job
+from . import job_controller
+from .collector import SCHEDULED
 from .audit_log import audit_event
-from hashlib import sha256
 import pytz
-import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,32 +18,19 @@ scheduler = AsyncIOScheduler(timezone=pytz.timezone(settings.TIMEZONE))
 
 async def run_scheduled_backup(schedule_id: int, schedule_name: str):
     """
-    Execute a scheduled backup job for a specific schedule.
-    This function runs the actual backup logic.
+    Queue a backup job for a schedule's devices (APScheduler entry point).
+    The job itself runs on the job worker (see job_controller).
     """
     db = SessionLocal()
     try:
-        # Create job record
-        job = Job(
-            triggered_by=f"schedule:{schedule_name}",
-            status="running"
-        )
-        db.add(job)
-        db.commit()
-        db.refresh(job)
-        
-        job_id = job.id  # Extract job_id before session operations
-        
         log_lines = []
-        log_lines.append(f"Scheduled job started at {job.started_at.isoformat()}")
         log_lines.append(f"Schedule: {schedule_name}")
         
         # Get schedule configuration to filter devices
         schedule = db.query(Schedule).filter_by(id=schedule_id).first()
         if not schedule:
             log_lines.append(f"ERROR: Schedule {schedule_id} not found")
-            job.status = "failed"
-            job.log = "\n".join(log_lines)
+            db.add(Job(triggered_by=f"schedule:{schedule_name}", status="failed", finished_at=tznow(), log="\n".join(log_lines)))
             db.commit()
             return
         
@@ -70,83 +55,12 @@ async def run_scheduled_backup(schedule_id: int, schedule_name: str):
             log_lines.append(f"Target: All enabled devices")
             devices = query.all()
         
-        log_lines.append(f"Processing {len(devices)} device(s)...")
-        
-        # Extract device info with decrypted credentials
-        device_list = []
-        for d in devices:
-            device_list.append({
-                'id': d.id,
-                'hostname': d.hostname,
-                'ip': d.ip,
-                'vendor': d.vendor,
-                'protocol': d.protocol,
-                'port': d.port,
-                'username': dec(d.username_enc),
-                'password': dec(d.password_enc),
-                'secret': dec(d.secret_enc) if d.secret_enc else None,
-            })
-        
-        ok = 0
-        for idx, device_info in enumerate(device_list):
-            try:
-                log_lines.append(f"[{device_info['hostname']}] Connecting to {device_info['ip']}...")
-                path, content = fetch_running_config(
-                    vendor=device_info['vendor'], 
-                    host=device_info['ip'], 
-                    username=device_info['username'],
-                    password=device_info['password'], 
-                    secret=device_info['secret'],
-                    protocol=device_info['protocol'], 
-                    port=device_info['port']
-                )
-                b = Backup(
-                    device_id=device_info['id'], 
-                    size_bytes=len(content),
-                    hash=sha256(content).hexdigest()[:8], 
-                    path=str(path)
-                )
-                db.add(b)
-                ok += 1
-                db.commit()
-                log_lines.append(f"[{device_info['hostname']}] Backup success ({len(content)} bytes, path={path})")
-                
-                # Delay between devices (rate limiting)
-                if idx < len(device_list) - 1:
-                    log_lines.append(f"[{device_info['hostname']}] Waiting 3s before next device...")
-                    await asyncio.sleep(3)
-                
-            except Exception as e:
-                log_lines.append(f"[{device_info['hostname']}] Backup failed: {str(e)}")
-                if idx < len(device_list) - 1:
-                    await asyncio.sleep(2)
-        
-        # Update job status - re-query to avoid detached instance
-        log_lines.append(f"Job completed: {ok}/{len(device_list)} successful")
-        
-        job = db.query(Job).filter_by(id=job_id).first()
-        if job:
-            job.status = "success"
-            job.devices = ok
-            job.finished_at = tznow()
-            job.log = "\n".join(log_lines)
-            db.commit()
-        
-        # Audit log
-        audit_event(
-            user="system",
-            action="job_run_scheduled",
-            target=f"schedule:{schedule_name}",
-            result=f"success ({ok}/{len(device_list)} devices)"
-        )
+        job_controller.enqueue(db, f"schedule:{schedule_name}", [d.id for d in devices], log_lines=log_lines,
+                               priority=SCHEDULED)
         
     except Exception as e:
         # Handle unexpected errors
-        if 'job' in locals():
-            job.status = "failed"
-            job.finished_at = tznow()
-            job.log = f"Job failed: {str(e)}"
-            db.commit()
+        db.rollback()
         audit_event(
             user="system",
             action="job_run_scheduled",
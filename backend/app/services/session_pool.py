@@ -0,0 +1,132 @@
+"""
+Keyed pool of authenticated device sessions.
+
+Opening a session (TCP + login + enable + paging) is often the most
+expensive part of a small fetch, and a /devices/{id}/test probe is usually
+followed by a real backup. fetch_running_config checks a session out of
+this pool by key, and hands it back when the command succeeded, so the next
+operation on the same device within SESSION_POOL_IDLE_TTL skips the handshake.
+
+A checked-out session is owned by one caller; the pool only holds idle ones.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable
+
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PooledSession:
+    conn: Any
+    alive: Callable[[], bool]
+    close: Callable[[], None]
+    prompt: bytes | None = None
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SessionPool:
+    """Idle sessions keyed by device + credentials, with idle TTL, max size and health check."""
+
+    def __init__(self, max_size: int, idle_ttl: float):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._idle: dict[Hashable, PooledSession] = {}
+        self._lock = threading.Lock()
+        self._reaper: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.idle_ttl > 0
+
+    def acquire(self, key: Hashable) -> PooledSession | None:
+        """Check out a healthy idle session for key, or None (caller connects)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            session = self._idle.pop(key, None)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_used > self.idle_ttl or not self._healthy(session):
+            self._close(session)
+            return None
+        return session
+
+    def release(self, key: Hashable, session: PooledSession):
+        """Return a session after a successful operation."""
+        if not self.enabled:
+            self._close(session)
+            return
+        session.last_used = time.monotonic()
+        evicted = []
+        with self._lock:
+            old = self._idle.pop(key, None)
+            if old is not None:
+                evicted.append(old)
+            self._idle[key] = session
+            # dict keeps insertion order: the oldest release goes first
+            while len(self._idle) > self.max_size:
+                evicted.append(self._idle.pop(next(iter(self._idle))))
+            self._start_reaper()
+        for s in evicted:
+            self._close(s)
+
+    def discard(self, session: PooledSession):
+        """Close a checked-out session that must not be reused."""
+        self._close(session)
+
+    def reap(self):
+        """Close sessions idle for longer than the TTL."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, s in self._idle.items() if now - s.last_used > self.idle_ttl]
+            sessions = [self._idle.pop(k) for k in expired]
+        for s in sessions:
+            self._close(s)
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._idle.values())
+            self._idle.clear()
+        for s in sessions:
+            self._close(s)
+
+    def __len__(self):
+        return len(self._idle)
+
+    def _start_reaper(self):
+        # called with the lock held
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name="session-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_ttl / 2))
+            self.reap()
+            with self._lock:
+                if not self._idle:
+                    self._reaper = None
+                    return
+
+    @staticmethod
+    def _healthy(session: PooledSession) -> bool:
+        try:
+            return bool(session.alive())
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(session: PooledSession):
+        try:
+            session.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled session: {e}")
+
+
+pool = SessionPool(max_size=settings.SESSION_POOL_SIZE, idle_ttl=settings.SESSION_POOL_IDLE_TTL)
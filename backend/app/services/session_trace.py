@@ -0,0 +1,128 @@
+"""
+In-memory session logs, kept only when a fetch fails.
+
+A SessionTrace is a bounded ring buffer holding the last SESSION_LOG_BYTES
+of one fetch's device dialogue: what netmiko reads (through
+NetmikoSessionLog) and what the Telnet/asyncssh paths read and send.
+Nothing touches the disk while the fetch runs, and two fetches to the same
+host each have their own trace.
+
+When the collector gives up on a device, save() stores the trace as a
+FetchDiagnostic row tied to the job and the device (see
+GET /jobs/{id}/diagnostics). Passwords and secrets are masked.
+"""
+from collections import deque
+
+from netmiko.session_log import SessionLog
+from sqlalchemy.orm import Session
+
+from ..models import FetchDiagnostic
+from ..settings import settings
+
+MASK = "********"
+
+
+class SessionTrace:
+    """Last max_bytes of a session's dialogue."""
+
+    def __init__(self, max_bytes: int | None = None, secrets: tuple[str | None, ...] = ()):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.SESSION_LOG_BYTES
+        self.dropped = 0
+        self._chunks: deque[bytes] = deque()
+        self._size = 0
+        self._secrets = [s.encode() for s in secrets if s]
+        self._pending = b""  # tail that may be the start of a secret split across writes
+
+    def mask(self, *secrets: str | None):
+        """Mask these values in everything written from now on."""
+        for s in secrets:
+            if s and s.encode() not in self._secrets:
+                self._secrets.append(s.encode())
+
+    def write(self, data: bytes | str):
+        if not data:
+            return
+        if isinstance(data, str):
+            data = data.encode(errors="replace")
+        data = self._pending + data
+        for secret in self._secrets:
+            data = data.replace(secret, MASK.encode())
+        held = self._held_back(data)
+        data, self._pending = data[:len(data) - held], data[len(data) - held:]
+        if not data:
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.max_bytes and self._chunks:
+            excess = self._size - self.max_bytes
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._size -= len(head)
+                self.dropped += len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._size -= excess
+                self.dropped += excess
+
+    def _held_back(self, data: bytes) -> int:
+        """Length of the longest tail of data that a secret starts with (it may end in the next write)."""
+        longest = 0
+        for secret in self._secrets:
+            for n in range(min(len(secret) - 1, len(data)), longest, -1):
+                if secret.startswith(data[-n:]):
+                    longest = n
+                    break
+        return longest
+
+    def sent(self, command: str):
+        """Record something we typed (the device may or may not echo it)."""
+        self.write(f"\n>>> {command}\n")
+
+    def note(self, text: str):
+        self.write(f"\n--- {text} ---\n")
+
+    def getvalue(self) -> str:
+        head = f"[... {self.dropped} earlier bytes dropped ...]\n" if self.dropped else ""
+        return head + b"".join((*self._chunks, self._pending)).decode(errors="replace")
+
+
+class NetmikoSessionLog(SessionLog):
+    """
+    netmiko session_log that writes into a SessionTrace instead of a file.
+
+    It stays attached to a pooled connection, so each fetch points target at
+    its own trace (or None to drop the output).
+    """
+
+    def __init__(self, target: SessionTrace | None = None):
+        super().__init__()
+        self.target = target
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def write(self, data: str) -> None:
+        if self.target is not None:
+            self.target.write(data)
+
+
+def save(db: Session, device_id: int, error: str, trace: SessionTrace, job_id: int | None = None):
+    """Store a failed fetch's trace; keeps the last SESSION_LOG_KEEP per device. Caller commits."""
+    db.add(FetchDiagnostic(job_id=job_id, device_id=device_id, error=error[:512], session_log=trace.getvalue()))
+    db.flush()
+    stale = (
+        db.query(FetchDiagnostic.id)
+        .filter(FetchDiagnostic.device_id == device_id)
+        .order_by(FetchDiagnostic.id.desc())
+        .offset(max(1, settings.SESSION_LOG_KEEP))
+        .all()
+    )
+    if stale:
+        db.query(FetchDiagnostic).filter(FetchDiagnostic.id.in_([row.id for row in stale])).delete(synchronize_session=False)
@@ -0,0 +1,168 @@
+"""
+Per-vendor collector profiles.
+
+One VendorProfile per netmiko device type holds everything the SSH, Telnet
+and asyncssh paths need to know about a platform: the config command, the
+CLI dialogue (prompt regexes, paging command, login/command timeouts), how
+hard netmiko may push it (fast_cli, delay_factor) and how big its configs
+usually get.
+
+Devices carry the vendor name picked in the UI ("Juniper (JunOS)"); those
+map to a profile through VENDOR_NAMES, and free-text or legacy names fall
+back to the device type itself, keyword matching, then cisco_ios.
+
+The built-in table can be tuned per platform without a code change:
+VENDOR_PROFILES_FILE points at a JSON object of device type -> field
+overrides, read once at startup by load(), e.g.
+
+    {"cisco_ios": {"fast_cli": true}, "huawei_olt": {"delay_factor": 2}}
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass, field, fields, replace
+
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+# CLI prompt patterns (Telnet and interactive SSH shells). expect() searches the whole pending buffer, so the
+# CLI prompt is anchored to the end of it: a line that does not start with a
+# banner character and ends in one of the usual prompt terminators.
+_LOGIN_PROMPT = re.compile(rb"(?i)(user ?name|login|user)\s*:\s*$")
+_PASSWORD_PROMPT = re.compile(rb"(?i)pass(word)?\s*:\s*$")
+_CLI_PROMPT = re.compile(rb"(?:^|[\r\n])[^\r\n\s#*=!-][^\r\n]{0,80}?[>#$%\]][ \t]*$")
+# Huawei: <HOST> or [HOST]; MikroTik: [admin@HOST] >
+_HUAWEI_PROMPT = re.compile(rb"(?:^|[\r\n])[<\[][^\r\n]{1,80}[>\]][ \t]*$")
+_MIKROTIK_PROMPT = re.compile(rb"(?:^|[\r\n])\[[^\r\n]{1,80}\][ \t]*>[ \t]*$")
+
+
+@dataclass(frozen=True)
+class CliPrompts:
+    """Per-vendor CLI dialogue: prompt regexes, paging command and timeouts."""
+    cli: re.Pattern = _CLI_PROMPT
+    login: re.Pattern = _LOGIN_PROMPT
+    password: re.Pattern = _PASSWORD_PROMPT
+    paging_cmd: str | None = "terminal length 0"
+    login_timeout: float = 15
+    command_timeout: float = 10
+
+
+@dataclass(frozen=True)
+class VendorProfile:
+    device_type: str  # netmiko device_type, also the profile key
+    config_command: str = "show running-config"
+    prompts: CliPrompts = field(default_factory=CliPrompts)
+    # netmiko fast_cli: shorter fixed waits. Only for platforms that keep up.
+    fast_cli: bool = False
+    # netmiko global_delay_factor; also stretches the Telnet/asyncssh dialogue waits
+    delay_factor: float = 1.0
+    # Typical config size in bytes
+    expected_size: int = 128 * 1024
+
+    @property
+    def transfer_timeout(self) -> float:
+        """Default wait for command output when there is no fetch history (see adaptive_timeouts)."""
+        # Big-config platforms take a while to render before the first byte
+        return max(60.0, self.expected_size / 10_000)
+
+    @property
+    def idle_timeout(self) -> float:
+        """Quiet time after which a read without a recognised prompt gives up."""
+        return 3.0 * self.delay_factor
+
+
+_HUAWEI = CliPrompts(cli=_HUAWEI_PROMPT, paging_cmd="screen-length 0 temporary", login_timeout=30)
+_MIKROTIK = CliPrompts(cli=_MIKROTIK_PROMPT, paging_cmd=None)
+
+PROFILES: dict[str, VendorProfile] = {p.device_type: p for p in (
+    VendorProfile("cisco_ios"),
+    VendorProfile("cisco_asa"),
+    VendorProfile("cisco_nxos", expected_size=512 * 1024),
+    VendorProfile("cisco_wlc_ssh"),
+    # AOS-CX and JunOS answer promptly and handle netmiko's fast mode
+    VendorProfile("aruba_aoscx", prompts=CliPrompts(paging_cmd="no page"), fast_cli=True),
+    VendorProfile("aruba_os", prompts=CliPrompts(paging_cmd="no page")),
+    VendorProfile("juniper", "show configuration", CliPrompts(paging_cmd="set cli screen-length 0"), fast_cli=True),
+    VendorProfile("mikrotik_routeros", "/export", _MIKROTIK, expected_size=64 * 1024),
+    VendorProfile("mikrotik_switchos", "/export", _MIKROTIK, expected_size=16 * 1024),
+    VendorProfile("huawei", "display current-configuration", _HUAWEI),
+    VendorProfile("huawei_olt", "display current-configuration", _HUAWEI, expected_size=2 * 1024 * 1024),
+    VendorProfile("huawei_smartax", "display current-configuration", _HUAWEI, expected_size=2 * 1024 * 1024),
+    VendorProfile("fortinet", "show", CliPrompts(paging_cmd=None), expected_size=1024 * 1024),
+)}
+
+DEFAULT_PROFILE = "cisco_ios"
+
+# Vendor names offered by the UI
+VENDOR_NAMES = {
+    "Cisco (IOS Router/Switch)": "cisco_ios",
+    "Cisco (ASA Firewall)": "cisco_asa",
+    "Cisco (NXOS Data Center)": "cisco_nxos",
+    "Cisco (WLC Controller)": "cisco_wlc_ssh",
+    "Allied Telesis (AWPlus)": "cisco_ios",
+    "Aruba (AOS-CX Switch)": "aruba_aoscx",
+    "Aruba (AOS AP/Controller)": "aruba_os",
+    "MikroTik (RouterOS)": "mikrotik_routeros",
+    "MikroTik (SwitchOS)": "mikrotik_switchos",
+    "Huawei (Switch/AP)": "huawei",
+    "Huawei (OLT)": "huawei_olt",
+    "Huawei (SmartAX)": "huawei_smartax",
+    "Fortinet (FortiGate)": "fortinet",
+    "Juniper (JunOS)": "juniper",
+    # legacy
+    "Cisco": "cisco_ios",
+    "Juniper": "juniper",
+    "Mikrotik": "mikrotik_routeros",
+    "Fortinet": "fortinet",
+}
+
+# Anything else: first keyword found in the lower-cased vendor name
+_KEYWORDS = (
+    (("mikrotik",), "mikrotik_routeros"),
+    (("juniper", "junos"), "juniper"),
+    (("fortinet", "fortigate"), "fortinet"),
+    (("huawei",), "huawei"),
+    (("aoscx", "aos-cx"), "aruba_aoscx"),
+    (("aruba",), "aruba_os"),
+)
+
+_PROMPT_FIELDS = {"paging_cmd", "login_timeout", "command_timeout"}
+_PROFILE_FIELDS = {f.name for f in fields(VendorProfile)} - {"device_type", "prompts"}
+
+
+def profile_for(vendor: str | None) -> VendorProfile:
+    key = VENDOR_NAMES.get(vendor or "")
+    if key is None and vendor in PROFILES:
+        key = vendor
+    if key is None:
+        vendor_lower = (vendor or "").lower()
+        key = next(
+            (k for words, k in _KEYWORDS if any(w in vendor_lower for w in words)),
+            DEFAULT_PROFILE,
+        )
+    return PROFILES.get(key) or PROFILES[DEFAULT_PROFILE]
+
+
+def apply_overrides(overrides: dict) -> None:
+    """Merge {device_type: {field: value}} into PROFILES; unknown device types start from the default."""
+    for device_type, values in overrides.items():
+        if not isinstance(values, dict):
+            raise Exception(f"Vendor profile {device_type}: expected an object")
+        unknown = set(values) - _PROFILE_FIELDS - _PROMPT_FIELDS
+        if unknown:
+            raise Exception(f"Vendor profile {device_type}: unknown field(s) {', '.join(sorted(unknown))}")
+        base = PROFILES.get(device_type) or replace(PROFILES[DEFAULT_PROFILE], device_type=device_type)
+        prompt_values = {k: v for k, v in values.items() if k in _PROMPT_FIELDS}
+        profile_values = {k: v for k, v in values.items() if k in _PROFILE_FIELDS}
+        PROFILES[device_type] = replace(base, prompts=replace(base.prompts, **prompt_values), **profile_values)
+
+
+def load(path: str | None = None) -> None:
+    """Apply VENDOR_PROFILES_FILE (or path) once at startup."""
+    path = path or settings.VENDOR_PROFILES_FILE
+    if not path:
+        return
+    with open(path, encoding="utf-8") as f:
+        apply_overrides(json.load(f))
+    logger.info(f"Vendor profile overrides loaded from {path}")
@@ -9,6 +9,93 @@ class Settings(BaseSettings):
     DB_URL: str = "sqlite:///./abs.db"
     TIMEZONE: str = "Asia/Jakarta"
     BACKUP_DIR: str = "./backups"
+    # Codec for stored configs: "gzip" or "none"; existing files of either kind stay readable
+    BACKUP_COMPRESSION: str = "gzip"
+    BACKUP_COMPRESSION_LEVEL: int = 6
+    # Strip volatile lines (timestamps, checksums, ...) per vendor before hashing
+    # (see services/normalize); BACKUP_STORE_RAW also keeps the output as received
+    BACKUP_NORMALIZE: bool = True
+    BACKUP_STORE_RAW: bool = False
+    # "full" stores every version as a blob; "delta" keeps only the latest full
+    # and older versions as reverse deltas, at most BACKUP_DELTA_MAX_CHAIN in a row
+    BACKUP_STORAGE_MODE: str = "full"
+    BACKUP_DELTA_MAX_CHAIN: int = 10
+    BACKUP_REBUILD_CACHE_SIZE: int = 32
+    # Blobs no backup uses any more are deleted this many seconds after they were
+    # released, so a job that just stored the same content can still reference them
+    BACKUP_BLOB_GRACE: int = 3600
+    # Skip the full config pull when a cheap per-vendor probe reports no change,
+    # but pull in full at least every CHANGE_PROBE_FULL_EVERY runs
+    CHANGE_PROBE_ENABLED: bool = True
+    CHANGE_PROBE_FULL_EVERY: int = 7
+    # Per-device timeouts from the last ADAPTIVE_TIMEOUT_HISTORY successful runs:
+    # p99 * ADAPTIVE_TIMEOUT_MARGIN plus some slack, capped at ADAPTIVE_TIMEOUT_MAX
+    ADAPTIVE_TIMEOUTS: bool = True
+    ADAPTIVE_TIMEOUT_HISTORY: int = 50
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES: int = 5
+    ADAPTIVE_TIMEOUT_MARGIN: float = 1.5
+    ADAPTIVE_TIMEOUT_MAX: float = 600
+    # Retries for transient fetch errors: RETRY_BACKOFF_BASE * 2^n seconds between attempts
+    RETRY_ATTEMPTS: int = 2
+    RETRY_BACKOFF_BASE: float = 2
+    RETRY_BACKOFF_MAX: float = 30
+    # Skip a device after BREAKER_THRESHOLD failed runs in a row; try again after BREAKER_COOLDOWN seconds
+    BREAKER_THRESHOLD: int = 5
+    BREAKER_COOLDOWN: int = 21600
+    # TCP reachability sweep (backup pre-flight and /devices/reachability)
+    REACHABILITY_PREFLIGHT: bool = True
+    REACHABILITY_TIMEOUT: float = 2
+    REACHABILITY_CONCURRENCY: int = 512
+    REACHABILITY_CACHE_TTL: int = 60
+    # Bulk device test results (POST /devices/test) are reused for this many seconds
+    DEVICE_TEST_CACHE_TTL: int = 300
+    # Collector concurrency: global cap, per-vendor cap and per-target-host cap
+    # (console servers expose many devices on one IP, so keep that one small).
+    COLLECTOR_MAX_WORKERS: int = 16
+    COLLECTOR_PER_VENDOR_LIMIT: int = 8
+    COLLECTOR_PER_HOST_LIMIT: int = 2
+    # Global slots scheduled runs may not take, so interactive and manual work starts at once
+    COLLECTOR_RESERVED_SLOTS: int = 2
+    # JSON file of per-platform overrides for the built-in vendor profiles
+    # (fast_cli, delay_factor, config_command, ...; see services/vendor_profiles)
+    VENDOR_PROFILES_FILE: str = ""
+    # Decrypted device credentials are cached this many seconds (0 = decrypt every time)
+    CREDENTIAL_CACHE_TTL: int = 300
+    CREDENTIAL_CACHE_SIZE: int = 256
+    # Session logs live in a per-fetch ring buffer of SESSION_LOG_BYTES and are
+    # only stored (last SESSION_LOG_KEEP per device) when a fetch fails
+    SESSION_LOG_BYTES: int = 64 * 1024
+    SESSION_LOG_KEEP: int = 5
+    # Durable job queue: a running job's lease is renewed every JOB_HEARTBEAT_SECONDS;
+    # a job whose lease ran out (worker died) is requeued up to JOB_MAX_ATTEMPTS claims
+    JOB_LEASE_SECONDS: int = 120
+    JOB_HEARTBEAT_SECONDS: int = 20
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_POLL_INTERVAL: float = 5
+    # Jobs a worker runs at once, of which at most JOB_BULK_CONCURRENCY scheduled ones;
+    # one place is only for interactive jobs
+    JOB_CONCURRENCY: int = 3
+    JOB_BULK_CONCURRENCY: int = 1
+    # A device already queued or running in another job is not fetched again:
+    # the new job shares that job's result for it
+    JOB_COALESCE: bool = True
+    # After a cancel, in-flight sessions get this many seconds to stop before they are abandoned
+    JOB_CANCEL_GRACE: float = 10
+    # A running job's log lines and progress are written to job_events every
+    # JOB_EVENT_BATCH lines or JOB_EVENT_FLUSH_SECONDS; /jobs/{id}/events polls them every JOB_STREAM_POLL.
+    # Device results go to job_results in bulk inserts of JOB_EVENT_BATCH rows
+    JOB_EVENT_BATCH: int = 50
+    JOB_EVENT_FLUSH_SECONDS: float = 1
+    JOB_STREAM_POLL: float = 1
+    # Events of an ended job repeat its log; they are deleted this many seconds after it ended
+    JOB_EVENT_RETENTION: int = 3600
+    # SSH transport: "netmiko" (thread per session) or "asyncssh" (event loop);
+    # a device's own transport field overrides this
+    COLLECTOR_TRANSPORT: str = "netmiko"
+    # Authenticated sessions kept for reuse by back-to-back operations on a
+    # device (0 disables the pool)
+    SESSION_POOL_SIZE: int = 32
+    SESSION_POOL_IDLE_TTL: int = 60
     class Config: env_file = ".env"
 
 settings = Settings()
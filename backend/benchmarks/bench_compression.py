@@ -0,0 +1,97 @@
+"""
+Disk space and throughput of the backup store per compression setting.
+
+Writes a set of synthetic device configs through ConfigWriter (the same path
+the collector uses) with each codec/level, then reads them back through
+open_config, and prints a table.
+
+Usage (from backend/):
+    python -m benchmarks.bench_compression [--devices 200] [--lines 4000]
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from app.services import backup_store
+from app.services.backup_store import ConfigWriter, open_config
+
+SETTINGS = [("none", 0), ("gzip", 1), ("gzip", 6), ("gzip", 9)]
+
+
+def make_config(rng: random.Random, lines: int) -> bytes:
+    """IOS-like running-config: mostly repeated interface stanzas."""
+    out = [f"hostname SW-{rng.randint(1, 9999)}", "!", "service timestamps log datetime msec", "!"]
+    i = 0
+    while len(out) < lines:
+        out += [
+            f"interface GigabitEthernet1/0/{i}",
+            f" description {rng.choice(['access', 'uplink', 'printer', 'ap'])}-{rng.randint(1, 500)}",
+            f" switchport access vlan {rng.choice([10, 20, 30, 99])}",
+            " switchport mode access",
+            " spanning-tree portfast",
+            "!",
+        ]
+        i += 1
+    out.append("end")
+    return ("\n".join(out) + "\n").encode()
+
+
+def run(configs: list[bytes], codec: str, level: int, root: Path) -> dict:
+    backup_store.settings.BACKUP_DIR = str(root)
+    backup_store.settings.BACKUP_COMPRESSION = codec
+    backup_store.settings.BACKUP_COMPRESSION_LEVEL = level
+
+    started = time.perf_counter()
+    paths = []
+    for cfg in configs:
+        writer = ConfigWriter()
+        for i in range(0, len(cfg), 1 << 14):
+            writer.write(cfg[i:i + (1 << 14)])
+        paths.append(writer.commit().path)
+    write_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for path in paths:
+        with open_config(path) as f:
+            while f.read(1 << 16):
+                pass
+    read_s = time.perf_counter() - started
+
+    return {
+        "disk": sum(Path(p).stat().st_size for p in paths),
+        "write_s": write_s,
+        "read_s": read_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=4000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    configs = [make_config(rng, args.lines) for _ in range(args.devices)]
+    raw = sum(len(c) for c in configs)
+    mb = raw / 1e6
+    print(f"{args.devices} configs, {mb:.1f} MB uncompressed\n")
+    print(f"{'setting':<10} {'disk MB':>8} {'ratio':>6} {'write MB/s':>11} {'read MB/s':>10}")
+
+    for codec, level in SETTINGS:
+        root = Path(tempfile.mkdtemp(prefix="bench-store-"))
+        try:
+            r = run(configs, codec, level, root)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        name = codec if codec == "none" else f"{codec}-{level}"
+        print(
+            f"{name:<10} {r['disk'] / 1e6:>8.2f} {raw / r['disk']:>5.1f}x "
+            f"{mb / r['write_s']:>11.0f} {mb / r['read_s']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
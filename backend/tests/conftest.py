@@ -65,6 +65,17 @@ def setup_test_db():
     database.SessionLocal = original_sessionlocal
 
 
+@pytest.fixture(autouse=True)
+def no_reachability_preflight(monkeypatch):
+    """
+    Collector tests fake the fetch layer with made-up IPs; the TCP pre-flight
+    would mark them all unreachable. Tests that exercise it turn it back on.
+    """
+    from app.services import reachability
+    monkeypatch.setattr(reachability.settings, "REACHABILITY_PREFLIGHT", False)
+    reachability.clear_cache()
+
+
 @pytest.fixture(scope="function")
 def client():
     """
@@ -118,3 +129,62 @@ def viewer_headers(viewer_token):
     Get authorization headers with viewer token.
     """
     return {"Authorization": f"Bearer {viewer_token}"}
+
+
+class FakeFleet:
+    """
+    Stand-in for netmiko_worker.fetch_running_config: writes a small config per
+    host and reports fixed timings. Hosts in `down` time out, hosts in `slow`
+    take `delay` seconds.
+    """
+
+    def __init__(self, tmp_path, down=("10.0.0.3",), slow=(), delay=0.15):
+        self.tmp_path = tmp_path
+        self.down = down
+        self.slow = slow
+        self.delay = delay
+
+    def fetch(self, *, host, base_path=None, timing=None, **kwargs):
+        import time
+
+        from app.services.backup_store import StoredConfig
+
+        if timing is not None:
+            timing.connect_s, timing.auth_s, timing.transfer_s = 0.5, 0.25, 1.5
+        if host in self.slow:
+            time.sleep(self.delay)
+        if host in self.down:
+            raise Exception(f"Connection failed: {host} | Error: timed out")
+        path = self.tmp_path / f"{host}.cfg"
+        path.write_bytes(b"hostname x")
+        digest = host.replace(".", "").ljust(64, "0")
+        return StoredConfig(path=str(path), sha256=digest, size=10, unchanged=base_path is not None)
+
+
+def add_devices(db, ids):
+    """Add devices sw<i> at 10.0.0.<i> with credentials."""
+    from app.models import Device
+    from app.utils.crypto import enc
+
+    for i in ids:
+        db.add(Device(id=i, hostname=f"sw{i}", ip=f"10.0.0.{i}", vendor="Cisco", protocol="SSH", port=22,
+                      username_enc=enc("u"), password_enc=enc("p")))
+    db.commit()
+
+
+@pytest.fixture(scope="function")
+def db(monkeypatch, tmp_path):
+    """
+    Session with devices sw1-sw3 for the job tests, fetched by a FakeFleet where
+    10.0.0.3 times out. No change probe, no retries, no audit events.
+    """
+    from app.services import collector, job_controller, netmiko_worker
+
+    monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+    monkeypatch.setattr(collector.settings, "RETRY_ATTEMPTS", 0)
+    monkeypatch.setattr(job_controller, "audit_event", lambda **kwargs: None)
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", FakeFleet(tmp_path).fetch)
+    db = TestSessionLocal()
+    add_devices(db, (1, 2, 3))
+    yield db
+    db.close()
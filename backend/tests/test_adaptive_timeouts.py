@@ -0,0 +1,170 @@
+"""
+Tests for adaptive per-device timeouts.
+
+Tests cover:
+1. Deriving timeouts from samples (p99 + margin, floor, cap, minimum history)
+2. Recording samples and the history window
+3. Timings measured by the Telnet driver, the learned transfer timeout between
+   output chunks, and a silent device failing fast
+4. run_backup records a sample per successful fetch
+"""
+import asyncio
+import socket
+import time
+
+import pytest
+
+from app.models import FetchSample
+from app.services import adaptive_timeouts, collector, netmiko_worker, vendor_profiles
+from app.services.adaptive_timeouts import p99, record, timeouts_for
+from app.services.backup_store import StoredConfig, open_config
+from app.services.netmiko_worker import FetchTiming, Timeouts, _connect_telnet_manual
+
+from .conftest import TestSessionLocal
+from .test_telnet_driver import FakeTelnetDevice
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUTS", True)
+    monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUT_HISTORY", 50)
+    monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUT_MIN_SAMPLES", 5)
+    monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUT_MARGIN", 1.5)
+    monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUT_MAX", 600)
+    session = TestSessionLocal()
+    yield session
+    session.close()
+
+
+def _samples(db, device_id, n, connect=None, auth=None, transfer=None):
+    for _ in range(n):
+        record(db, device_id, FetchTiming(connect_s=connect, auth_s=auth, transfer_s=transfer), 1000)
+    db.commit()
+
+
+class TestDerive:
+    """Tests for timeouts_for."""
+
+    def test_p99_nearest_rank(self):
+        assert p99([1.0]) == 1.0
+        assert p99([float(i) for i in range(1, 101)]) == 99.0
+        assert p99([float(i) for i in range(1, 1001)]) == 990.0
+
+    def test_too_little_history_keeps_defaults(self, db):
+        _samples(db, 1, 4, connect=0.1, transfer=1.0)
+        assert timeouts_for(db, 1) == Timeouts()
+
+    def test_fast_device_gets_short_timeouts(self, db):
+        _samples(db, 1, 20, connect=0.2, auth=0.3, transfer=0.8)
+        t = timeouts_for(db, 1)
+        assert t.connect == 3.0  # floor
+        assert t.auth == 5.0  # floor
+        assert t.transfer == 10.0  # floor
+
+    def test_big_device_gets_more_than_sixty_seconds(self, db):
+        _samples(db, 2, 19, connect=1.0, transfer=50.0)
+        _samples(db, 2, 1, connect=1.0, transfer=90.0)
+        t = timeouts_for(db, 2)
+        # p99 over 20 samples is the slowest one: 90 * 1.5 + 5
+        assert t.transfer == 140.0
+        assert t.auth is None  # netmiko: auth is part of connect
+
+    def test_cap(self, db):
+        _samples(db, 3, 10, transfer=1000.0)
+        assert timeouts_for(db, 3).transfer == 600
+
+    def test_disabled(self, db, monkeypatch):
+        _samples(db, 1, 20, connect=0.2, transfer=0.8)
+        monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUTS", False)
+        assert timeouts_for(db, 1) == Timeouts()
+
+
+class TestRecord:
+    """Tests for record."""
+
+    def test_history_window(self, db, monkeypatch):
+        monkeypatch.setattr(adaptive_timeouts.settings, "ADAPTIVE_TIMEOUT_HISTORY", 10)
+        _samples(db, 1, 25, transfer=1.0)
+        _samples(db, 2, 3, transfer=1.0)
+        assert db.query(FetchSample).filter(FetchSample.device_id == 1).count() == 10
+        assert db.query(FetchSample).filter(FetchSample.device_id == 2).count() == 3
+
+    def test_empty_timing_is_not_recorded(self, db):
+        record(db, 1, FetchTiming(), None)
+        db.commit()
+        assert db.query(FetchSample).count() == 0
+
+
+class TestTelnetTimings:
+    """Timing capture and timeouts in the Telnet driver."""
+
+    def test_timing_is_measured(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        dev = FakeTelnetDevice(outputs={b"show running-config": b"hostname R1"})
+        timing = FetchTiming()
+        netmiko_worker.fetch_running_config(
+            vendor="Cisco", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port, timing=timing,
+        )
+        assert timing.connect_s is not None and timing.connect_s < 1
+        assert timing.auth_s is not None and timing.auth_s < 1
+        assert timing.transfer_s is not None and timing.transfer_s < 1
+
+    def test_learned_transfer_timeout_covers_gaps(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        quick = vendor_profiles.VendorProfile("cisco_ios", delay_factor=0.1)  # 0.3 s idle fallback
+        monkeypatch.setattr(netmiko_worker, "profile_for", lambda vendor: quick)
+        config = b"hostname R1\r\ninterface Gi0/1\r\nend"
+        dev = FakeTelnetDevice(outputs={b"show running-config": config}, stall=(len(b"hostname R1\r\n"), 1))
+        stored = netmiko_worker.fetch_running_config(
+            vendor="Cisco", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port, timeouts=Timeouts(transfer=3),
+        )
+        with open_config(stored.path) as f:
+            assert f.read() == b"hostname R1\ninterface Gi0/1\nend\n"
+
+    def test_silent_device_fails_fast(self):
+        # accepts TCP but never prints a login prompt
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        started = time.monotonic()
+        try:
+            with pytest.raises(Exception, match="timeout"):
+                _connect_telnet_manual(
+                    vendor="Cisco", host="127.0.0.1", username="u", password="p",
+                    secret=None, port=server.getsockname()[1], session_log="",
+                    timeouts=Timeouts(connect=1, auth=1),
+                )
+        finally:
+            server.close()
+        # vendor default would wait 3 + 15 seconds
+        assert time.monotonic() - started < 4
+
+
+class TestRunBackupRecords:
+    """run_backup and the sample history."""
+
+    def test_sample_per_fetch_and_timeouts_passed(self, db, monkeypatch, tmp_path):
+        seen = []
+
+        def fake_fetch(*, host, timeouts, timing, **kwargs):
+            seen.append(timeouts)
+            timing.connect_s, timing.transfer_s = 0.5, 2.0
+            path = tmp_path / f"{host}.cfg"
+            path.write_bytes(b"hostname x")
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        device = {
+            "id": 7, "hostname": "sw7", "ip": "10.0.0.7", "vendor": "Fortinet", "protocol": "SSH",
+            "port": 22, "username": "u", "password": "p", "secret": None,
+        }
+        for _ in range(6):
+            asyncio.run(collector.run_backup(db, [device], []))
+
+        assert db.query(FetchSample).filter(FetchSample.device_id == 7).count() == 6
+        assert seen[0] == Timeouts()
+        assert seen[-1] == Timeouts(connect=3.0, transfer=10.0)
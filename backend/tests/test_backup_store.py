@@ -0,0 +1,217 @@
+"""
+Tests for config storage.
+
+Tests cover:
+1. ConfigWriter - streaming write, incremental hash, atomic rename
+2. Content-addressed blobs: dedup and the unchanged fast path
+3. Compression: gzip blobs, legacy plain blobs, gzip passthrough downloads
+4. _CliLineFilter - streaming cleanup of session output
+"""
+import gzip
+import os
+from datetime import datetime
+from hashlib import sha256
+
+from app.services import backup_store
+from app.services.backup_store import ConfigWriter, blob_path, open_config
+from app.services.netmiko_worker import _CliLineFilter
+
+
+class TestConfigWriter:
+    """Tests for ConfigWriter."""
+
+    def test_commit_hashes_incrementally_and_renames(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        chunks = [b"hostname R1\n", b"interface Gi0/1\n" * 1000, b"end\n"]
+        writer = ConfigWriter()
+        for chunk in chunks:
+            writer.write(chunk)
+        # nothing under a final name until commit
+        assert not list(tmp_path.rglob("*.cfg*"))
+
+        stored = writer.commit()
+        content = b"".join(chunks)
+        assert stored.sha256 == sha256(content).hexdigest()
+        assert stored.size == len(content)
+        assert open_config(stored.path).read() == content
+        assert stored.path == str(blob_path(stored.sha256))
+        assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [f"{stored.sha256}.cfg.gz"]
+
+    def test_abort_leaves_nothing_behind(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        writer = ConfigWriter()
+        writer.write(b"half a config")
+        writer.abort()
+        assert os.listdir(tmp_path) == []
+
+
+def _store(chunks, base_path=None):
+    writer = ConfigWriter(base_path)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.commit()
+
+
+class TestBlobStore:
+    """Tests for content addressing and the unchanged fast path."""
+
+    def test_unchanged_content_writes_nothing(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        first = _store([b"hostname R1\n", b"end\n"])
+        mtime = os.stat(first.path).st_mtime_ns
+
+        again = _store([b"hostname R1\nend\n"], base_path=first.path)
+        assert again.unchanged
+        assert again.path == first.path
+        assert again.sha256 == first.sha256
+        assert os.stat(first.path).st_mtime_ns == mtime
+        assert not list(tmp_path.glob(".tmp-*"))
+
+    def test_changed_content_diverges_from_base(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        first = _store([b"hostname R1\n", b"end\n"])
+        changed = _store([b"hostname R1\n", b"ntp server 1.1.1.1\n", b"end\n"], base_path=first.path)
+        assert not changed.unchanged
+        assert open_config(changed.path).read() == b"hostname R1\nntp server 1.1.1.1\nend\n"
+        # base is untouched
+        assert open_config(first.path).read() == b"hostname R1\nend\n"
+
+    def test_truncated_output_is_a_change(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        first = _store([b"hostname R1\nend\n"])
+        shorter = _store([b"hostname R1\n"], base_path=first.path)
+        assert not shorter.unchanged
+        assert open_config(shorter.path).read() == b"hostname R1\n"
+
+    def test_identical_configs_share_a_blob(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        a = _store([b"hostname SW\n"])
+        b = _store([b"hostname SW\n"])
+        assert a.path == b.path
+        assert len([p for p in tmp_path.rglob("*.cfg*")]) == 1
+
+
+CONFIG = b"".join(b"interface Gi0/%d\n description access\n switchport mode access\n!\n" % i for i in range(500))
+
+
+class TestCompression:
+    """Tests for compressed storage."""
+
+    def test_gzip_blob_is_smaller_and_deterministic(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        stored = _store([CONFIG])
+        assert stored.path.endswith(".cfg.gz")
+        assert stored.size == len(CONFIG)
+        assert stored.stored_size == os.path.getsize(stored.path) < len(CONFIG) // 5
+        assert gzip.decompress(open(stored.path, "rb").read()) == CONFIG
+        # mtime=0: the same config compresses to the same bytes
+        first = open(stored.path, "rb").read()
+        os.remove(stored.path)
+        assert open(_store([CONFIG]).path, "rb").read() == first
+
+    def test_unchanged_against_compressed_base(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        first = _store([CONFIG])
+        again = _store([CONFIG[:1000], CONFIG[1000:]], base_path=first.path)
+        assert again.unchanged
+
+    def test_legacy_plain_blob_still_readable_and_deduped(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(backup_store.settings, "BACKUP_COMPRESSION", "none")
+        plain = _store([CONFIG])
+        assert plain.path.endswith(".cfg")
+
+        monkeypatch.setattr(backup_store.settings, "BACKUP_COMPRESSION", "gzip")
+        assert _store([CONFIG], base_path=plain.path).unchanged
+        # same content from another device reuses the plain blob
+        assert _store([CONFIG]).path == plain.path
+        changed = _store([CONFIG + b"end\n"], base_path=plain.path)
+        assert changed.path.endswith(".cfg.gz")
+        assert open_config(changed.path).read() == CONFIG + b"end\n"
+
+
+class TestDownload:
+    """Tests for /backups/{id}/download with compressed blobs."""
+
+    def _client(self, monkeypatch, tmp_path, compression="gzip"):
+        from fastapi.testclient import TestClient
+
+        from app.api import backups
+        from app.main import app
+        from app.models import Backup, Device
+        from app.security import get_current_user
+        from .conftest import TestSessionLocal
+
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(backup_store.settings, "BACKUP_COMPRESSION", compression)
+        stored = _store([CONFIG])
+        db = TestSessionLocal()
+        db.add(Device(id=1, hostname="sw1", ip="10.0.0.1", vendor="Cisco", protocol="SSH", port=22,
+                         username_enc="", password_enc=""))
+        db.add(Backup(id=1, device_id=1, timestamp=datetime(2024, 1, 2, 3, 4), size_bytes=stored.size,
+                      hash=stored.sha256, path=stored.path))
+        db.commit()
+        db.close()
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        app.router.on_startup = []
+        monkeypatch.setitem(app.dependency_overrides, backups.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: type("U", (), {"username": "t"})())
+        monkeypatch.setattr(backups, "audit_event", lambda **kwargs: None)
+        return TestClient(app)
+
+    def test_gzip_is_passed_through(self, monkeypatch, tmp_path):
+        client = self._client(monkeypatch, tmp_path)
+        r = client.get("/backups/1/download", headers={"Accept-Encoding": "gzip"})
+        assert r.status_code == 200
+        assert r.headers["content-encoding"] == "gzip"
+        assert int(r.headers["content-length"]) < len(CONFIG)
+        assert r.content == CONFIG  # decoded by the client
+
+    def test_plain_client_gets_decompressed_stream(self, monkeypatch, tmp_path):
+        client = self._client(monkeypatch, tmp_path)
+        r = client.get("/backups/1/download", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in r.headers
+        assert r.content == CONFIG
+        assert "attachment" in r.headers["content-disposition"]
+
+    def test_uncompressed_blob(self, monkeypatch, tmp_path):
+        client = self._client(monkeypatch, tmp_path, compression="none")
+        r = client.get("/backups/1/download", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in r.headers
+        assert r.content == CONFIG
+
+
+def _filter(chunks, command=b"show running-config", prompt=b"R1#", **kwargs) -> bytes:
+    out = []
+    lines = _CliLineFilter(command, prompt, out.append, **kwargs)
+    for chunk in chunks:
+        lines.feed(chunk)
+    lines.close()
+    return b"".join(out)
+
+
+class TestCliLineFilter:
+    """Tests for _CliLineFilter."""
+
+    def test_strips_echo_and_trailing_prompt(self):
+        raw = b"show running-config\r\n\r\nhostname R1\r\n\r\ninterface Gi0/1\r\nend\r\n\r\nR1#"
+        # byte-at-a-time to exercise chunk boundaries
+        out = _filter([raw[i:i + 1] for i in range(len(raw))])
+        assert out == b"hostname R1\n\ninterface Gi0/1\nend\n"
+
+    def test_prompt_lines_dropped(self):
+        raw = b"show run\r\nhostname R1\r\nR1#\r\n#\r\nbanner motd #\r\nend\r\nR1#"
+        out = _filter([raw], command=b"show run", drop_prompt_lines=True)
+        # short lines ending in '#' are config (Huawei separators, banners), not prompts
+        assert out == b"hostname R1\n#\nbanner motd #\nend\n"
+
+    def test_no_echo_keeps_everything(self):
+        out = _filter([b"hostname R1\nend\n"], command=b"", prompt=None)
+        assert out == b"hostname R1\nend\n"
@@ -0,0 +1,194 @@
+"""
+Tests for change-detection probes.
+
+Tests cover:
+1. Marker parsing per vendor, and output without a marker
+2. run_backup skips the full pull while the probe reports no change
+3. Forced full pull every CHANGE_PROBE_FULL_EVERY runs, probe failures, unsupported vendors
+4. The probe shares the device's session trace and stops on cancel
+5. Device updates reset the probe state only when the session changes
+"""
+import asyncio
+import threading
+
+import pytest
+
+from app.models import Backup, Device
+from app.services import backup_store, collector, netmiko_worker
+from app.services.backup_store import ConfigWriter, StoredConfig
+from app.services.change_probe import CHANGE_PROBES, parse_token, probe_for
+from app.services.netmiko_worker import FetchCancelled
+
+from .conftest import TestSessionLocal
+
+
+class TestParseToken:
+    """Tests for probe output parsing."""
+
+    @pytest.mark.parametrize("vendor,output,token", [
+        ("Cisco (IOS Router/Switch)",
+         b"! Last configuration change at 10:22:33 UTC Mon Mar 4 2024 by admin\r\n",
+         "10:22:33 UTC Mon Mar 4 2024 by admin"),
+        ("Cisco (NXOS Data Center)",
+         b"!Running configuration last done at: Tue Mar  5 10:00:00 2024\n",
+         "Tue Mar  5 10:00:00 2024"),
+        ("Cisco (ASA Firewall)",
+         b"Cryptochecksum: 1a2b3c4d 5e6f7081 92a3b4c5 d6e7f809\n",
+         "1a2b3c4d 5e6f7081 92a3b4c5 d6e7f809"),
+        ("Juniper (JunOS)",
+         b"0   2024-03-05 10:00:00 UTC by admin via cli\n",
+         "2024-03-05 10:00:00 UTC by admin via cli"),
+    ])
+    def test_markers(self, vendor, output, token):
+        assert parse_token(probe_for(vendor), output) == token
+
+    def test_no_marker(self):
+        # e.g. an error message: constant output must not look like "unchanged"
+        probe = CHANGE_PROBES["cisco_ios"]
+        assert parse_token(probe, b"% Invalid input detected at '^' marker.\n") is None
+        assert parse_token(probe, b"") is None
+
+    def test_unsupported_vendor(self):
+        assert probe_for("Fortinet (FortiGate)") is None
+
+
+class _FakeDevice:
+    """Scripted device: config content, probe output, and a call log."""
+
+    def __init__(self, vendor="Cisco (IOS Router/Switch)"):
+        self.vendor = vendor
+        self.config = b"hostname R1\nend\n"
+        self.marker = b"! Last configuration change at 10:00:00 UTC Mon Mar 4 2024\n"
+        self.probe_error = False
+        self.probe_kwargs: dict = {}
+        self.cancel_during_probe = False
+        self.calls: list[str] = []
+
+    def fetch(self, *, cmd=None, base_path=None, keep_output=True, **kwargs):
+        self.calls.append("probe" if cmd else "full")
+        if cmd:
+            self.probe_kwargs = kwargs
+            if self.cancel_during_probe:
+                kwargs["cancel"].set()  # the job is cancelled while the probe runs
+                raise FetchCancelled("cancelled")
+            if self.probe_error:
+                raise Exception("Connection failed: probe")
+            return StoredConfig(path="", sha256="", size=len(self.marker), preview=self.marker)
+        writer = ConfigWriter(base_path)
+        writer.write(self.config)
+        return writer.commit()
+
+
+@pytest.fixture
+def probed(monkeypatch, tmp_path):
+    monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", True)
+    monkeypatch.setattr(collector.settings, "CHANGE_PROBE_FULL_EVERY", 3)
+    dev = _FakeDevice()
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", dev.fetch)
+    db = TestSessionLocal()
+
+    def run(cancel=None) -> list[str]:
+        db.merge(Device(id=1, hostname="r1", ip="10.0.0.1", vendor=dev.vendor, protocol="SSH",
+                        port=22, username_enc="", password_enc=""))
+        db.commit()
+        info = {
+            "id": 1, "hostname": "r1", "ip": "10.0.0.1", "vendor": dev.vendor, "protocol": "SSH",
+            "port": 22, "username": "u", "password": "p", "secret": None,
+        }
+        dev.calls.clear()
+        log_lines: list[str] = []
+        ok = asyncio.run(collector.run_backup(db, [info], log_lines, cancel=cancel))
+        assert ok == (0 if cancel is not None and cancel.is_set() else 1)
+        return list(dev.calls)
+
+    yield dev, db, run
+    db.close()
+
+
+class TestProbeInRunBackup:
+    """run_backup with a change probe."""
+
+    def test_unchanged_marker_skips_full_pull(self, probed):
+        dev, db, run = probed
+        assert run() == ["probe", "full"]
+        assert run() == ["probe"]
+        assert db.query(Backup).count() == 1
+        assert db.query(Backup).one().verified_at is not None
+
+    def test_changed_marker_pulls(self, probed):
+        dev, db, run = probed
+        run()
+        dev.marker = b"! Last configuration change at 11:00:00 UTC Mon Mar 4 2024\n"
+        dev.config = b"hostname R2\nend\n"
+        assert run() == ["probe", "full"]
+        assert db.query(Backup).count() == 2
+        assert db.get(Device, 1).change_token.startswith("11:00:00")
+
+    def test_forced_full_pull_every_n_runs(self, probed):
+        dev, db, run = probed
+        calls = [run() for _ in range(7)]
+        # CHANGE_PROBE_FULL_EVERY = 3: at most two skipped runs in a row
+        assert [c[-1] for c in calls] == ["full", "probe", "probe", "full", "probe", "probe", "full"]
+
+    def test_probe_failure_falls_back_to_full_pull(self, probed):
+        dev, db, run = probed
+        run()
+        dev.probe_error = True
+        assert run() == ["probe", "full"]
+
+    def test_probe_gets_trace_and_cancel(self, probed):
+        dev, db, run = probed
+        run()
+        assert dev.probe_kwargs["session_log"] is not None
+        cancel = threading.Event()
+        dev.cancel_during_probe = True
+        assert run(cancel) == ["probe"]  # no full pull after a cancelled probe
+        assert dev.probe_kwargs["cancel"] is cancel
+
+    def test_unsupported_vendor_always_pulls(self, probed):
+        dev, db, run = probed
+        dev.vendor = "Fortinet (FortiGate)"
+        assert run() == ["full"]
+        assert run() == ["full"]
+
+
+class TestDeviceUpdate:
+    """PUT /devices/{id} and the probe state."""
+
+    def test_probe_state_reset_only_when_session_changes(self, client, monkeypatch):
+        from app.api import devices
+        from app.main import app
+        from app.security import require_admin
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, devices.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, lambda: type("U", (), {"username": "t"})())
+        monkeypatch.setattr(devices, "audit_event", lambda **kwargs: None)
+        device = {"hostname": "r1", "ip": "10.0.0.1", "vendor": "Cisco", "username": "u", "password": "p"}
+        dev_id = client.post("/devices", json=device).json()["id"]
+        db = TestSessionLocal()
+
+        def put(**changes) -> tuple:
+            d = db.get(Device, dev_id)
+            d.change_token, d.probe_skips = "10:00:00", 2
+            db.commit()
+            device.update(changes)
+            assert client.put(f"/devices/{dev_id}", json=device).status_code == 200
+            db.expire_all()
+            d = db.get(Device, dev_id)
+            return d.change_token, d.probe_skips
+
+        assert put(hostname="r1-core", tags="core", enabled=False) == ("10:00:00", 2)
+        assert put() == ("10:00:00", 2)  # same login sent again
+        assert put(ip="10.0.0.9") == (None, 0)
+        assert put(password="rotated") == (None, 0)
+        assert put(vendor="Juniper (JunOS)") == (None, 0)
+        db.close()
+
@@ -0,0 +1,181 @@
+"""
+Tests for collector retries and the per-device circuit breaker.
+
+Tests cover:
+1. Error classification and backoff
+2. Transient errors are retried, authentication errors are not
+3. Breaker opens after BREAKER_THRESHOLD failed runs, skips the device, and
+   half-opens for a single trial after the cooldown
+4. Breaker state in the /devices API
+"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from app.models import Device
+from app.services import circuit_breaker, collector, netmiko_worker
+from app.services.backup_store import StoredConfig
+from app.services.circuit_breaker import backoff, is_transient
+
+from .conftest import TestSessionLocal
+
+
+class TestPolicy:
+    """Tests for is_transient and backoff."""
+
+    @pytest.mark.parametrize("message,transient", [
+        ("Connection failed: 10.0.0.1 | Error: timed out", True),
+        ("Connection failed: 10.0.0.1 | Error: [Errno 111] Connection refused", True),
+        ("Connection failed: 10.0.0.1 | Error: Telnet authentication failed", False),
+        ("Connection failed: 10.0.0.1 | Error: Authentication to device failed.", False),
+        ("Connection failed: 10.0.0.1 | Error: Telnet enable secret rejected", False),
+    ])
+    def test_is_transient(self, message, transient):
+        assert is_transient(Exception(message)) is transient
+
+    def test_backoff_grows_and_is_capped(self, monkeypatch):
+        monkeypatch.setattr(circuit_breaker.settings, "RETRY_BACKOFF_BASE", 2)
+        monkeypatch.setattr(circuit_breaker.settings, "RETRY_BACKOFF_MAX", 10)
+        assert 1 <= backoff(1) <= 2
+        assert 4 <= backoff(3) <= 8
+        assert 5 <= backoff(6) <= 10
+
+
+class _Flaky:
+    def __init__(self, failures: list[str], tmp_path):
+        self.failures = list(failures)
+        self.calls = 0
+        self.tmp_path = tmp_path
+
+    def fetch(self, *, host, **kwargs):
+        self.calls += 1
+        if self.failures:
+            raise Exception(f"Connection failed: {host} | Error: {self.failures.pop(0)}")
+        path = self.tmp_path / f"{host}.cfg"
+        path.write_bytes(b"hostname x")
+        return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setattr(collector.settings, "RETRY_ATTEMPTS", 2)
+    monkeypatch.setattr(collector.settings, "RETRY_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(collector.settings, "BREAKER_THRESHOLD", 3)
+    monkeypatch.setattr(collector.settings, "BREAKER_COOLDOWN", 3600)
+    monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+    db = TestSessionLocal()
+    db.add(Device(id=1, hostname="sw1", ip="10.0.0.1", vendor="Cisco", protocol="SSH", port=22,
+                  username_enc="", password_enc=""))
+    db.commit()
+
+    def run(flaky: _Flaky) -> tuple[int, list[str]]:
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", flaky.fetch)
+        info = {
+            "id": 1, "hostname": "sw1", "ip": "10.0.0.1", "vendor": "Cisco", "protocol": "SSH",
+            "port": 22, "username": "u", "password": "p", "secret": None,
+        }
+        log_lines: list[str] = []
+        ok = asyncio.run(collector.run_backup(db, [info], log_lines))
+        return ok, log_lines
+
+    yield db, run, tmp_path
+    db.close()
+
+
+class TestRetries:
+    """Retries inside one run."""
+
+    def test_transient_errors_are_retried(self, env):
+        db, run, tmp_path = env
+        flaky = _Flaky(["timed out", "Connection reset by peer"], tmp_path)
+        ok, log_lines = run(flaky)
+        assert ok == 1
+        assert flaky.calls == 3
+        assert any("Attempt 1/3 failed" in line for line in log_lines)
+        assert db.get(Device, 1).consecutive_failures == 0
+
+    def test_auth_errors_are_not_retried(self, env):
+        db, run, tmp_path = env
+        flaky = _Flaky(["Telnet authentication failed"] * 3, tmp_path)
+        ok, _ = run(flaky)
+        assert ok == 0
+        assert flaky.calls == 1
+        assert db.get(Device, 1).consecutive_failures == 1
+        assert "authentication" in db.get(Device, 1).last_error
+
+
+class TestBreaker:
+    """Circuit breaker across runs."""
+
+    def test_opens_after_threshold_and_skips(self, env):
+        db, run, tmp_path = env
+        for _ in range(3):
+            run(_Flaky(["timed out"] * 3, tmp_path))
+        device = db.get(Device, 1)
+        assert device.consecutive_failures == 3
+        assert circuit_breaker.state(device) == circuit_breaker.OPEN
+
+        flaky = _Flaky([], tmp_path)
+        ok, log_lines = run(flaky)
+        assert ok == 0
+        assert flaky.calls == 0
+        assert any("Skipped: circuit open" in line and "timed out" in line for line in log_lines)
+
+    def test_half_open_single_trial_then_closes(self, env):
+        db, run, tmp_path = env
+        for _ in range(3):
+            run(_Flaky(["timed out"] * 3, tmp_path))
+        device = db.get(Device, 1)
+        device.last_failure_at = device.last_failure_at - timedelta(hours=2)
+        db.commit()
+        assert circuit_breaker.state(device) == circuit_breaker.HALF_OPEN
+
+        # trial fails: one attempt only, open again
+        flaky = _Flaky(["timed out"] * 3, tmp_path)
+        run(flaky)
+        assert flaky.calls == 1
+        assert circuit_breaker.state(db.get(Device, 1)) == circuit_breaker.OPEN
+
+        device = db.get(Device, 1)
+        device.last_failure_at = device.last_failure_at - timedelta(hours=2)
+        db.commit()
+        ok, _ = run(_Flaky([], tmp_path))
+        assert ok == 1
+        assert circuit_breaker.state(db.get(Device, 1)) == circuit_breaker.CLOSED
+
+
+class TestBreakerApi:
+    """Breaker state in /devices."""
+
+    def test_state_visible_and_reset(self, env, client, monkeypatch):
+        from app.api import devices
+        from app.main import app
+        from app.security import get_current_user, require_admin
+
+        db, run, tmp_path = env
+        for _ in range(3):
+            run(_Flaky(["timed out"] * 3, tmp_path))
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        user = lambda: type("U", (), {"username": "t"})()
+        monkeypatch.setitem(app.dependency_overrides, devices.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, user)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, user)
+        monkeypatch.setattr(devices, "audit_event", lambda **kwargs: None)
+
+        [row] = client.get("/devices").json()
+        assert row["breaker_state"] == "open"
+        assert row["consecutive_failures"] == 3
+        assert "timed out" in row["last_error"]
+        assert row["retry_at"] is not None
+
+        row = client.post("/devices/1/breaker/reset").json()
+        assert row["breaker_state"] == "closed"
+        assert row["consecutive_failures"] == 0
@@ -0,0 +1,208 @@
+"""
+Tests for the shared collection engine.
+
+Tests cover:
+1. DeviceLimiter - global, per-vendor and per-host caps
+2. run_backup - devices are fetched concurrently and recorded as Backup rows
+3. Unchanged configs only record a verification timestamp; the last backup is read
+   once the device has a slot
+4. Event-loop responsiveness while a (simulated) job runs
+"""
+import asyncio
+import time
+
+from app.models import Backup
+from app.services import collector, netmiko_worker
+from app.services.backup_store import StoredConfig
+from app.services.collector import DeviceLimiter
+
+from .conftest import TestSessionLocal
+
+
+def _device(i: int, vendor: str = "Cisco", ip: str | None = None) -> dict:
+    return {
+        "id": i,
+        "hostname": f"dev{i}",
+        "ip": ip or f"10.0.0.{i}",
+        "vendor": vendor,
+        "protocol": "SSH",
+        "port": 22,
+        "username": "u",
+        "password": "p",
+        "secret": None,
+    }
+
+
+async def _peak(limiter: DeviceLimiter, keys: list[tuple[str, str]]) -> int:
+    active = 0
+    peak = 0
+
+    async def one(vendor, host):
+        nonlocal active, peak
+        async with limiter.slot(vendor, host):
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(one(v, h) for v, h in keys))
+    return peak
+
+
+class TestDeviceLimiter:
+    """Tests for DeviceLimiter caps."""
+
+    def test_global_cap(self):
+        limiter_keys = [("Cisco", f"10.0.0.{i}") for i in range(20)]
+        peak = asyncio.run(_peak(DeviceLimiter(4, 0, 0), limiter_keys))
+        assert peak == 4
+
+    def test_per_vendor_cap(self):
+        limiter_keys = [("Juniper", f"10.0.0.{i}") for i in range(20)]
+        peak = asyncio.run(_peak(DeviceLimiter(16, 3, 0), limiter_keys))
+        assert peak == 3
+
+    def test_per_host_cap(self):
+        # console server: many ports behind a single IP
+        limiter_keys = [("Cisco", "10.0.0.1") for _ in range(10)]
+        peak = asyncio.run(_peak(DeviceLimiter(16, 0, 1), limiter_keys))
+        assert peak == 1
+
+
+class TestRunBackup:
+    """Tests for run_backup."""
+
+    def test_devices_are_fetched_concurrently(self, monkeypatch, tmp_path):
+        def fake_fetch(*, vendor, host, **kwargs):
+            time.sleep(0.2)
+            path = tmp_path / f"{host}.cfg"
+            path.write_bytes(b"hostname x")
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        monkeypatch.setattr(collector.settings, "COLLECTOR_MAX_WORKERS", 8)
+
+        devices = [_device(i) for i in range(1, 9)]
+        log_lines: list[str] = []
+        db = TestSessionLocal()
+        try:
+            started = time.monotonic()
+            ok = asyncio.run(collector.run_backup(db, devices, log_lines))
+            elapsed = time.monotonic() - started
+            assert ok == 8
+            assert db.query(Backup).count() == 8
+        finally:
+            db.close()
+        # serial would be 8 * 0.2s
+        assert elapsed < 1.0
+
+    def test_failed_device_is_logged(self, monkeypatch):
+        def fake_fetch(*, host, **kwargs):
+            raise Exception(f"Connection failed: {host}")
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        monkeypatch.setattr(collector.settings, "RETRY_ATTEMPTS", 0)
+
+        log_lines: list[str] = []
+        db = TestSessionLocal()
+        try:
+            ok = asyncio.run(collector.run_backup(db, [_device(1)], log_lines))
+        finally:
+            db.close()
+        assert ok == 0
+        assert any("Backup failed" in line for line in log_lines)
+
+
+class TestUnchangedFastPath:
+    """A config identical to the device's last backup adds no row."""
+
+    def test_unchanged_config_is_verified_not_stored(self, monkeypatch, tmp_path):
+        path = tmp_path / "blob.cfg"
+        path.write_bytes(b"hostname x")
+        calls = []
+
+        def fake_fetch(*, base_path=None, **kwargs):
+            calls.append(base_path)
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10, unchanged=base_path is not None)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+
+        db = TestSessionLocal()
+        try:
+            asyncio.run(collector.run_backup(db, [_device(1)], []))
+            log_lines: list[str] = []
+            ok = asyncio.run(collector.run_backup(db, [_device(1)], log_lines))
+            rows = db.query(Backup).all()
+            assert ok == 1
+            assert len(rows) == 1
+            assert rows[0].hash == "ab" * 32
+            assert rows[0].verified_at is not None
+        finally:
+            db.close()
+        assert calls == [None, str(path)]
+        assert any("unchanged since" in line for line in log_lines)
+
+
+    def test_last_backup_read_when_slot_is_free(self, monkeypatch, tmp_path):
+        path = tmp_path / "blob.cfg"
+        path.write_bytes(b"hostname x")
+        calls = []
+
+        def fake_fetch(*, base_path=None, **kwargs):
+            calls.append(base_path)
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10, unchanged=base_path is not None)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        monkeypatch.setattr(collector.settings, "COLLECTOR_MAX_WORKERS", 1)
+
+        db = TestSessionLocal()
+        try:
+            # the second entry waits for the first; it must see the backup the first one made
+            ok = asyncio.run(collector.run_backup(db, [_device(1), _device(1)], []))
+        finally:
+            db.close()
+        assert ok == 2
+        assert calls == [None, str(path)]
+
+
+class TestEventLoopLag:
+    """The blocking collector must not stall the event loop."""
+
+    def test_event_loop_stays_responsive_during_job(self, monkeypatch, tmp_path):
+        def blocking_fetch(*, host, **kwargs):
+            # netmiko/telnetlib style blocking I/O
+            time.sleep(0.15)
+            path = tmp_path / f"{host}.cfg"
+            path.write_bytes(b"hostname x")
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", blocking_fetch)
+
+        devices = [_device(i, ip=f"10.0.{i // 250}.{i % 250}") for i in range(1, 41)]
+
+        async def scenario():
+            max_lag = 0.0
+            done = asyncio.Event()
+
+            async def probe():
+                # what /health sees: how late does a 10ms timer fire?
+                nonlocal max_lag
+                while not done.is_set():
+                    t0 = time.monotonic()
+                    await asyncio.sleep(0.01)
+                    max_lag = max(max_lag, time.monotonic() - t0 - 0.01)
+
+            db = TestSessionLocal()
+            try:
+                probe_task = asyncio.create_task(probe())
+                ok = await collector.run_backup(db, devices, [])
+                done.set()
+                await probe_task
+            finally:
+                db.close()
+            return ok, max_lag
+
+        ok, max_lag = asyncio.run(scenario())
+        assert ok == len(devices)
+        # a single blocking fetch on the loop would show up as >= 150ms
+        assert max_lag < 0.1
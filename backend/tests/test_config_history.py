@@ -0,0 +1,257 @@
+"""
+Tests for reverse-delta config history.
+
+Tests cover:
+1. make_delta/apply_delta round trips
+2. run_backup in delta mode: latest full, older versions as deltas, bounded chains
+3. Rebuilding old versions (and the rebuild cache)
+4. Deleting a version that others are rebuilt through
+5. Unused blobs: released, then swept after BACKUP_BLOB_GRACE unless in use again
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from app.models import Backup, Blob
+from app.services import backup_store, collector, config_history, netmiko_worker
+from app.services.backup_store import ConfigWriter, apply_delta, make_delta
+from app.services.config_history import RebuildCache
+
+from .conftest import TestSessionLocal
+
+
+def _config(version: int, lines: int = 2000) -> bytes:
+    body = [b"interface Gi0/%d\n description port %d\n!\n" % (i, i) for i in range(lines)]
+    # a few lines change per version
+    body[version % lines] = b"interface Gi0/%d\n description changed in v%d\n!\n" % (version % lines, version)
+    return b"hostname R1\n" + b"".join(body) + b"ntp server 10.0.0.%d\nend\n" % version
+
+
+class TestDeltaCodec:
+    """Tests for make_delta/apply_delta."""
+
+    @pytest.mark.parametrize("old,new", [
+        (b"a\nb\nc\n", b"a\nb\nc\n"),
+        (b"a\nb\nc\n", b"a\nx\nc\n"),
+        (b"a\nb\nc\n", b"a\nb\nc"),
+        (b"", b"a\n"),
+        (b"a\n", b""),
+        (b"a\nb\n", b"b\na\nb\n"),
+    ])
+    def test_round_trip(self, old, new):
+        assert apply_delta(make_delta(old, new), new) == old
+
+    def test_random_edits(self):
+        rng = random.Random(7)
+        new = _config(0, lines=300)
+        lines = new.splitlines(keepends=True)
+        for _ in range(30):
+            i = rng.randrange(len(lines))
+            lines[i:i + rng.randint(0, 3)] = [b"edit %d\n" % rng.randint(0, 99)] * rng.randint(0, 2)
+        old = b"".join(lines)
+        assert apply_delta(make_delta(old, new), new) == old
+
+    def test_small_change_gives_small_delta(self):
+        old, new = _config(1), _config(2)
+        assert len(make_delta(old, new)) < 300 < len(old)
+
+
+class TestRebuildCache:
+    """Tests for RebuildCache."""
+
+    def test_lru_eviction(self):
+        cache = RebuildCache(max_entries=2)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.get("a")
+        cache.put("c", b"3")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"1"
+        assert len(cache) == 2
+
+
+@pytest.fixture
+def delta_mode(monkeypatch, tmp_path):
+    monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setattr(config_history.settings, "BACKUP_STORAGE_MODE", "delta")
+    monkeypatch.setattr(config_history.settings, "BACKUP_DELTA_MAX_CHAIN", 3)
+    monkeypatch.setattr(config_history, "rebuild_cache", RebuildCache(8))
+    versions = []
+
+    def fake_fetch(*, base_path=None, **kwargs):
+        writer = ConfigWriter(base_path)
+        writer.write(versions[-1])
+        return writer.commit()
+
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+    device = {
+        "id": 1, "hostname": "r1", "ip": "10.0.0.1", "vendor": "Cisco", "protocol": "SSH",
+        "port": 22, "username": "u", "password": "p", "secret": None,
+    }
+    db = TestSessionLocal()
+
+    def backup(content: bytes) -> list[str]:
+        versions.append(content)
+        log_lines: list[str] = []
+        asyncio.run(collector.run_backup(db, [device], log_lines))
+        return log_lines
+
+    yield db, backup
+    db.close()
+
+
+def _rows(db):
+    return db.query(Backup).order_by(Backup.id).all()
+
+
+class TestDeltaMode:
+    """run_backup, rebuild and delete in delta mode."""
+
+    def test_latest_full_older_as_deltas(self, delta_mode, tmp_path):
+        db, backup = delta_mode
+        for v in range(3):
+            backup(_config(v))
+        rows = _rows(db)
+        assert [r.delta_base_id for r in rows] == [rows[1].id, rows[2].id, None]
+        assert rows[2].blob_sha256 is not None
+        # the older full blobs are only released
+        assert db.query(Blob).filter(Blob.released_at.is_(None)).count() == 1
+        assert len(list((tmp_path / "objects").rglob("*.cfg*"))) == 3
+        for v, row in enumerate(rows):
+            assert config_history.read_config(db, row) == _config(v)
+
+    def test_released_blobs_swept_after_grace(self, delta_mode, tmp_path, monkeypatch):
+        db, backup = delta_mode
+        backup(_config(0))
+        backup(_config(1))
+        assert len(list((tmp_path / "objects").rglob("*.cfg*"))) == 2
+        monkeypatch.setattr(config_history.settings, "BACKUP_BLOB_GRACE", 0)
+        backup(_config(2))
+        rows = _rows(db)
+        # only the latest full blob is left
+        assert db.query(Blob).count() == 1
+        assert len(list((tmp_path / "objects").rglob("*.cfg*"))) == 1
+        for v, row in enumerate(rows):
+            assert config_history.read_config(db, row) == _config(v)
+
+    def test_chain_length_is_bounded(self, delta_mode):
+        db, backup = delta_mode
+        for v in range(9):
+            backup(_config(v))
+        rows = _rows(db)
+        # keyframes every MAX_CHAIN + 1 versions
+        assert [r.delta_base_id is None for r in rows] == [False, False, False, True] * 2 + [True]
+        assert max(config_history.chain_length(db, r) for r in rows) == 3
+        for v, row in enumerate(rows):
+            assert config_history.read_config(db, row) == _config(v)
+
+    def test_rebuild_uses_cache(self, delta_mode, monkeypatch):
+        db, backup = delta_mode
+        for v in range(4):
+            backup(_config(v))
+        oldest = _rows(db)[0]
+        assert config_history.read_config(db, oldest) == _config(0)
+
+        reads = []
+        real = config_history._read
+        monkeypatch.setattr(config_history, "_read", lambda path: reads.append(path) or real(path))
+        assert config_history.read_config(db, oldest) == _config(0)
+        assert reads == []
+
+    def test_unchanged_run_keeps_history(self, delta_mode):
+        db, backup = delta_mode
+        backup(_config(0))
+        backup(_config(1))
+        log_lines = backup(_config(1))
+        assert any("unchanged since" in line for line in log_lines)
+        assert len(_rows(db)) == 2
+
+    def test_delete_materializes_dependents(self, delta_mode, client, monkeypatch):
+        from app.api import backups
+        from app.main import app
+        from app.security import require_admin
+
+        db, backup = delta_mode
+        for v in range(3):
+            backup(_config(v))
+        rows = _rows(db)
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, backups.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, lambda: type("U", (), {"username": "t"})())
+        monkeypatch.setattr(backups, "audit_event", lambda **kwargs: None)
+        assert client.delete(f"/backups/{rows[1].id}").status_code == 200
+
+        db.expire_all()
+        first, last = _rows(db)
+        # v0 was a delta against v1: it is a full blob again
+        assert first.delta_base_id is None and first.blob_sha256 is not None
+        assert config_history.read_config(db, first) == _config(0)
+        assert config_history.read_config(db, last) == _config(2)
+
+
+class TestReleasedBlobs:
+    """release_blobs and sweep_released_blobs."""
+
+    def _blob(self, db, content: bytes):
+        writer = ConfigWriter()
+        writer.write(content)
+        stored = writer.commit()
+        db.add(Blob(sha256=stored.sha256, path=stored.path, size=stored.size))
+        db.commit()
+        return stored
+
+    @pytest.fixture
+    def store(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(backup_store.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(config_history.settings, "BACKUP_BLOB_GRACE", 60)
+        db = TestSessionLocal()
+        yield db
+        db.close()
+
+    def _age(self, db, stored, seconds: int):
+        blob = db.get(Blob, stored.sha256)
+        blob.released_at -= timedelta(seconds=seconds)
+        db.commit()
+        old = time.time() - seconds
+        os.utime(stored.path, (old, old))
+
+    def test_kept_during_grace(self, store):
+        stored = self._blob(store, b"hostname a\n")
+        assert config_history.release_blobs(store, [stored.sha256]) == 1
+        assert config_history.sweep_released_blobs(store) == 0
+        self._age(store, stored, 120)
+        assert config_history.sweep_released_blobs(store) == 1
+        assert store.get(Blob, stored.sha256) is None
+        assert not Path(stored.path).exists()
+
+    def test_referenced_again(self, store):
+        stored = self._blob(store, b"hostname b\n")
+        config_history.release_blobs(store, [stored.sha256])
+        self._age(store, stored, 120)
+        store.add(Backup(device_id=1, size_bytes=1, hash=stored.sha256, path=stored.path, blob_sha256=stored.sha256))
+        store.commit()
+        assert config_history.sweep_released_blobs(store) == 0
+        assert store.get(Blob, stored.sha256).released_at is None
+
+    def test_reused_file_not_swept(self, store):
+        # another worker got the blob from ConfigWriter.commit() but has not recorded its backup yet
+        stored = self._blob(store, b"hostname c\n")
+        config_history.release_blobs(store, [stored.sha256])
+        self._age(store, stored, 120)
+        writer = ConfigWriter()
+        writer.write(b"hostname c\n")
+        assert writer.commit().path == stored.path
+        assert config_history.sweep_released_blobs(store) == 0
+        assert Path(stored.path).exists()
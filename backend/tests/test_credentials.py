@@ -0,0 +1,206 @@
+"""
+Tests for the credential provider.
+
+Tests cover:
+1. CredentialCache: one decrypt per ciphertext, TTL, size bound, rotation
+2. ref()/resolve(): device credentials vs. shared profile, plain dicts
+3. run_backup resolving CredentialRefs at connection time
+4. /credentials CRUD and devices using a profile
+"""
+import asyncio
+
+import pytest
+
+from app.models import CredentialProfile, Device
+from app.services import collector, credentials, netmiko_worker
+from app.services.backup_store import StoredConfig
+from app.services.credentials import CredentialRef
+from app.utils.crypto import enc
+
+from .conftest import TestSessionLocal
+
+
+@pytest.fixture
+def decrypts(monkeypatch):
+    """Count decryptions and start from an empty cache."""
+    calls = []
+    real_dec = credentials.dec
+
+    def counting_dec(token):
+        calls.append(token)
+        return real_dec(token)
+
+    monkeypatch.setattr(credentials, "dec", counting_dec)
+    monkeypatch.setattr(credentials, "cache", credentials.CredentialCache())
+    return calls
+
+
+class TestCredentialCache:
+    """Tests for CredentialCache."""
+
+    def test_shared_ref_decrypts_once(self, decrypts):
+        ref = CredentialRef(enc("admin"), enc("pw"), None, profile_id=1)
+        for _ in range(50):
+            creds = credentials.resolve({"credentials": ref})
+        assert (creds.username, creds.password, creds.secret) == ("admin", "pw", None)
+        assert len(decrypts) == 2
+        assert (credentials.cache.hits, credentials.cache.misses) == (49, 1)
+
+    def test_ttl_zero_disables_cache(self, decrypts, monkeypatch):
+        monkeypatch.setattr(credentials.settings, "CREDENTIAL_CACHE_TTL", 0)
+        ref = CredentialRef(enc("admin"), enc("pw"), enc("en"))
+        credentials.resolve({"credentials": ref})
+        credentials.resolve({"credentials": ref})
+        assert len(decrypts) == 6
+
+    def test_expired_entry_is_decrypted_again(self, decrypts, monkeypatch):
+        clock = [100.0]
+        monkeypatch.setattr(credentials.time, "monotonic", lambda: clock[0])
+        ref = CredentialRef(enc("admin"), enc("pw"), None)
+        credentials.resolve({"credentials": ref})
+        clock[0] += credentials.settings.CREDENTIAL_CACHE_TTL + 1
+        credentials.resolve({"credentials": ref})
+        assert credentials.cache.misses == 2
+
+    def test_size_bound(self, decrypts, monkeypatch):
+        monkeypatch.setattr(credentials.settings, "CREDENTIAL_CACHE_SIZE", 2)
+        refs = [CredentialRef(enc(f"u{i}"), enc("pw"), None) for i in range(3)]
+        for ref in refs:
+            credentials.resolve({"credentials": ref})
+        credentials.resolve({"credentials": refs[0]})
+        assert credentials.cache.misses == 4
+
+    def test_rotated_password_is_not_stale(self, decrypts):
+        old = CredentialRef(enc("admin"), enc("old"), None, profile_id=1)
+        new = CredentialRef(old.username_enc, enc("new"), None, profile_id=1)
+        assert credentials.resolve({"credentials": old}).password == "old"
+        assert credentials.resolve({"credentials": new}).password == "new"
+
+    def test_plain_dict_passes_through(self, decrypts):
+        creds = credentials.resolve({"username": "u", "password": "p", "secret": None})
+        assert (creds.username, creds.password) == ("u", "p")
+        assert decrypts == []
+
+    def test_repr_hides_ciphertext(self):
+        ref = CredentialRef(enc("admin"), enc("pw"), None, profile_id=3)
+        assert repr(ref) == "CredentialRef(profile_id=3)"
+
+
+class TestRef:
+    """ref() picks the profile's credentials when the device has one."""
+
+    def test_profile_and_own_credentials(self, decrypts):
+        db = TestSessionLocal()
+        profile = CredentialProfile(name="noc", username_enc=enc("noc"), password_enc=enc("shared"))
+        db.add(profile)
+        db.flush()
+        own = Device(hostname="a", ip="10.0.0.1", vendor="Cisco", protocol="SSH", port=22,
+                     username_enc=enc("local"), password_enc=enc("mine"))
+        shared = Device(hostname="b", ip="10.0.0.2", vendor="Cisco", protocol="SSH", port=22,
+                        username_enc="", password_enc="", credential_profile_id=profile.id)
+        db.add_all([own, shared])
+        db.commit()
+        assert credentials.resolve({"credentials": credentials.ref(db, own)}).password == "mine"
+        assert credentials.resolve({"credentials": credentials.ref(db, shared)}).username == "noc"
+        db.close()
+
+
+class TestRunBackup:
+    """run_backup decrypts when each session opens."""
+
+    def test_shared_profile_decrypted_once(self, decrypts, monkeypatch, tmp_path):
+        monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+        seen = []
+
+        def fake_fetch(*, host, username, password, **kwargs):
+            seen.append((host, username, password))
+            path = tmp_path / f"{host}.cfg"
+            path.write_bytes(b"hostname x")
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        db = TestSessionLocal()
+        ref = CredentialRef(enc("noc"), enc("shared"), None, profile_id=1)
+        devices = []
+        for i in range(1, 6):
+            db.add(Device(id=i, hostname=f"sw{i}", ip=f"10.0.0.{i}", vendor="Cisco", protocol="SSH", port=22,
+                          username_enc="", password_enc=""))
+            devices.append({"id": i, "hostname": f"sw{i}", "ip": f"10.0.0.{i}", "vendor": "Cisco",
+                            "protocol": "SSH", "port": 22, "credentials": ref})
+        db.commit()
+        assert asyncio.run(collector.run_backup(db, devices, [])) == 5
+        assert {(u, p) for _, u, p in seen} == {("noc", "shared")}
+        assert len(decrypts) == 2
+        db.close()
+
+
+class TestCredentialsApi:
+    """/credentials endpoints."""
+
+    @pytest.fixture
+    def api(self, client, monkeypatch):
+        from app.api import devices
+        from app.main import app
+        from app.routers import credentials as credentials_router
+        from app.security import get_current_user, require_admin
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        user = lambda: type("U", (), {"username": "t"})()
+        monkeypatch.setitem(app.dependency_overrides, credentials_router.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, devices.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, user)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, user)
+        monkeypatch.setattr(credentials_router, "audit_event", lambda **kwargs: None)
+        monkeypatch.setattr(devices, "audit_event", lambda **kwargs: None)
+        return client
+
+    def test_crud(self, api):
+        res = api.post("/credentials", json={"name": "noc", "username": "noc", "password": "pw"})
+        assert res.status_code == 200
+        profile = res.json()
+        assert profile["has_secret"] is False
+        assert "password" not in profile
+
+        res = api.post("/devices", json={"hostname": "sw1", "ip": "10.0.0.1", "vendor": "Cisco",
+                                         "credential_profile_id": profile["id"]})
+        assert res.status_code == 200
+        assert res.json()["credential_profile_id"] == profile["id"]
+        assert api.get("/credentials").json()[0]["devices"] == 1
+
+        res = api.put(f"/credentials/{profile['id']}", json={"name": "noc", "password": "rotated"})
+        assert res.status_code == 200
+        db = TestSessionLocal()
+        stored = db.get(CredentialProfile, profile["id"])
+        creds = credentials.resolve({"credentials": CredentialRef(stored.username_enc, stored.password_enc, None)})
+        assert (creds.username, creds.password) == ("noc", "rotated")
+        db.close()
+
+        assert api.delete(f"/credentials/{profile['id']}").status_code == 409
+
+    def test_update_keeps_or_clears_profile(self, api):
+        profile = api.post("/credentials", json={"name": "noc", "username": "noc", "password": "pw"}).json()
+        device = {"hostname": "sw1", "ip": "10.0.0.1", "vendor": "Cisco"}
+        dev = api.post("/devices", json={**device, "credential_profile_id": profile["id"]}).json()
+
+        # an older client does not send the field
+        res = api.put(f"/devices/{dev['id']}", json={**device, "port": 2222})
+        assert res.json()["credential_profile_id"] == profile["id"]
+        res = api.put(f"/devices/{dev['id']}", json={**device, "credential_profile_id": None})
+        assert res.status_code == 422
+        res = api.put(f"/devices/{dev['id']}", json={**device, "credential_profile_id": None,
+                                                     "username": "u", "password": "p"})
+        assert res.status_code == 200 and res.json()["credential_profile_id"] is None
+
+    def test_validation(self, api):
+        assert api.post("/credentials", json={"name": "x", "username": "u"}).status_code == 422
+        res = api.post("/devices", json={"hostname": "sw1", "ip": "10.0.0.1", "vendor": "Cisco"})
+        assert res.status_code == 422
+        res = api.post("/devices", json={"hostname": "sw1", "ip": "10.0.0.1", "vendor": "Cisco",
+                                         "credential_profile_id": 99})
+        assert res.status_code == 422
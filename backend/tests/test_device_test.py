@@ -0,0 +1,202 @@
+"""
+Tests for bulk device tests.
+
+Tests cover:
+1. test_many() - completion order, collector concurrency caps, result cache
+2. POST /devices/test - NDJSON and SSE streams, tag selection, breaker reset, admins only;
+   POST /devices/{id}/test through the same interactive slot
+3. GET /devices/test/results
+"""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from app.models import Device
+from app.services import collector, device_test, netmiko_worker
+
+from .conftest import TestSessionLocal
+
+
+class _FakeFleet:
+    """fetch_running_config stand-in: per-host delay and failure, tracks concurrency."""
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, *, host, cmd=None, **kwargs):
+        with self._lock:
+            self.calls.append((host, cmd))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delays.get(host, 0.01))
+            if host in self.failing:
+                raise Exception(f"Connection failed: {host} | Error: Authentication to device failed.")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _info(i: int) -> dict:
+    return {
+        "id": i, "hostname": f"sw{i}", "ip": f"10.0.0.{i}", "vendor": "Cisco", "protocol": "SSH",
+        "port": 22, "username": "u", "password": "p", "secret": None,
+    }
+
+
+async def _collect(device_list, **kwargs):
+    return [r async for r in device_test.test_many(device_list, **kwargs)]
+
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    monkeypatch.setattr(device_test.settings, "DEVICE_TEST_CACHE_TTL", 300)
+    device_test.clear_cache()
+    yield
+    device_test.clear_cache()
+
+
+class TestTestMany:
+    """Tests for test_many()."""
+
+    def test_results_in_completion_order(self, monkeypatch):
+        fleet = _FakeFleet(delays={"10.0.0.1": 0.3, "10.0.0.2": 0.01, "10.0.0.3": 0.1}, failing={"10.0.0.3"})
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        results = asyncio.run(_collect([_info(1), _info(2), _info(3)]))
+        assert [r.device_id for r in results] == [2, 3, 1]
+        assert [r.success for r in results] == [True, False, True]
+        assert "Authentication" in results[1].message
+        assert all(cmd == "show version" for _, cmd in fleet.calls)
+
+    def test_collector_caps_apply(self, monkeypatch):
+        monkeypatch.setattr(collector.settings, "COLLECTOR_MAX_WORKERS", 3)
+        fleet = _FakeFleet(delays={f"10.0.0.{i}": 0.05 for i in range(1, 13)})
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        results = asyncio.run(_collect([_info(i) for i in range(1, 13)]))
+        assert len(results) == 12
+        assert fleet.peak == 3
+
+    def test_cached_results_are_reused(self, monkeypatch):
+        fleet = _FakeFleet()
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        asyncio.run(_collect([_info(1), _info(2)]))
+        again = asyncio.run(_collect([_info(1), _info(2), _info(3)]))
+        assert len(fleet.calls) == 3
+        assert {r.device_id: r.cached for r in again} == {1: True, 2: True, 3: False}
+
+        asyncio.run(_collect([_info(1)], refresh=True))
+        assert len(fleet.calls) == 4
+
+    def test_cache_expires(self, monkeypatch):
+        fleet = _FakeFleet()
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        asyncio.run(_collect([_info(1)]))
+        monkeypatch.setattr(device_test.settings, "DEVICE_TEST_CACHE_TTL", 0)
+        time.sleep(0.01)
+        asyncio.run(_collect([_info(1)]))
+        assert len(fleet.calls) == 2
+
+
+class TestBulkTestApi:
+    """POST /devices/test and GET /devices/test/results."""
+
+    @pytest.fixture
+    def api(self, client, monkeypatch):
+        from app.api import devices
+        from app.main import app
+        from app.security import get_current_user
+        from app.utils.crypto import enc
+
+        db = TestSessionLocal()
+        for i, tags in [(1, "core,dc1"), (2, "access"), (3, "core")]:
+            db.add(Device(id=i, hostname=f"sw{i}", ip=f"10.0.0.{i}", vendor="Cisco", protocol="SSH", port=22,
+                          username_enc=enc("u"), password_enc=enc("p"), tags=tags))
+        db.commit()
+        db.close()
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        audits = []
+        monkeypatch.setitem(app.dependency_overrides, devices.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user,
+                            lambda: type("U", (), {"username": "t", "role": "admin"})())
+        monkeypatch.setattr(devices, "audit_event", lambda **kwargs: audits.append(kwargs))
+        fleet = _FakeFleet(failing={"10.0.0.3"})
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        return client, fleet, audits
+
+    def test_ndjson_stream_by_tag(self, api):
+        client, fleet, audits = api
+        res = client.post("/devices/test", json={"tags": "Core"})
+        assert res.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in res.text.splitlines()]
+        assert {row["device_id"]: row["success"] for row in lines[:-1]} == {1: True, 3: False}
+        assert lines[-1] == {"done": True, "total": 2, "succeeded": 1, "failed": 1}
+        assert sorted(host for host, _ in fleet.calls) == ["10.0.0.1", "10.0.0.3"]
+        assert audits[-1]["action"] == "device_test_bulk"
+
+    def test_sse_stream_by_ids(self, api):
+        client, _, _ = api
+        res = client.post("/devices/test", json={"device_ids": [2]}, headers={"Accept": "text/event-stream"})
+        assert res.headers["content-type"].startswith("text/event-stream")
+        events = [block.split("\n") for block in res.text.strip().split("\n\n")]
+        assert [e[0] for e in events] == ["event: result", "event: done"]
+        assert json.loads(events[0][1][len("data: "):])["hostname"] == "sw2"
+
+    def test_viewer_cannot_bulk_test(self, api, monkeypatch):
+        from app.main import app
+        from app.security import get_current_user
+
+        client, fleet, _ = api
+        monkeypatch.setitem(app.dependency_overrides, get_current_user,
+                            lambda: type("U", (), {"username": "v", "role": "viewer"})())
+        assert client.post("/devices/test", json={}).status_code == 403
+        assert fleet.calls == []
+
+    def test_success_resets_breaker(self, api):
+        client, _, _ = api
+        db = TestSessionLocal()
+        db.get(Device, 1).consecutive_failures = 9
+        db.commit()
+        client.post("/devices/test", json={"device_ids": [1]})
+        db.expire_all()
+        assert db.get(Device, 1).consecutive_failures == 0
+        db.close()
+
+    def test_single_device_test_in_interactive_lane(self, api, monkeypatch):
+        client, fleet, audits = api
+        slots = []
+        real_slot = collector.DeviceLimiter.slot
+
+        def slot(self, vendor, host, priority=collector.MANUAL):
+            slots.append((host, priority))
+            return real_slot(self, vendor, host, priority)
+
+        monkeypatch.setattr(collector.DeviceLimiter, "slot", slot)
+        assert client.post("/devices/1/test").json() == {"success": True, "message": "OK"}
+        res = client.post("/devices/3/test").json()
+        assert not res["success"] and res["message"].startswith("Failed: ")
+        assert slots == [("10.0.0.1", collector.INTERACTIVE), ("10.0.0.3", collector.INTERACTIVE)]
+        assert [a["result"] for a in audits] == ["success", res["message"].replace("Failed: ", "failed: ", 1)]
+        assert {row["device_id"] for row in client.get("/devices/test/results").json()} == {1, 3}
+
+    def test_recent_results(self, api):
+        client, fleet, _ = api
+        client.post("/devices/test", json={})
+        rows = client.get("/devices/test/results").json()
+        assert {row["device_id"] for row in rows} == {1, 2, 3}
+        client.post("/devices/test", json={})
+        assert len(fleet.calls) == 3
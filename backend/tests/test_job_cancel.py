@@ -0,0 +1,231 @@
+"""
+Tests for cooperative job cancellation.
+
+Tests cover:
+1. Queued jobs cancelled at once; running jobs asked to stop
+2. run_backup: devices not started are skipped, in-flight transfers aborted
+   without counting as device failures, stuck sessions abandoned after the grace
+   but keeping their slot until they end; a run given up by its caller stops
+3. Cancel requests from another process (heartbeat) and after a worker died
+4. FetchCancelled from the Telnet transfer loop, nothing stored after cancel, POST /jobs/{id}/cancel
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.models import Device, FetchDiagnostic, Job
+from app.services import collector, job_controller, netmiko_worker
+from app.services.netmiko_worker import FetchCancelled
+
+from .conftest import TestSessionLocal
+from .test_job_queue import _expire
+from .test_telnet_driver import FakeTelnetDevice
+
+
+class _SlowFleet:
+    """Fetch that transfers until cancelled (or ignores cancel when stuck)."""
+
+    def __init__(self, stuck: float = 0):
+        self.stuck = stuck
+        self.started = threading.Event()
+        self.calls = []
+
+    def fetch(self, *, host, cancel=None, **kwargs):
+        self.calls.append(host)
+        self.started.set()
+        if self.stuck:
+            time.sleep(self.stuck)  # e.g. a login that does not check the flag
+            raise Exception("timed out")
+        while not cancel.is_set():
+            time.sleep(0.01)
+        raise FetchCancelled("cancelled")
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(collector.settings, "COLLECTOR_MAX_WORKERS", 1)
+    return db
+
+
+def _run_and_cancel(db, fleet) -> float:
+    """Run a queued 3-device job, cancel it once the first fetch is going; returns seconds to stop."""
+    job = job_controller.enqueue(db, "manual", [1, 2, 3])
+
+    async def scenario():
+        runner = asyncio.create_task(job_controller.run_next("w1"))
+        while not fleet.started.is_set():
+            await asyncio.sleep(0.01)
+        asked = time.monotonic()
+        assert job_controller.cancel(db, job.id) == "cancelling"
+        await runner
+        return time.monotonic() - asked
+
+    elapsed = asyncio.run(scenario())
+    db.expire_all()
+    return elapsed
+
+
+class TestCancel:
+    """Tests for job_controller.cancel()."""
+
+    def test_queued_job_never_runs(self, db, monkeypatch):
+        fleet = _SlowFleet()
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        job = job_controller.enqueue(db, "manual", [1])
+        assert job_controller.cancel(db, job.id) == "cancelled"
+        assert not asyncio.run(job_controller.run_next("w1"))
+        assert fleet.calls == []
+        assert job_controller.cancel(db, job.id) is None
+
+    def test_running_job_stops(self, db, monkeypatch):
+        fleet = _SlowFleet()
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        assert _run_and_cancel(db, fleet) < 2
+        job = db.query(Job).one()
+        assert (job.status, job.devices, job.lease_owner) == ("cancelled", 0, None)
+        assert "Cancelled: 2 device(s) not started, 1 in-flight session(s) aborted" in job.log
+        assert fleet.calls == ["10.0.0.1"]
+        # a cancelled transfer is not the device's fault
+        assert (db.get(Device, 1).consecutive_failures or 0) == 0
+        assert db.query(FetchDiagnostic).count() == 0
+
+    def test_stuck_session_abandoned_after_grace(self, db, monkeypatch):
+        monkeypatch.setattr(collector.settings, "JOB_CANCEL_GRACE", 0.2)
+        fleet = _SlowFleet(stuck=1.5)
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        assert _run_and_cancel(db, fleet) < 1
+        job = db.query(Job).one()
+        assert job.status == "cancelled"
+        assert "1 in-flight session(s) aborted" in job.log
+
+    def test_abandoned_session_keeps_slot(self, db, monkeypatch):
+        monkeypatch.setattr(collector.settings, "JOB_CANCEL_GRACE", 0.1)
+        fleet = _SlowFleet(stuck=0.8)
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        device = job_controller.device_info(db, db.get(Device, 1))
+        cancel = threading.Event()
+
+        async def scenario():
+            run = asyncio.create_task(collector.run_backup(db, [device], [], cancel=cancel))
+            while not fleet.started.is_set() and not run.done():
+                await asyncio.sleep(0.01)
+            started = time.monotonic()
+            cancel.set()
+            await run
+            abandoned = time.monotonic() - started
+            async with collector.shared_limiter().slot("Cisco", "10.0.0.2"):
+                return abandoned, time.monotonic() - started
+
+        abandoned, next_slot = asyncio.run(scenario())
+        assert abandoned < 0.5
+        assert next_slot >= 0.7  # only once the stuck thread is gone
+
+    def test_run_given_up_stops_transfers(self, db, monkeypatch):
+        fleet = _SlowFleet()
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fleet.fetch)
+        device = job_controller.device_info(db, db.get(Device, 1))
+
+        async def scenario():
+            run = asyncio.create_task(collector.run_backup(db, [device], []))
+            while not fleet.started.is_set() and not run.done():
+                await asyncio.sleep(0.01)
+            run.cancel()  # e.g. worker shutdown
+            with pytest.raises(asyncio.CancelledError):
+                await run
+            started = time.monotonic()
+            async with collector.shared_limiter().slot("Cisco", "10.0.0.2"):
+                return time.monotonic() - started
+
+        assert asyncio.run(scenario()) < 0.5  # the transfer saw the flag and gave its slot back
+
+
+class TestOtherProcess:
+    """Cancel requests that do not reach the worker's process directly."""
+
+    def test_heartbeat_refused_after_cancel_request(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "other-process")
+        assert job_controller.cancel(db, job.id) == "cancelling"
+        assert not job_controller.heartbeat(db, job.id, "other-process")
+
+    def test_dead_worker_job_ends_cancelled(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "dead-worker")
+        job_controller.cancel(db, job.id)
+        _expire(db, job.id)
+        job_controller.reclaim_expired(db)
+        db.refresh(job)
+        assert job.status == "cancelled"
+
+    def test_shutdown_does_not_requeue_cancelled(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "w1")
+        job_controller.cancel(db, job.id)
+        assert job_controller.release(db, "w1") == 0
+        db.refresh(job)
+        assert job.status == "cancelled"
+
+
+class TestTransport:
+    """The flag reaches the transfer loop."""
+
+    def test_telnet_fetch_raises_fetch_cancelled(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        dev = FakeTelnetDevice(outputs={b"show running-config": b"hostname R1"})
+        cancel = threading.Event()
+        cancel.set()
+        with pytest.raises(FetchCancelled):
+            netmiko_worker.fetch_running_config(
+                vendor="Cisco", host="127.0.0.1", username="u", password="p",
+                secret=None, protocol="Telnet", port=dev.port, cancel=cancel,
+            )
+        assert [p.name for p in tmp_path.iterdir()] == []
+
+    def test_cancel_after_transfer_stores_nothing(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        dev = FakeTelnetDevice(outputs={b"show running-config": b"hostname R1"})
+        cancel = threading.Event()
+
+        class _CancelOnTransfer(netmiko_worker.FetchTiming):
+            def __setattr__(self, name, value):
+                if name == "transfer_s" and value is not None:
+                    cancel.set()  # abandoned after the last read, before the commit
+                super().__setattr__(name, value)
+
+        timing = _CancelOnTransfer()
+        with pytest.raises(FetchCancelled):
+            netmiko_worker.fetch_running_config(
+                vendor="Cisco", host="127.0.0.1", username="u", password="p",
+                secret=None, protocol="Telnet", port=dev.port, cancel=cancel, timing=timing,
+            )
+        assert not (tmp_path / "objects").exists()
+
+
+class TestApi:
+    """POST /jobs/{id}/cancel."""
+
+    def test_cancel_endpoint(self, db, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import require_admin
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, lambda: type("U", (), {"username": "t"})())
+        monkeypatch.setattr(jobs, "audit_event", lambda **kwargs: None)
+        running = job_controller.enqueue(db, "manual", [1])
+        queued = job_controller.enqueue(db, "manual", [2])
+        job_controller.claim(db, "w1")
+        assert client.post(f"/jobs/{running.id}/cancel").json() == {"ok": True, "status": "cancelling"}
+        assert client.post(f"/jobs/{queued.id}/cancel").json() == {"ok": True, "status": "cancelled"}
+        assert client.post(f"/jobs/{queued.id}/cancel").json()["ok"] is False
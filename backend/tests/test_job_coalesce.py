@@ -0,0 +1,152 @@
+"""
+Tests for single-flight backup requests per device.
+
+Tests cover:
+1. enqueue(): devices a queued/running job is still to fetch are shared, not queued again
+2. execute(): shared devices get the other job's result without a second session
+3. The other job cancelled, still queued or still running elsewhere
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.models import Backup, Job, JobResult
+from app.services import job_controller, netmiko_worker
+from app.services.backup_store import StoredConfig
+
+from .conftest import TestSessionLocal
+
+
+@pytest.fixture
+def fetches(db, monkeypatch, tmp_path):
+    calls = []
+
+    def fake_fetch(*, host, **kwargs):
+        calls.append(host)
+        path = tmp_path / f"{host}-{len(calls)}.cfg"
+        path.write_bytes(b"hostname x")
+        return StoredConfig(path=str(path), sha256=f"{len(calls)}".ljust(64, "0"), size=10)
+
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+    return calls
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(job_controller.settings, "JOB_POLL_INTERVAL", 0.05)
+    return db
+
+
+def _payload(job):
+    return json.loads(job.payload)
+
+
+class TestEnqueue:
+    """Tests for sharing at enqueue time."""
+
+    def test_overlap_shared_with_queued_job(self, db):
+        first = job_controller.enqueue(db, "manual", [1, 2])
+        second = job_controller.enqueue(db, "schedule:Nightly", [1, 2, 3])
+        assert _payload(second) == {"device_ids": [3], "shared": {"1": first.id, "2": first.id}}
+        assert f"2 device(s) already queued or running, sharing the result of job#{first.id}" in second.log
+
+    def test_shares_with_the_fetching_job_only(self, db):
+        first = job_controller.enqueue(db, "manual", [1])
+        job_controller.enqueue(db, "manual", [1, 2])
+        third = job_controller.enqueue(db, "manual", [1, 2])
+        assert _payload(third)["shared"]["1"] == first.id
+        assert _payload(third)["shared"]["2"] != first.id
+
+    def test_devices_already_fetched_are_queued_again(self, db):
+        first = job_controller.enqueue(db, "manual", [1, 2])
+        job_controller.claim(db, "other")
+        db.add(JobResult(job_id=first.id, device_id=1, status="success"))
+        db.commit()
+        second = job_controller.enqueue(db, "manual", [1, 2])
+        assert _payload(second) == {"device_ids": [1], "shared": {"2": first.id}}
+
+    def test_finished_jobs_and_disabled(self, db, monkeypatch):
+        first = job_controller.enqueue(db, "manual", [1])
+        job_controller.cancel(db, first.id)
+        assert _payload(job_controller.enqueue(db, "manual", [1])) == {"device_ids": [1]}
+        monkeypatch.setattr(job_controller.settings, "JOB_COALESCE", False)
+        assert _payload(job_controller.enqueue(db, "manual", [1])) == {"device_ids": [1]}
+
+
+class TestExecute:
+    """Shared results when the job runs."""
+
+    def test_one_session_per_device(self, db, fetches):
+        first = job_controller.enqueue(db, "manual", [1, 2])
+        second = job_controller.enqueue(db, "manual", [1, 2, 3])
+        asyncio.run(job_controller.run_next("w1"))
+        asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        assert sorted(fetches) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+        second = db.get(Job, second.id)
+        assert (second.status, second.devices, second.devices_total, second.devices_done) == ("success", 3, 3, 3)
+        rows = {r.device_id: r for r in db.query(JobResult).filter_by(job_id=second.id)}
+        assert (rows[1].shared_from_job_id, rows[3].shared_from_job_id) == (first.id, None)
+        mine = db.query(JobResult).filter_by(job_id=first.id, device_id=1).one()
+        assert rows[1].backup_id == mine.backup_id == db.query(Backup.id).filter_by(device_id=1).scalar()
+        assert f"[sw1] Shared result of job#{first.id}: success" in second.log
+        assert "Job completed: 3/3 successful" in second.log
+
+    def test_owner_cancelled_fetches_itself(self, db, fetches):
+        first = job_controller.enqueue(db, "manual", [1])
+        second = job_controller.enqueue(db, "manual", [1])
+        job_controller.cancel(db, first.id)
+        asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        assert fetches == ["10.0.0.1"]
+        row = db.query(JobResult).filter_by(job_id=second.id).one()
+        assert (row.status, row.shared_from_job_id) == ("success", None)
+        assert "Fetching 1 device(s) the other job(s) did not back up" in db.get(Job, second.id).log
+
+    def test_waits_for_owner_running_elsewhere(self, db, fetches):
+        first = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "other-process")
+        second = job_controller.enqueue(db, "manual", [1])
+
+        async def other_process_finishes():
+            await asyncio.sleep(0.2)
+            s = TestSessionLocal()
+            s.add(JobResult(job_id=first.id, device_id=1, status="failed", error="timed out", error_class="timeout"))
+            s.commit()
+            job_controller._finish(s, first.id, "other-process", "success", 0, ["done"])
+            s.close()
+
+        async def scenario():
+            other = asyncio.create_task(other_process_finishes())
+            await job_controller.run_next("w1")
+            await other
+
+        asyncio.run(scenario())
+        db.expire_all()
+        assert fetches == []
+        row = db.query(JobResult).filter_by(job_id=second.id).one()
+        assert (row.status, row.error_class, row.shared_from_job_id) == ("failed", "timeout", first.id)
+        assert "Job completed: 0/1 successful" in db.get(Job, second.id).log
+
+    def test_waits_for_owner_still_queued(self, db, fetches):
+        first = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "other-process")
+        second = job_controller.enqueue(db, "manual", [1])
+        assert job_controller.claim(db, "w1").id == second.id
+        job_controller.release(db, "other-process")  # handed back: queued again
+
+        async def owner_runs_later():
+            await asyncio.sleep(0.2)
+            await job_controller.run_next("w2")
+
+        async def scenario():
+            owner = asyncio.create_task(owner_runs_later())
+            await job_controller.execute(second.id, "w1")
+            await owner
+
+        asyncio.run(scenario())
+        db.expire_all()
+        assert fetches == ["10.0.0.1"]  # by the owner only
+        row = db.query(JobResult).filter_by(job_id=second.id).one()
+        assert (row.status, row.shared_from_job_id) == ("success", first.id)
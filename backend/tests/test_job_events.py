@@ -0,0 +1,188 @@
+"""
+Tests for incrementally written job progress.
+
+Tests cover:
+1. JobLog: lines and counters written in batches, only by the flusher
+2. execute(): events and device counters while the job runs; events of ended jobs swept
+3. Throughput/ETA, and a dead worker's log kept when its job is reclaimed
+4. GET /jobs/{id}/events: snapshot, new lines, progress and done (NDJSON and SSE)
+"""
+import asyncio
+import json
+import threading
+from datetime import timedelta
+
+import pytest
+
+from app.models import Job, JobEvent
+from app.services import job_controller, job_events
+from app.services.job_events import JobLog
+
+from .conftest import TestSessionLocal
+from .test_job_queue import _expire
+
+
+def _messages(db, job_id):
+    return [e.message for e in db.query(JobEvent).filter_by(job_id=job_id).order_by(JobEvent.id)]
+
+
+class TestJobLog:
+    """Tests for the batching log list."""
+
+    def test_lines_written_on_flush_only(self, db):
+        job = job_controller.enqueue(db, "manual", [1], log_lines=["Queued by t"])
+        log = JobLog(job.id, 1, ["Queued by t"])
+        log.append("one")
+        log.start(3)
+        log.progress(1, 1)
+        assert log == ["Queued by t", "one"]
+        assert _messages(db, job.id) == []
+        log.flush()
+        db.expire_all()
+        assert _messages(db, job.id) == ["one"]
+        assert (job.devices_total, job.devices_done, job.devices) == (3, 1, 1)
+
+    def test_full_batch_wakes_flusher(self, db, monkeypatch):
+        monkeypatch.setattr(job_events.settings, "JOB_EVENT_BATCH", 2)
+        monkeypatch.setattr(job_events.settings, "JOB_EVENT_FLUSH_SECONDS", 60)
+        job = job_controller.enqueue(db, "manual", [1])
+
+        async def scenario():
+            log = JobLog(job.id)
+            flusher = asyncio.create_task(log.keep_flushing())
+            log.append("a")
+            await asyncio.sleep(0.05)
+            first = _messages(db, job.id)
+            log.append("b")
+            await asyncio.sleep(0.05)
+            flusher.cancel()
+            return first, _messages(db, job.id)
+
+        assert asyncio.run(scenario()) == ([], ["a", "b"])
+
+
+class TestExecute:
+    """Progress of a job run by the worker."""
+
+    def test_events_and_counters(self, db):
+        seen = []
+        original = JobLog.progress
+
+        def spy(self, done, ok):
+            seen.append((done, ok))
+            original(self, done, ok)
+
+        job = job_controller.enqueue(db, "manual", [1, 2, 3], log_lines=["Queued by t"])
+        with pytest.MonkeyPatch.context() as m:
+            m.setattr(JobLog, "progress", spy)
+            asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        job = db.get(Job, job.id)
+        assert [done for done, _ in seen] == [1, 2, 3]
+        assert (job.devices_total, job.devices_done, job.devices) == (3, 3, 2)
+        events = _messages(db, job.id)
+        assert events[0].startswith("Job started at")
+        assert events[-1] == "Job completed: 2/3 successful"
+        assert job.log.splitlines() == ["Queued by t"] + events
+
+    def test_events_of_ended_jobs_swept(self, db):
+        old = job_controller.enqueue(db, "manual", [1])
+        asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        assert _messages(db, old.id)  # kept for streams still catching up
+        db.get(Job, old.id).finished_at = job_controller._now() - timedelta(hours=2)
+        db.commit()
+        new = job_controller.enqueue(db, "manual", [2])
+        asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        assert _messages(db, old.id) == []
+        assert "Job completed: 1/1 successful" in db.get(Job, old.id).log
+        assert _messages(db, new.id)
+
+
+class TestProgress:
+    """Throughput, ETA and recovery."""
+
+    def test_rate_and_eta(self, db):
+        job = Job(triggered_by="manual", status="running", devices_total=100, devices_done=25, devices=20,
+                  started_at=job_controller._now() - timedelta(minutes=5))
+        p = job_events.progress(job)
+        assert (p["devices_done"], p["succeeded"], p["rate_per_min"]) == (25, 20, 5.0)
+        assert 890 <= p["eta_s"] <= 900
+
+    def test_no_eta_before_first_device(self, db):
+        job = Job(triggered_by="manual", status="running", devices_total=10, started_at=job_controller._now())
+        assert job_events.progress(job)["eta_s"] is None
+
+    def test_dead_worker_log_kept(self, db):
+        job = job_controller.enqueue(db, "manual", [1], log_lines=["Queued by t"])
+        job_controller.claim(db, "dead-worker")
+        log = JobLog(job.id, 1)
+        log.append("[sw1] Connecting to 10.0.0.1...")
+        log.flush()
+        assert job_events.current_log(db, job)[0] == ["Queued by t", "[sw1] Connecting to 10.0.0.1..."]
+        _expire(db, job.id)
+        job_controller.reclaim_expired(db)
+        db.refresh(job)
+        assert job.log.splitlines()[:2] == ["Queued by t", "[sw1] Connecting to 10.0.0.1..."]
+        assert "Lease of dead-worker expired" in job.log
+
+
+class TestStream:
+    """GET /jobs/{id}/events."""
+
+    @pytest.fixture
+    def api(self, db, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import get_current_user
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: type("U", (), {"username": "t"})())
+        monkeypatch.setattr(jobs.settings, "JOB_STREAM_POLL", 0.05)
+        return client
+
+    def test_running_job_followed_to_the_end(self, db, api):
+        job = job_controller.enqueue(db, "manual", [1, 2], log_lines=["Queued by t"])
+        job_controller.claim(db, "w1")
+        log = JobLog(job.id, 1)
+        log.append("Processing 2 device(s)...")
+        log.start(2)
+        log.flush()
+
+        def finish():
+            log.append("[sw1] Backup success")
+            log.progress(1, 1)
+            log.flush()
+            job_controller._finish(TestSessionLocal(), job.id, "w1", "success", 1, ["done"])
+
+        timer = threading.Timer(0.3, finish)
+        timer.start()
+        with api.stream("GET", f"/jobs/{job.id}/events") as r:
+            assert r.headers["content-type"].startswith("application/x-ndjson")
+            messages = [json.loads(line) for line in r.iter_lines() if line.strip()]
+        timer.join()
+        types = [m["type"] for m in messages]
+        assert types[0] == "snapshot" and types[-1] == "done"
+        assert messages[0]["log"] == ["Queued by t", "Processing 2 device(s)..."]
+        assert (messages[0]["devices_done"], messages[0]["devices_total"]) == (0, 2)
+        assert [m["line"] for m in messages if m["type"] == "log"] == ["[sw1] Backup success"]
+        assert "progress" in types
+        assert messages[-1]["status"] == "success"
+
+    def test_finished_job_sse(self, db, api):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.cancel(db, job.id)
+        r = api.get(f"/jobs/{job.id}/events", headers={"Accept": "text/event-stream"})
+        assert r.headers["content-type"].startswith("text/event-stream")
+        assert [line for line in r.text.splitlines() if line.startswith("event:")] == ["event: snapshot", "event: done"]
+
+    def test_unknown_job(self, api):
+        assert api.get("/jobs/999/events").status_code == 404
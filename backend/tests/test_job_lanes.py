@@ -0,0 +1,204 @@
+"""
+Tests for job priority lanes.
+
+Tests cover:
+1. PrioritySemaphore: urgent waiters first, reserved permits, cancelled waiters
+2. DeviceLimiter: an interactive device waits for one device session, not for the sweep
+3. claim() by lane, the worker's place for urgent jobs beside a sweep, the last
+   place only for interactive jobs
+4. Worker end to end; sharing only with jobs as urgent; POST /jobs/run/manual lanes
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.models import Job
+from app.services import collector, job_controller, netmiko_worker
+from app.services.collector import INTERACTIVE, MANUAL, SCHEDULED, DeviceLimiter, PrioritySemaphore
+
+from .conftest import FakeFleet, TestSessionLocal, add_devices
+
+
+class TestPrioritySemaphore:
+    """Tests for the priority-ordered semaphore."""
+
+    def test_most_urgent_waiter_first(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            order = []
+            await sem.acquire(MANUAL)
+
+            async def waiter(priority, name):
+                await sem.acquire(priority)
+                order.append(name)
+                sem.release()
+
+            tasks = [asyncio.create_task(waiter(p, n)) for p, n in
+                     ((SCHEDULED, "sweep1"), (SCHEDULED, "sweep2"), (INTERACTIVE, "test"), (MANUAL, "manual"))]
+            await asyncio.sleep(0)
+            sem.release()
+            await asyncio.gather(*tasks)
+            return order
+
+        assert asyncio.run(scenario()) == ["test", "manual", "sweep1", "sweep2"]
+
+    def test_reserved_permits_not_for_scheduled(self):
+        async def scenario():
+            sem = PrioritySemaphore(2, reserved=1)
+            await sem.acquire(SCHEDULED)
+            sweep = asyncio.create_task(sem.acquire(SCHEDULED))
+            await asyncio.sleep(0.01)
+            blocked = not sweep.done()
+            await asyncio.wait_for(sem.acquire(INTERACTIVE), 1)  # the reserved one
+            sweep.cancel()
+            return blocked
+
+        assert asyncio.run(scenario())
+
+    def test_cancelled_waiter_skipped(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            await sem.acquire()
+            gone = asyncio.create_task(sem.acquire(INTERACTIVE))
+            later = asyncio.create_task(sem.acquire(SCHEDULED))
+            await asyncio.sleep(0)
+            gone.cancel()
+            await asyncio.sleep(0)
+            sem.release()
+            await asyncio.wait_for(later, 1)
+            return True
+
+        assert asyncio.run(scenario())
+
+
+class TestDeviceLimiter:
+    """Device-granularity preemption."""
+
+    def test_interactive_device_overtakes_queued_sweep_devices(self):
+        async def scenario():
+            limiter = DeviceLimiter(1, 0, 0)
+            order = []
+
+            async def device(name, priority):
+                async with limiter.slot("Cisco", name, priority):
+                    order.append(name)
+                    await asyncio.sleep(0.02)
+
+            sweep = [asyncio.create_task(device(f"sweep{i}", SCHEDULED)) for i in range(5)]
+            await asyncio.sleep(0.01)  # sweep0 holds the slot, the rest wait
+            await device("test", INTERACTIVE)
+            await asyncio.gather(*sweep)
+            return order
+
+        assert asyncio.run(scenario())[:2] == ["sweep0", "test"]
+
+
+@pytest.fixture
+def db(db, monkeypatch, tmp_path):
+    slow = [f"10.0.0.{i}" for i in range(2, 7)]  # sweep devices are slow
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", FakeFleet(tmp_path, down=(), slow=slow).fetch)
+    add_devices(db, range(4, 7))
+    return db
+
+
+class TestClaim:
+    """Tests for claiming by lane."""
+
+    def test_urgent_lane_first(self, db):
+        sweep = job_controller.enqueue(db, "schedule:Nightly", [2], priority=SCHEDULED)
+        manual = job_controller.enqueue(db, "manual", [3])
+        picked = job_controller.enqueue(db, "manual", [4], priority=INTERACTIVE)
+        assert [job_controller.claim(db, "w1").id for _ in range(3)] == [picked.id, manual.id, sweep.id]
+
+    def test_no_bulk(self, db):
+        job_controller.enqueue(db, "schedule:Nightly", [2], priority=SCHEDULED)
+        assert job_controller.claim(db, "w1", up_to=MANUAL) is None
+
+    def test_one_place_kept_for_urgent_jobs(self, db):
+        job_controller.enqueue(db, "schedule:A", [2], priority=SCHEDULED)
+        job_controller.enqueue(db, "schedule:B", [3], priority=SCHEDULED)
+        assert [p for _, p in job_controller._claim_more({})] == [SCHEDULED]
+        job_controller.enqueue(db, "manual", [4])
+        assert [p for _, p in job_controller._claim_more({"sweep": SCHEDULED})] == [MANUAL]
+
+    def test_last_place_kept_for_interactive_jobs(self, db, monkeypatch):
+        monkeypatch.setattr(job_controller.settings, "JOB_CONCURRENCY", 3)
+        job_controller.enqueue(db, "manual", [1, 2, 3, 4, 5, 6])
+        job_controller.enqueue(db, "schedule:Nightly", [1, 2, 3, 4, 5, 6], priority=SCHEDULED)
+        running = {f"job{i}": p for i, (_, p) in enumerate(job_controller._claim_more({}))}
+        assert sorted(running.values()) == [MANUAL, SCHEDULED]  # a full manual run beside the sweep
+        job_controller.enqueue(db, "manual", [2])
+        assert job_controller._claim_more(running) == []
+        picked = job_controller.enqueue(db, "manual", [1], priority=INTERACTIVE)
+        assert job_controller._claim_more(running) == [(picked.id, INTERACTIVE)]
+
+    def test_legacy_row_is_manual(self, db):
+        db.add(Job(id=50, triggered_by="manual", status="queued", priority=None, payload='{"device_ids": []}'))
+        db.commit()
+        job_controller.enqueue(db, "schedule:A", [2], priority=SCHEDULED)
+        job = job_controller.claim(db, "w1")
+        assert (job.id, job_controller.lane(job)) == (50, "manual")
+
+
+class TestWorker:
+    """Urgent work beside a running sweep."""
+
+    def test_interactive_job_done_while_sweep_runs(self, db, monkeypatch):
+        monkeypatch.setattr(job_controller.settings, "JOB_POLL_INTERVAL", 0.05)
+        monkeypatch.setattr(collector.settings, "COLLECTOR_MAX_WORKERS", 2)
+        sweep = job_controller.enqueue(db, "schedule:Nightly", [2, 3, 4, 5, 6], priority=SCHEDULED)
+
+        async def scenario():
+            job_controller.start()
+            try:
+                await asyncio.sleep(0.1)  # the sweep is running
+                picked = job_controller.enqueue(TestSessionLocal(), "manual", [1], priority=INTERACTIVE)
+                for _ in range(200):
+                    s = TestSessionLocal()
+                    statuses = (s.get(Job, picked.id).status, s.get(Job, sweep.id).status)
+                    s.close()
+                    if "success" in statuses:
+                        return statuses
+                    await asyncio.sleep(0.02)
+            finally:
+                await job_controller.stop()
+
+        assert asyncio.run(scenario()) == ("success", "running")
+
+    def test_no_sharing_with_less_urgent_jobs(self, db):
+        sweep = job_controller.enqueue(db, "schedule:Nightly", [1, 2], priority=SCHEDULED)
+        picked = job_controller.enqueue(db, "manual", [1], priority=INTERACTIVE)
+        assert json.loads(picked.payload) == {"device_ids": [1]}
+        later = job_controller.enqueue(db, "schedule:Other", [1, 2], priority=SCHEDULED)
+        assert json.loads(later.payload)["shared"] == {"1": sweep.id, "2": sweep.id}
+
+
+class TestApi:
+    """POST /jobs/run/manual and GET /jobs/queue."""
+
+    def test_selected_devices_run_interactive(self, db, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import get_current_user, require_admin
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        user = lambda: type("U", (), {"username": "t"})()
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, user)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, user)
+        monkeypatch.setattr(jobs, "audit_event", lambda **kwargs: None)
+
+        assert client.post("/jobs/run/manual", json={}).json()["lane"] == "manual"
+        r = client.post("/jobs/run/manual", json={"device_ids": [1]}).json()
+        assert r["lane"] == "interactive"
+        assert client.get(f"/jobs/{r['job_id']}").json()["lane"] == "interactive"
+        assert client.post("/jobs/run/manual", json={"device_ids": [999]}).status_code == 404
+        lanes = client.get("/jobs/queue").json()["lanes"]
+        assert lanes["interactive"]["queued"] == 1 and lanes["manual"]["queued"] == 1
@@ -0,0 +1,205 @@
+"""
+Tests for the durable job queue.
+
+Tests cover:
+1. enqueue/claim: persisted payload, atomic claim, leases and heartbeats
+2. Expired leases requeued (or failed after JOB_MAX_ATTEMPTS), legacy running rows failed
+3. execute(): devices re-read from the payload; a retry keeps the earlier attempt's results
+4. Worker loop, clean shutdown hand-back, POST /jobs/run/manual and GET /jobs/queue
+5. Duplicate job results removed (and logged) when the unique index is added
+"""
+import asyncio
+import json
+from datetime import timedelta
+
+import pytest
+
+from app.models import Backup, Job, JobResult
+from app.services import job_controller
+
+from .conftest import TestSessionLocal
+
+
+def _expire(db, job_id):
+    job = db.get(Job, job_id)
+    job.lease_expires_at = job_controller._now() - timedelta(seconds=1)
+    db.commit()
+
+
+class TestClaim:
+    """Tests for enqueue, claim and heartbeats."""
+
+    def test_enqueue_persists_payload(self, db):
+        job = job_controller.enqueue(db, "manual", [1, 2], requested_by="alice", log_lines=["queued"])
+        assert job.status == "queued"
+        assert json.loads(job.payload) == {"device_ids": [1, 2]}
+        assert job.enqueued_at is not None
+
+    def test_claim_is_exclusive_and_fifo(self, db):
+        first = job_controller.enqueue(db, "manual", [1])
+        job_controller.enqueue(db, "manual", [2])
+        claimed = job_controller.claim(db, "w1")
+        assert claimed.id == first.id
+        assert (claimed.status, claimed.lease_owner, claimed.attempts) == ("running", "w1", 1)
+        assert claimed.lease_expires_at > job_controller._now()
+        other = job_controller.claim(TestSessionLocal(), "w2")
+        assert other.id != first.id
+        assert job_controller.claim(db, "w3") is None
+
+    def test_heartbeat_only_for_the_holder(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "w1")
+        _expire(db, job.id)
+        assert job_controller.heartbeat(db, job.id, "w1")
+        db.refresh(job)
+        assert job.lease_expires_at > job_controller._now()
+        assert not job_controller.heartbeat(db, job.id, "w2")
+
+
+class TestReclaim:
+    """Tests for leases that ran out."""
+
+    def test_expired_lease_is_requeued(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "dead-worker")
+        assert job_controller.reclaim_expired(db) == 0
+        _expire(db, job.id)
+        assert job_controller.reclaim_expired(db) == 1
+        db.refresh(job)
+        assert (job.status, job.lease_owner) == ("queued", None)
+        assert "Lease of dead-worker expired" in job.log
+        assert job_controller.claim(db, "w2").attempts == 2
+
+    def test_gives_up_after_max_attempts(self, db, monkeypatch):
+        monkeypatch.setattr(job_controller.settings, "JOB_MAX_ATTEMPTS", 1)
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "dead-worker")
+        _expire(db, job.id)
+        job_controller.reclaim_expired(db)
+        db.refresh(job)
+        assert job.status == "failed"
+        assert job.finished_at is not None
+
+    def test_legacy_running_row_fails(self, db):
+        db.add(Job(id=99, triggered_by="manual", status="running"))
+        db.commit()
+        job_controller.reclaim_expired(db)
+        assert db.get(Job, 99).status == "failed"
+
+    def test_release_hands_jobs_back(self, db):
+        job = job_controller.enqueue(db, "manual", [1])
+        job_controller.claim(db, "w1")
+        assert job_controller.release(db, "w1") == 1
+        db.refresh(job)
+        assert (job.status, job.attempts) == ("queued", 0)
+
+
+class TestExecute:
+    """Tests for running a claimed job."""
+
+    def test_runs_payload_devices(self, db):
+        job = job_controller.enqueue(db, "manual", [1, 2, 3], log_lines=["Queued by t"])
+        assert asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        job = db.get(Job, job.id)
+        assert (job.status, job.devices, job.lease_owner) == ("success", 2, None)
+        assert job.log.startswith("Queued by t\nJob started at")
+        assert "Job completed: 2/3 successful" in job.log
+        assert not asyncio.run(job_controller.run_next("w1"))
+
+    def test_retry_keeps_earlier_results(self, db):
+        job = job_controller.enqueue(db, "manual", [1, 2, 3])
+        job_controller.claim(db, "dead-worker")
+        db.add_all([
+            JobResult(job_id=job.id, device_id=1, status="success"),
+            JobResult(job_id=job.id, device_id=2, status="cancelled"),
+        ])
+        db.commit()
+        _expire(db, job.id)
+        asyncio.run(job_controller.run_next("w1"))
+        db.expire_all()
+        rows = db.query(JobResult).filter_by(job_id=job.id).all()
+        assert sorted((r.device_id, r.status) for r in rows) == [(1, "success"), (2, "success"), (3, "failed")]
+        assert db.query(Backup).filter_by(device_id=1).count() == 0  # not fetched again
+        job = db.get(Job, job.id)
+        assert "1 device(s) already done by an earlier attempt (1 successful)" in job.log
+        assert "Job completed: 2/3 successful" in job.log
+        assert (job.devices_total, job.devices_done) == (3, 3)
+
+
+class TestSchemaUpgrade:
+    """ensure_schema() adding the one-row-per-job-and-device index to an older database."""
+
+    def test_duplicate_results_removed_and_logged(self, monkeypatch, tmp_path, caplog):
+        from sqlalchemy import create_engine, text
+
+        from app import database
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        database.Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP INDEX ux_job_results_job_device"))
+            for job_id, device_id in ((1, 1), (1, 1), (1, 2), (2, 1)):
+                conn.execute(text(
+                    "INSERT INTO job_results (job_id, device_id, status, finished_at) "
+                    "VALUES (:job, :device, 'success', '2024-01-01 00:00:00')"
+                ), {"job": job_id, "device": device_id})
+        monkeypatch.setattr(database, "engine", engine)
+        database.ensure_schema()
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, job_id, device_id FROM job_results ORDER BY id")).all()
+        assert [tuple(r) for r in rows] == [(1, 1, 1), (3, 1, 2), (4, 2, 1)]  # oldest kept
+        assert "Removed 1 duplicate job_results row(s)" in caplog.text
+        engine.dispose()
+
+
+class TestWorker:
+    """The worker loop and the API."""
+
+    def test_worker_picks_up_queued_job(self, db, monkeypatch):
+        monkeypatch.setattr(job_controller.settings, "JOB_POLL_INTERVAL", 0.05)
+        job = job_controller.enqueue(db, "manual", [1])
+
+        async def scenario():
+            job_controller.start()
+            try:
+                for _ in range(100):
+                    s = TestSessionLocal()
+                    status = s.get(Job, job.id).status
+                    s.close()
+                    if status == "success":
+                        return status
+                    await asyncio.sleep(0.05)
+            finally:
+                await job_controller.stop()
+
+        assert asyncio.run(scenario()) == "success"
+
+    def test_manual_run_and_queue_stats(self, db, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import get_current_user, require_admin
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        user = lambda: type("U", (), {"username": "t"})()
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, user)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, user)
+        monkeypatch.setattr(jobs, "audit_event", lambda **kwargs: None)
+
+        job_id = client.post("/jobs/run/manual").json()["job_id"]
+        stats = client.get("/jobs/queue").json()
+        assert (stats["queued"], stats["running"]) == (1, 0)
+        assert stats["oldest_queued_s"] is not None
+
+        assert asyncio.run(job_controller.run_next("w1"))
+        stats = client.get("/jobs/queue").json()
+        assert (stats["queued"], stats["recent_jobs"]) == (0, 1)
+        assert stats["avg_wait_s"] is not None
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "success"
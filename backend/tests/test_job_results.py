@@ -0,0 +1,168 @@
+"""
+Tests for structured per-device job results.
+
+Tests cover:
+1. Error classes
+2. run_backup: one job_results row per device with status, timings, bytes and backup id,
+   written with bulk inserts
+3. Skipped and cancelled devices; runs without a job record nothing
+4. GET /jobs/{id}/results, /jobs/results and the failure report
+"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.models import Backup, Job, JobResult
+from app.services import circuit_breaker, collector
+from app.utils.timeutil import tznow
+
+from .conftest import TestSessionLocal, test_engine
+
+
+def _devices(*ids):
+    return [
+        {"id": i, "hostname": f"sw{i}", "ip": f"10.0.0.{i}", "vendor": "Cisco", "protocol": "SSH", "port": 22,
+         "username": "u", "password": "p", "secret": None}
+        for i in ids
+    ]
+
+
+def _run(db, *ids) -> int:
+    job = Job(triggered_by="manual", status="running")
+    db.add(job)
+    db.commit()
+    asyncio.run(collector.run_backup(db, _devices(*ids), [], job_id=job.id))
+    return job.id
+
+
+def _results(db, job_id) -> dict[int, JobResult]:
+    return {r.device_id: r for r in db.query(JobResult).filter_by(job_id=job_id)}
+
+
+class TestErrorClass:
+    """Tests for circuit_breaker.error_class()."""
+
+    @pytest.mark.parametrize("error, expected", [
+        ("Connection failed: 10.0.0.1 | Error: Authentication to device failed.", "auth"),
+        ("Unreachable: 10.0.0.1:22 (timed out)", "unreachable"),
+        ("Telnet timeout waiting for login prompt (last output: '')", "timeout"),
+        ("Connection failed: 10.0.0.1 | Error: [Errno 111] Connection refused", "refused"),
+        ("SSH session closed waiting for prompt prompt", "disconnected"),
+        ("unknown transport 'x'", "unsupported"),
+        ("disk full", "other"),
+    ])
+    def test_classes(self, error, expected):
+        assert circuit_breaker.error_class(error) == expected
+
+
+class TestRunBackup:
+    """Rows written by the collector."""
+
+    def test_one_row_per_device(self, db):
+        job_id = _run(db, 1, 2, 3)
+        rows = _results(db, job_id)
+        assert {i: r.status for i, r in rows.items()} == {1: "success", 2: "success", 3: "failed"}
+        ok, failed = rows[1], rows[3]
+        assert ok.backup_id == db.query(Backup.id).filter_by(device_id=1).scalar()
+        assert (ok.connect_s, ok.auth_s, ok.transfer_s, ok.size_bytes) == (0.5, 0.25, 1.5, 10)
+        assert ok.error is None and ok.error_class is None
+        assert (failed.error_class, failed.backup_id) == ("timeout", None)
+        assert "timed out" in failed.error
+        assert failed.finished_at is not None
+
+    def test_unchanged_points_at_verified_backup(self, db):
+        _run(db, 1)
+        first = db.query(Backup.id).filter_by(device_id=1).scalar()
+        row = _results(db, _run(db, 1))[1]
+        assert (row.status, row.backup_id, row.size_bytes) == ("unchanged", first, 10)
+
+    def test_bulk_inserts(self, db, monkeypatch):
+        monkeypatch.setattr(collector.settings, "JOB_EVENT_BATCH", 2)
+        inserts = []
+
+        def spy(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("INSERT INTO job_results"):
+                inserts.append(len(parameters) if executemany else 1)
+
+        event.listen(test_engine, "before_cursor_execute", spy)
+        try:
+            _run(db, 1, 2, 3)
+        finally:
+            event.remove(test_engine, "before_cursor_execute", spy)
+        assert inserts == [2, 1]
+
+    def test_circuit_open_skipped(self, db, monkeypatch):
+        monkeypatch.setattr(collector.settings, "BREAKER_THRESHOLD", 1)
+        _run(db, 3)
+        db.expire_all()
+        row = _results(db, _run(db, 3))[3]
+        assert (row.status, row.error_class) == ("skipped", "circuit_open")
+        assert "timed out" in row.error
+
+    def test_cancelled_devices(self, db):
+        import threading
+
+        cancel = threading.Event()
+        cancel.set()
+        job = Job(triggered_by="manual", status="running")
+        db.add(job)
+        db.commit()
+        asyncio.run(collector.run_backup(db, _devices(1, 2), [], job_id=job.id, cancel=cancel))
+        assert {r.status for r in _results(db, job.id).values()} == {"cancelled"}
+
+    def test_no_job_no_rows(self, db):
+        asyncio.run(collector.run_backup(db, _devices(1), []))
+        assert db.query(JobResult).count() == 0
+
+
+class TestApi:
+    """The results endpoints."""
+
+    @pytest.fixture
+    def api(self, db, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import get_current_user
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: type("U", (), {"username": "t"})())
+        return client
+
+    def test_job_results(self, db, api):
+        job_id = _run(db, 1, 3)
+        rows = api.get(f"/jobs/{job_id}/results").json()
+        # completion order
+        assert sorted((r["hostname"], r["status"]) for r in rows) == [("sw1", "success"), ("sw3", "failed")]
+        assert api.get("/jobs/999/results").status_code == 404
+
+    def test_device_history(self, db, api):
+        _run(db, 1, 3)
+        _run(db, 3)
+        rows = api.get("/jobs/results", params={"device_id": 3}).json()
+        assert len(rows) == 2 and {r["status"] for r in rows} == {"failed"}
+        assert api.get("/jobs/results", params={"status": "success"}).json()[0]["device_id"] == 1
+
+    def test_failure_report(self, db, api):
+        _run(db, 1, 2, 3)
+        last = _run(db, 3)
+        old = Job(triggered_by="manual", status="success")
+        db.add(old)
+        db.commit()
+        db.add(JobResult(job_id=old.id, device_id=2, status="failed", error="Connection refused",
+                         error_class="refused", finished_at=tznow() - timedelta(days=40)))
+        db.commit()
+        report = api.get("/jobs/results/failures", params={"days": 30}).json()
+        assert len(report) == 1
+        entry = report[0]
+        assert (entry["hostname"], entry["failures"], entry["error_classes"]) == ("sw3", 2, {"timeout": 2})
+        assert entry["last_job_id"] == last
+        assert "timed out" in entry["last_error"]
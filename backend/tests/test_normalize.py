@@ -0,0 +1,209 @@
+"""
+Tests for per-vendor config normalization.
+
+Tests cover:
+1. Volatile lines dropped or masked per vendor, one compiled regex per platform
+2. NormalizingWriter: streaming output equals whole-buffer normalization
+3. Unchanged devices produce identical hashes; BACKUP_STORE_RAW keeps the original bytes;
+   masked values are stored, only the change check ignores them
+4. Telnet fetch end to end, and probes left untouched
+"""
+import asyncio
+
+import pytest
+
+from app.models import Backup, Blob, Device
+from app.services import collector, netmiko_worker, normalize
+from app.services.backup_store import StoredConfig, open_config
+from app.services.normalize import NormalizingWriter, normalizer_for
+
+from .conftest import TestSessionLocal
+from .test_telnet_driver import FakeTelnetDevice
+
+IOS = (
+    b"Building configuration...\n"
+    b"\n"
+    b"Current configuration : 1234 bytes\n"
+    b"!\n"
+    b"! Last configuration change at 10:00:00 UTC Mon Jan 1 2024 by admin\n"
+    b"! NVRAM config last updated at 09:00:00 UTC Mon Jan 1 2024 by admin\n"
+    b"!\n"
+    b"hostname R1\n"
+    b"ntp clock-period 17179869\n"
+    b"ntp server 10.0.0.1\n"
+    b"end\n"
+)
+
+
+def _ios(stamp: bytes) -> bytes:
+    return IOS.replace(b"10:00:00", stamp).replace(b"17179869", stamp.replace(b":", b""))
+
+
+class TestNormalizer:
+    """Tests for the per-vendor rules."""
+
+    def test_ios_volatile_lines_dropped(self):
+        out = normalizer_for("Cisco (IOS Router/Switch)").apply(IOS)
+        assert out == b"\n!\n!\nhostname R1\nntp server 10.0.0.1\nend\n"
+
+    def test_same_config_same_bytes(self):
+        n = normalizer_for("Cisco")
+        assert n.apply(_ios(b"10:00:00")) == n.apply(_ios(b"11:30:00"))
+
+    def test_fortigate_ver_and_enc_values(self):
+        cfg = (
+            b"#config-version=FGT60F-7.2.5-FW-build1517-230606:opmode=0:vdom=0\n"
+            b"#conf_file_ver=184467440737095\n"
+            b"config system admin\n"
+            b"    edit \"admin\"\n"
+            b"        set password ENC SH2abc123\n"
+            b"    next\n"
+            b"end\n"
+        )
+        out = normalizer_for("Fortinet (FortiGate)").apply(cfg)
+        assert b"conf_file_ver" not in out
+        assert b"#config-version=FGT60F" in out
+        assert b"        set password ENC <masked>\n" in out
+
+    @pytest.mark.parametrize("vendor, line", [
+        ("Juniper (JunOS)", b"## Last commit: 2024-01-01 10:00:00 UTC by admin"),
+        ("MikroTik (RouterOS)", b"# jan/02/2024 12:00:00 by RouterOS 6.49.7"),
+        ("MikroTik (RouterOS)", b"# 2024-01-02 12:00:00 by RouterOS 7.13"),
+        ("Huawei (OLT)", b"!Last configuration was updated at 2024-01-01 10:00:00+07:00"),
+        ("Cisco (ASA Firewall)", b"Cryptochecksum:0123abcd 4567ef01"),
+        ("Cisco (NXOS Data Center)", b"!Time: Mon Jan  1 10:00:00 2024"),
+        ("Aruba (AOS AP/Controller)", b"R1 uptime is 4 weeks, 2 days"),
+    ])
+    def test_dropped(self, vendor, line):
+        assert normalizer_for(vendor).line(line) is None
+
+    def test_config_lines_kept(self):
+        n = normalizer_for("Cisco")
+        for line in (b"hostname R1", b" description uptime is 99 percent", b"banner motd #", b"ntp server 10.0.0.1"):
+            assert n.line(line) == line
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(normalize.settings, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setattr(normalize.settings, "BACKUP_COMPRESSION", "none")
+
+    def write(data: bytes, base_path=None, vendor="Cisco", chunk=7) -> StoredConfig:
+        writer = NormalizingWriter(vendor, base_path)
+        for i in range(0, len(data), chunk):
+            writer.write(data[i:i + chunk])
+        return writer.commit()
+
+    return write
+
+
+class TestNormalizingWriter:
+    """Streaming normalization into the blob store."""
+
+    def test_streaming_matches_apply(self, store):
+        stored = store(IOS, chunk=3)
+        with open_config(stored.path) as f:
+            assert f.read() == normalizer_for("Cisco").apply(IOS)
+
+    def test_unchanged_device_same_hash(self, store):
+        first = store(_ios(b"10:00:00"))
+        again = store(_ios(b"23:59:59"), base_path=first.path)
+        assert again.unchanged
+        assert again.sha256 == first.sha256
+
+    def test_disabled(self, store, monkeypatch):
+        monkeypatch.setattr(normalize.settings, "BACKUP_NORMALIZE", False)
+        with open_config(store(IOS).path) as f:
+            assert f.read() == IOS
+
+    def test_raw_kept_for_new_versions(self, store, monkeypatch):
+        monkeypatch.setattr(normalize.settings, "BACKUP_STORE_RAW", True)
+        first = store(_ios(b"10:00:00"))
+        assert first.raw is not None
+        with open_config(first.raw.path) as f:
+            assert f.read() == _ios(b"10:00:00")
+        assert store(_ios(b"11:00:00"), base_path=first.path).raw is None  # unchanged
+        assert store(b"hostname R2\nend\n").raw is None  # nothing volatile: raw == normalized
+
+
+    def test_masked_values_kept_in_stored_blob(self, store):
+        def forti(salt: bytes, ver: bytes = b"1") -> bytes:
+            return (b"#conf_file_ver=" + ver + b"\nconfig system admin\n    edit \"admin\"\n"
+                    b"        set password ENC SH2" + salt + b"\n    next\nend\n")
+
+        first = store(forti(b"abc"), vendor="Fortinet")
+        with open_config(first.path) as f:
+            assert f.read() == forti(b"abc").split(b"\n", 1)[1]  # only conf_file_ver dropped
+        # re-salted ENC value, same config
+        assert store(forti(b"xyz", b"2"), base_path=first.path, vendor="Fortinet").unchanged
+        changed = store(forti(b"xyz").replace(b"admin", b"ops"), base_path=first.path, vendor="Fortinet")
+        assert not changed.unchanged
+
+    def test_masked_base_replaced(self, store, tmp_path):
+        # stored while ENC values were still masked in the blob
+        base = tmp_path / "masked.cfg"
+        base.write_bytes(b"config system admin\n        set password ENC <masked>\nend\n")
+        again = store(b"config system admin\n        set password ENC SH2abc\nend\n", base_path=str(base),
+                      vendor="Fortinet")
+        assert not again.unchanged
+        with open_config(again.path) as f:
+            assert b"ENC SH2abc" in f.read()
+
+
+class TestFetch:
+    """Normalization inside fetch_running_config."""
+
+    @pytest.fixture(autouse=True)
+    def _env(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_COMPRESSION", "none")
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+
+    def _fetch(self, dev, **kwargs):
+        return netmiko_worker.fetch_running_config(
+            vendor="Cisco", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port, **kwargs,
+        )
+
+    def test_telnet_pulls_hash_alike(self):
+        first = self._fetch(FakeTelnetDevice(outputs={b"show running-config": _ios(b"10:00:00").replace(b"\n", b"\r\n")}))
+        again = self._fetch(FakeTelnetDevice(outputs={b"show running-config": _ios(b"12:00:00").replace(b"\n", b"\r\n")}),
+                            base_path=first.path)
+        assert again.unchanged
+
+    def test_probe_output_untouched(self):
+        out = b"! Last configuration change at 10:00:00 UTC Mon Jan 1 2024"
+        dev = FakeTelnetDevice(outputs={b"show running-config | include Last configuration change": out})
+        result = self._fetch(dev, cmd="show running-config | include Last configuration change", keep_output=False)
+        assert b"Last configuration change at 10:00:00" in result.preview
+
+
+class TestRunBackup:
+    """Raw blobs recorded by the collector."""
+
+    def test_raw_blob_referenced(self, monkeypatch, tmp_path):
+        from app.services import config_history
+
+        monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+        monkeypatch.setattr(normalize.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(normalize.settings, "BACKUP_STORE_RAW", True)
+
+        def fake_fetch(*, vendor, base_path=None, **kwargs):
+            writer = NormalizingWriter(vendor, base_path)
+            writer.write(IOS)
+            return writer.commit()
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        db = TestSessionLocal()
+        db.add(Device(id=1, hostname="r1", ip="10.0.0.1", vendor="Cisco", protocol="SSH", port=22,
+                      username_enc="", password_enc=""))
+        db.commit()
+        device = {"id": 1, "hostname": "r1", "ip": "10.0.0.1", "vendor": "Cisco", "protocol": "SSH",
+                  "port": 22, "username": "u", "password": "p", "secret": None}
+        assert asyncio.run(collector.run_backup(db, [device], [])) == 1
+        [b] = db.query(Backup).all()
+        assert b.raw_blob_sha256 and b.raw_blob_sha256 != b.blob_sha256
+        assert db.get(Blob, b.raw_blob_sha256) is not None
+        # still referenced: not dropped
+        assert config_history.release_blobs(db, [b.raw_blob_sha256]) == 0
+        db.close()
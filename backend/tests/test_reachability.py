@@ -0,0 +1,164 @@
+"""
+Tests for the TCP reachability sweep.
+
+Tests cover:
+1. check() - open and closed ports
+2. sweep() - TTL cache, refresh, thousands of targets in seconds
+3. Pre-flight stage of run_backup
+4. /devices/reachability endpoint
+"""
+import asyncio
+import socket
+import time
+
+from app.models import Device
+from app.services import collector, netmiko_worker, reachability
+from app.services.backup_store import StoredConfig
+
+from .conftest import TestSessionLocal
+
+
+def _closed_port() -> int:
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+async def _with_server(coro_factory, host="127.0.0.1"):
+    async def handle(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, 0, backlog=4096)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await coro_factory(port)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+class TestCheck:
+    """Tests for check()."""
+
+    def test_open_port(self):
+        r = asyncio.run(_with_server(lambda port: reachability.check("127.0.0.1", port)))
+        assert r.reachable
+        assert r.latency_ms is not None and r.error is None
+
+    def test_closed_port(self):
+        r = asyncio.run(reachability.check("127.0.0.1", _closed_port()))
+        assert not r.reachable
+        assert r.error
+
+
+class TestSweep:
+    """Tests for sweep()."""
+
+    def test_cache_and_refresh(self, monkeypatch):
+        monkeypatch.setattr(reachability.settings, "REACHABILITY_CACHE_TTL", 60)
+        calls = []
+
+        async def fake_check(host, port, timeout=None):
+            calls.append((host, port))
+            return reachability.Reachability(True, 1.0, None, time.time())
+
+        monkeypatch.setattr(reachability, "check", fake_check)
+        targets = [("10.0.0.1", 22), ("10.0.0.2", 23), ("10.0.0.1", 22)]
+        asyncio.run(reachability.sweep(targets))
+        asyncio.run(reachability.sweep(targets))
+        assert sorted(calls) == [("10.0.0.1", 22), ("10.0.0.2", 23)]
+        asyncio.run(reachability.sweep(targets, refresh=True))
+        assert len(calls) == 4
+
+    def test_expired_entries_are_checked_again(self, monkeypatch):
+        monkeypatch.setattr(reachability.settings, "REACHABILITY_CACHE_TTL", 60)
+        reachability._cache[("10.0.0.1", 22)] = reachability.Reachability(True, 1.0, None, time.time() - 61)
+        assert reachability.cached("10.0.0.1", 22) is None
+
+    def test_thousands_of_targets_in_seconds(self, monkeypatch):
+        monkeypatch.setattr(reachability.settings, "REACHABILITY_CONCURRENCY", 256)
+
+        async def run(port):
+            # Linux routes all of 127/8 to loopback: 2000 distinct targets
+            targets = [(f"127.0.{i // 250}.{i % 250 + 1}", port) for i in range(2000)]
+            started = time.monotonic()
+            results = await reachability.sweep(targets)
+            return results, time.monotonic() - started
+
+        results, elapsed = asyncio.run(_with_server(run, host="0.0.0.0"))
+        assert len(results) == 2000
+        assert all(r.reachable for r in results.values())
+        assert elapsed < 5
+
+
+class TestPreflight:
+    """Reachability pre-flight in run_backup."""
+
+    def test_unreachable_device_is_not_fetched(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(reachability.settings, "REACHABILITY_PREFLIGHT", True)
+        monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+        fetched = []
+
+        def fake_fetch(*, host, port, **kwargs):
+            fetched.append(port)
+            path = tmp_path / f"{port}.cfg"
+            path.write_bytes(b"hostname x")
+            return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+        monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+        dead = _closed_port()
+        db = TestSessionLocal()
+        db.add(Device(id=2, hostname="dead", ip="127.0.0.1", vendor="Cisco", protocol="SSH", port=dead,
+                      username_enc="", password_enc=""))
+        db.commit()
+
+        async def run(port):
+            devices = [
+                {"id": 1, "hostname": "alive", "ip": "127.0.0.1", "port": port},
+                {"id": 2, "hostname": "dead", "ip": "127.0.0.1", "port": dead},
+            ]
+            for d in devices:
+                d.update(vendor="Cisco", protocol="SSH", username="u", password="p", secret=None)
+            log_lines: list[str] = []
+            ok = await collector.run_backup(db, devices, log_lines)
+            return ok, log_lines, port
+
+        try:
+            ok, log_lines, port = asyncio.run(_with_server(run))
+            assert ok == 1
+            assert fetched == [port]
+            assert any("[dead] Backup failed: Unreachable" in line for line in log_lines)
+            assert db.get(Device, 2).consecutive_failures == 1
+        finally:
+            db.close()
+
+
+class TestReachabilityApi:
+    """GET /devices/reachability."""
+
+    def test_endpoint(self, client, monkeypatch):
+        from app.api import devices
+        from app.main import app
+        from app.security import get_current_user
+
+        db = TestSessionLocal()
+        db.add(Device(id=1, hostname="dead", ip="127.0.0.1", vendor="Cisco", protocol="SSH",
+                      port=_closed_port(), username_enc="", password_enc=""))
+        db.commit()
+        db.close()
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, devices.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: type("U", (), {"username": "t"})())
+        [row] = client.get("/devices/reachability").json()
+        assert row["hostname"] == "dead"
+        assert row["reachable"] is False
+        assert row["error"]
@@ -0,0 +1,99 @@
+"""
+Tests for the device session pool.
+
+Tests cover:
+1. SessionPool - reuse, idle TTL, max size, health checks
+2. fetch_running_config reuses a Telnet session for back-to-back commands
+"""
+import time
+
+from app.services import netmiko_worker
+from app.services.backup_store import open_config
+from app.services.session_pool import PooledSession, SessionPool
+
+from .test_telnet_driver import FakeTelnetDevice
+
+
+class _Conn:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+
+    def session(self) -> PooledSession:
+        return PooledSession(conn=self, alive=lambda: self.healthy, close=self._close)
+
+    def _close(self):
+        self.closed = True
+
+
+class TestSessionPool:
+    """Tests for SessionPool."""
+
+    def test_release_then_acquire_reuses(self):
+        pool = SessionPool(max_size=4, idle_ttl=60)
+        conn = _Conn()
+        pool.release("r1", conn.session())
+        session = pool.acquire("r1")
+        assert session is not None and session.conn is conn
+        # checked out: nobody else gets it
+        assert pool.acquire("r1") is None
+
+    def test_expired_session_is_closed(self):
+        pool = SessionPool(max_size=4, idle_ttl=60)
+        conn = _Conn()
+        session = conn.session()
+        pool.release("r1", session)
+        session.last_used = time.monotonic() - 61
+        assert pool.acquire("r1") is None
+        assert conn.closed
+
+    def test_unhealthy_session_is_closed(self):
+        pool = SessionPool(max_size=4, idle_ttl=60)
+        conn = _Conn(healthy=False)
+        pool.release("r1", conn.session())
+        assert pool.acquire("r1") is None
+        assert conn.closed
+
+    def test_max_size_evicts_oldest(self):
+        pool = SessionPool(max_size=2, idle_ttl=60)
+        conns = [_Conn() for _ in range(3)]
+        for i, conn in enumerate(conns):
+            pool.release(f"r{i}", conn.session())
+        assert len(pool) == 2
+        assert conns[0].closed
+        assert not conns[2].closed
+
+    def test_disabled_pool_closes_on_release(self):
+        pool = SessionPool(max_size=0, idle_ttl=60)
+        conn = _Conn()
+        pool.release("r1", conn.session())
+        assert conn.closed
+        assert pool.acquire("r1") is None
+
+
+class TestFetchReusesSession:
+    """fetch_running_config and the pool together."""
+
+    def test_back_to_back_telnet_commands_share_one_login(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        pool = SessionPool(max_size=4, idle_ttl=60)
+        monkeypatch.setattr(netmiko_worker, "session_pool", pool)
+
+        # FakeTelnetDevice accepts a single connection
+        dev = FakeTelnetDevice(outputs={
+            b"show version": b"Cisco IOS Software",
+            b"show running-config": b"hostname R1",
+        })
+        kwargs = dict(
+            vendor="Cisco", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port,
+        )
+        version = netmiko_worker.fetch_running_config(cmd="show version", **kwargs)
+        config = netmiko_worker.fetch_running_config(**kwargs)
+        pool.close_all()
+        version = open_config(version.path).read()
+        config = open_config(config.path).read()
+
+        assert b"Cisco IOS Software" in version
+        assert b"hostname R1" in config
+        assert dev.received.count(b"terminal length 0") == 1
@@ -0,0 +1,172 @@
+"""
+Tests for in-memory session logs.
+
+Tests cover:
+1. SessionTrace ring buffer: size bound, dropped-bytes marker, secret masking (also
+   across writes)
+2. Telnet dialogue captured in memory, password masked
+3. run_backup stores a diagnostic only for failed devices, per job, pruned per device
+4. /jobs/{id}/diagnostics endpoints
+"""
+import asyncio
+
+import pytest
+
+from app.models import Device, FetchDiagnostic, Job
+from app.services import collector, netmiko_worker, session_trace
+from app.services.backup_store import StoredConfig
+from app.services.session_trace import NetmikoSessionLog, SessionTrace
+
+from .conftest import TestSessionLocal
+from .test_telnet_driver import FakeTelnetDevice
+
+
+class TestSessionTrace:
+    """Tests for SessionTrace."""
+
+    def test_keeps_only_the_tail(self):
+        trace = SessionTrace(max_bytes=10)
+        trace.write(b"0123456789")
+        trace.write("abcde")
+        assert trace.dropped == 5
+        assert trace.getvalue() == "[... 5 earlier bytes dropped ...]\n56789abcde"
+
+    def test_secrets_are_masked(self):
+        trace = SessionTrace(secrets=("hunter2", None))
+        trace.write(b"Password: hunter2\r\n")
+        assert "hunter2" not in trace.getvalue()
+        assert "********" in trace.getvalue()
+
+    def test_secret_split_across_writes_is_masked(self):
+        trace = SessionTrace(secrets=("hunter2",))
+        trace.write(b"Password: hun")
+        trace.write(b"ter2\r\nR1#")
+        assert trace.getvalue() == "Password: ********\r\nR1#"
+        trace.write(b"show hu")  # a prefix that never becomes the secret is kept as is
+        assert trace.getvalue().endswith("R1#show hu")
+
+    def test_netmiko_log_follows_target(self):
+        trace = SessionTrace()
+        log = NetmikoSessionLog(trace)
+        log.write("R1#show run")
+        log.target = None
+        log.write("dropped")
+        assert trace.getvalue() == "R1#show run"
+
+
+class TestTelnetCapture:
+    """Telnet dialogue goes to the trace."""
+
+    def test_failed_login_is_captured(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        dev = FakeTelnetDevice(password=b"right")
+        trace = SessionTrace(secrets=("wrong",))
+        with pytest.raises(Exception, match="authentication failed"):
+            netmiko_worker.fetch_running_config(
+                vendor="Cisco", host="127.0.0.1", username="admin", password="wrong",
+                secret=None, protocol="Telnet", port=dev.port, session_log=trace,
+            )
+        log = trace.getvalue()
+        assert "User Access Verification" in log
+        assert ">>> admin" in log
+        assert "Login invalid" in log
+        assert "wrong" not in log
+        assert "error: Telnet authentication failed" in log
+
+    def test_successful_fetch_writes_no_session_file(self, monkeypatch, tmp_path):
+        import tempfile
+
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path / "backups"))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        dev = FakeTelnetDevice(outputs={b"show running-config": b"hostname R1"})
+        trace = SessionTrace()
+        netmiko_worker.fetch_running_config(
+            vendor="Cisco", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port, session_log=trace,
+        )
+        assert "hostname R1" in trace.getvalue()
+        assert [p.name for p in tmp_path.iterdir()] == ["backups"]
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setattr(collector.settings, "RETRY_ATTEMPTS", 0)
+    monkeypatch.setattr(collector.settings, "CHANGE_PROBE_ENABLED", False)
+    monkeypatch.setattr(session_trace.settings, "SESSION_LOG_KEEP", 2)
+    db = TestSessionLocal()
+    for i in (1, 2):
+        db.add(Device(id=i, hostname=f"sw{i}", ip=f"10.0.0.{i}", vendor="Cisco", protocol="SSH", port=22,
+                      username_enc="", password_enc=""))
+    db.commit()
+
+    def fake_fetch(*, host, session_log, **kwargs):
+        session_log.write(f"{host}: Password: secret-pw\n")
+        if host == "10.0.0.2":
+            raise Exception(f"Connection failed: {host} | Error: timed out")
+        path = tmp_path / f"{host}.cfg"
+        path.write_bytes(b"hostname x")
+        return StoredConfig(path=str(path), sha256="ab" * 32, size=10)
+
+    monkeypatch.setattr(netmiko_worker, "fetch_running_config", fake_fetch)
+
+    def run(job_id):
+        devices = [
+            {"id": i, "hostname": f"sw{i}", "ip": f"10.0.0.{i}", "vendor": "Cisco", "protocol": "SSH",
+             "port": 22, "username": "u", "password": "secret-pw", "secret": None}
+            for i in (1, 2)
+        ]
+        db.add(Job(id=job_id, triggered_by="manual"))
+        db.commit()
+        return asyncio.run(collector.run_backup(db, devices, [], job_id=job_id))
+
+    yield db, run
+    db.close()
+
+
+class TestRunBackup:
+    """Diagnostics written by run_backup."""
+
+    def test_only_failed_devices_are_stored(self, env):
+        db, run = env
+        assert run(1) == 1
+        [d] = db.query(FetchDiagnostic).all()
+        assert (d.job_id, d.device_id) == (1, 2)
+        assert "timed out" in d.error
+        assert "10.0.0.2: Password: ********" in d.session_log
+        assert "attempt 1/1" in d.session_log
+
+    def test_kept_per_device(self, env):
+        db, run = env
+        for job_id in (1, 2, 3):
+            run(job_id)
+        assert [d.job_id for d in db.query(FetchDiagnostic).order_by(FetchDiagnostic.id)] == [2, 3]
+
+
+class TestDiagnosticsApi:
+    """GET /jobs/{id}/diagnostics."""
+
+    def test_list_and_fetch(self, env, client, monkeypatch):
+        from app.api import jobs
+        from app.main import app
+        from app.security import require_admin
+
+        db, run = env
+        run(7)
+
+        def _db():
+            s = TestSessionLocal()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        monkeypatch.setitem(app.dependency_overrides, jobs.get_db, _db)
+        monkeypatch.setitem(app.dependency_overrides, require_admin, lambda: type("U", (), {"username": "t"})())
+        [row] = client.get("/jobs/7/diagnostics").json()
+        assert row["hostname"] == "sw2"
+        res = client.get("/jobs/7/diagnostics/2")
+        assert res.status_code == 200
+        assert "10.0.0.2: Password: ********" in res.text
+        assert client.get("/jobs/7/diagnostics/1").status_code == 404
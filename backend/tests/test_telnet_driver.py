@@ -0,0 +1,176 @@
+"""
+Tests for the prompt-driven Telnet driver, against a scripted fake device.
+
+Tests cover:
+1. Login/enable/paging dialogue without fixed sleeps
+2. Authentication failures are reported instead of timing out silently
+3. Read path: stops at the prompt, answers pagers, handles large output
+4. A device that goes quiet before its prompt fails the fetch, nothing stored
+"""
+import socket
+import threading
+import time
+
+import pytest
+
+from app.services import netmiko_worker, vendor_profiles
+from app.services.netmiko_worker import Timeouts, _connect_telnet_manual, _read_until_prompt
+
+
+class FakeTelnetDevice:
+    """
+    Minimal line-oriented Telnet device: Username/Password login, optional
+    enable secret, and canned command output followed by the CLI prompt.
+    """
+
+    def __init__(self, prompt=b"R1#", password=b"p", secret=None, outputs=None, stall=None):
+        self.prompt = prompt
+        self.password = password
+        self.secret = secret
+        self.outputs = outputs or {}
+        # (bytes, seconds): go quiet for that long once the output has sent that many bytes
+        self.stall = stall
+        self.received: list[bytes] = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _readline(self, conn) -> bytes:
+        buf = b""
+        while not buf.endswith(b"\n"):
+            ch = conn.recv(1)
+            if not ch:
+                raise ConnectionError
+            buf += ch
+        return buf.strip()
+
+    def _serve(self):
+        conn, _ = self._sock.accept()
+        try:
+            conn.sendall(b"\r\nUser Access Verification\r\n\r\nUsername: ")
+            self._readline(conn)
+            conn.sendall(b"Password: ")
+            if self._readline(conn) != self.password:
+                conn.sendall(b"\r\n% Login invalid\r\n\r\nUsername: ")
+                return
+            conn.sendall(b"\r\n" + self.prompt.replace(b"#", b">"))
+            while True:
+                line = self._readline(conn)
+                self.received.append(line)
+                if line == b"enable" and self.secret:
+                    conn.sendall(b"\r\nPassword: ")
+                    self._readline(conn)
+                    conn.sendall(b"\r\n" + self.prompt)
+                elif line == b"exit":
+                    return
+                else:
+                    out = self.outputs.get(line, b"")
+                    conn.sendall(line + b"\r\n")
+                    # a list of pages is sent behind a --More-- pager
+                    pages = out if isinstance(out, list) else [out]
+                    for page in pages[:-1]:
+                        conn.sendall(page + b"\r\n --More-- ")
+                        conn.recv(1)
+                        conn.sendall(b"\x08" * 10 + b" " * 10 + b"\x08" * 10)
+                    if self.stall and line in self.outputs:
+                        sent, seconds = self.stall
+                        conn.sendall(pages[-1][:sent])
+                        time.sleep(seconds)
+                        pages[-1] = pages[-1][sent:]
+                    conn.sendall(pages[-1] + b"\r\n" + self.prompt)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+            self._sock.close()
+
+
+class TestTelnetLogin:
+    """Tests for _connect_telnet_manual."""
+
+    def test_login_enable_and_paging_are_prompt_driven(self):
+        dev = FakeTelnetDevice(secret=b"s")
+        started = time.monotonic()
+        tn, prompt = _connect_telnet_manual(
+            vendor="Cisco (IOS Router/Switch)", host="127.0.0.1",
+            username="u", password="p", secret="s", port=dev.port, session_log="",
+        )
+        elapsed = time.monotonic() - started
+        tn.close()
+        assert prompt == b"R1#"
+        # the old driver spent 5-8s in fixed sleeps
+        assert elapsed < 1.0
+        assert dev.received == [b"enable", b"terminal length 0"]
+
+    def test_wrong_password_fails_fast(self):
+        dev = FakeTelnetDevice(password=b"right")
+        with pytest.raises(Exception, match="authentication failed"):
+            _connect_telnet_manual(
+                vendor="Cisco", host="127.0.0.1",
+                username="u", password="wrong", secret=None, port=dev.port, session_log="",
+            )
+
+
+def _login(dev: FakeTelnetDevice):
+    return _connect_telnet_manual(
+        vendor="Cisco", host="127.0.0.1",
+        username="u", password="p", secret=None, port=dev.port, session_log="",
+    )
+
+
+class TestReadUntilPrompt:
+    """Tests for _read_until_prompt."""
+
+    def test_stops_at_prompt_without_idle_wait(self):
+        dev = FakeTelnetDevice(outputs={b"show running-config": b"hostname R1\r\n!\r\nend"})
+        tn, prompt = _login(dev)
+        tn.write(b"show running-config\n")
+        started = time.monotonic()
+        raw = _read_until_prompt(tn, prompt, idle_timeout=5).getvalue()
+        elapsed = time.monotonic() - started
+        tn.close()
+        assert b"hostname R1" in raw
+        assert raw.rstrip().endswith(b"R1#")
+        assert elapsed < 1.0
+
+    def test_pager_is_answered_and_stripped(self):
+        pages = [b"line-a", b"line-b", b"line-c"]
+        dev = FakeTelnetDevice(outputs={b"show running-config": pages})
+        tn, prompt = _login(dev)
+        tn.write(b"show running-config\n")
+        raw = _read_until_prompt(tn, prompt, idle_timeout=5).getvalue()
+        tn.close()
+        for page in pages:
+            assert page in raw
+        assert b"More" not in raw
+        assert b"\x08" not in raw
+
+    def test_large_output(self):
+        body = b"\r\n".join(b"interface Gi0/%d" % i for i in range(50000))
+        dev = FakeTelnetDevice(outputs={b"show running-config": body})
+        tn, prompt = _login(dev)
+        tn.write(b"show running-config\n")
+        raw = _read_until_prompt(tn, prompt, idle_timeout=5).getvalue()
+        tn.close()
+        assert body in raw
+
+
+class TestFetch:
+    """Telnet fetches through fetch_running_config."""
+
+    def test_stall_before_prompt_is_a_timeout(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        quick = vendor_profiles.VendorProfile("cisco_ios", delay_factor=0.1)
+        monkeypatch.setattr(netmiko_worker, "profile_for", lambda vendor: quick)
+        config = b"hostname R1\r\ninterface Gi0/1\r\n description uplink\r\nend"
+        dev = FakeTelnetDevice(outputs={b"show running-config": config}, stall=(len(b"hostname R1\r\n"), 1.5))
+        with pytest.raises(Exception, match="Timed out waiting for prompt"):
+            netmiko_worker.fetch_running_config(
+                vendor="Cisco", host="127.0.0.1", username="u", password="p",
+                secret=None, protocol="Telnet", port=dev.port, timeouts=Timeouts(transfer=0.5),
+            )
+        assert not (tmp_path / "objects").exists()
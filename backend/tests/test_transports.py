@@ -0,0 +1,170 @@
+"""
+Tests for the pluggable SSH transport layer.
+
+Tests cover:
+1. Transport selection (per device, global default, Telnet)
+2. asyncssh backend against an in-process SSH server: exec channel and
+   interactive shell with enable (with or without a password prompt), same
+   StoredConfig contract, output written off the event loop
+3. asyncssh errors carry a message (timeouts included)
+"""
+import asyncio
+import threading
+import time
+
+import asyncssh
+import pytest
+
+from app.services import netmiko_worker
+from app.services.backup_store import open_config
+from app.services.circuit_breaker import error_class
+from app.services.netmiko_worker import Timeouts, _resolve_transport, fetch_running_config_async
+
+CONFIG = "hostname R1\n!\ninterface Gi0/1\n description uplink\n!\nend"
+
+
+class _Server(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return password == "p"
+
+
+async def _handle(process):
+    """Cisco-like device: exec runs one command, a shell needs enable first."""
+    if process.command:
+        if process.command == "show hang":
+            await asyncio.sleep(1)  # accepts the command, never answers in time
+        if process.command == "show running-config":
+            process.stdout.write(CONFIG + "\n")
+        process.exit(0)
+        return
+    # user "admin" logs in privileged: enable asks no password
+    prompt = "R1#" if process.get_extra_info("username") == "admin" else "R1>"
+    process.stdout.write("\r\n" + prompt)
+    try:
+        while True:
+            line = (await process.stdin.readline()).strip()
+            if line == "enable" and prompt == "R1#":
+                pass
+            elif line == "enable":
+                process.stdout.write("\r\nPassword: ")
+                await process.stdin.readline()
+                prompt = "R1#"
+            elif line == "show running-config" and prompt == "R1#":
+                process.stdout.write(line + "\r\n" + CONFIG.replace("\n", "\r\n") + "\r\n")
+            elif line in ("exit", ""):
+                if line == "exit":
+                    break
+            process.stdout.write("\r\n" + prompt)
+    except asyncssh.BreakReceived:
+        pass
+    process.exit(0)
+
+
+async def _with_server(coro_factory):
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    server = await asyncssh.create_server(
+        _Server, "127.0.0.1", 0, server_host_keys=[key], process_factory=_handle,
+    )
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await coro_factory(port)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+class TestResolveTransport:
+    """Tests for _resolve_transport."""
+
+    def test_device_overrides_global(self, monkeypatch):
+        monkeypatch.setattr(netmiko_worker.settings, "COLLECTOR_TRANSPORT", "netmiko")
+        assert _resolve_transport("SSH", "asyncssh") == "asyncssh"
+        assert _resolve_transport("SSH", None) == "netmiko"
+
+    def test_telnet_always_uses_telnetlib(self):
+        assert _resolve_transport("Telnet", "asyncssh") == "netmiko"
+
+    def test_unknown_transport(self):
+        with pytest.raises(ValueError):
+            _resolve_transport("SSH", "carrier-pigeon")
+
+
+class TestAsyncSSHTransport:
+    """Tests for the asyncssh backend."""
+
+    def _fetch(self, port, secret=None, username="u"):
+        return fetch_running_config_async(
+            vendor="Cisco (IOS Router/Switch)", host="127.0.0.1",
+            username=username, password="p", secret=secret,
+            protocol="SSH", port=port, transport="asyncssh",
+        )
+
+    def test_exec_channel(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        stored = asyncio.run(_with_server(lambda port: self._fetch(port)))
+        content = open_config(stored.path).read()
+        assert content == CONFIG.encode() + b"\n"
+        assert stored.size == len(content)
+
+    def test_shell_with_enable(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        stored = asyncio.run(_with_server(lambda port: self._fetch(port, secret="s")))
+        content = open_config(stored.path).read()
+        assert b"hostname R1" in content
+        assert b"description uplink" in content
+        assert b"R1#" not in content
+
+    def test_enable_without_password_prompt(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        started = time.monotonic()
+        stored = asyncio.run(_with_server(lambda port: self._fetch(port, secret="s", username="admin")))
+        assert b"hostname R1" in open_config(stored.path).read()
+        assert time.monotonic() - started < 3  # no wait for a password prompt that never comes
+
+    def test_writes_off_event_loop(self, monkeypatch, tmp_path):
+        from app.services import normalize
+
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        threads = set()
+        real_write = normalize.NormalizingWriter.write
+
+        def write(self, chunk):
+            threads.add(threading.get_ident())
+            real_write(self, chunk)
+
+        monkeypatch.setattr(normalize.NormalizingWriter, "write", write)
+        for secret in (None, "s"):  # exec channel and shell
+            asyncio.run(_with_server(lambda port: self._fetch(port, secret=secret)))
+        assert threads and threading.get_ident() not in threads
+
+    def test_bad_password(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+
+        async def run(port):
+            return await fetch_running_config_async(
+                vendor="Cisco", host="127.0.0.1", username="u", password="wrong",
+                secret=None, protocol="SSH", port=port, transport="asyncssh",
+            )
+
+        with pytest.raises(Exception, match="Connection failed"):
+            asyncio.run(_with_server(run))
+
+    def test_no_output_timeout_has_message(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+
+        async def run(port):
+            return await fetch_running_config_async(
+                vendor="Cisco", host="127.0.0.1", username="u", password="p", secret=None,
+                protocol="SSH", port=port, transport="asyncssh", cmd="show hang", timeouts=Timeouts(transfer=0.2),
+            )
+
+        with pytest.raises(Exception) as exc:
+            asyncio.run(_with_server(run))
+        assert "no output from 127.0.0.1 within 0.2s" in str(exc.value)
+        assert error_class(str(exc.value)) == "timeout"
@@ -0,0 +1,117 @@
+"""
+Tests for the vendor profile registry.
+
+Tests cover:
+1. profile_for() - UI names, legacy names, keywords, device types, default
+2. Overrides from VENDOR_PROFILES_FILE
+3. The SSH and Telnet paths take device type, fast mode and command from the profile
+"""
+import json
+
+import pytest
+
+from app.services import netmiko_worker, vendor_profiles
+from app.services.vendor_profiles import PROFILES, VENDOR_NAMES, apply_overrides, load, profile_for
+
+from .test_telnet_driver import FakeTelnetDevice
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    """Overrides go to a copy of the registry."""
+    monkeypatch.setattr(vendor_profiles, "PROFILES", dict(PROFILES))
+    return vendor_profiles.PROFILES
+
+
+class TestLookup:
+    """Tests for profile_for."""
+
+    def test_every_ui_name_has_a_profile(self):
+        for name, device_type in VENDOR_NAMES.items():
+            assert profile_for(name).device_type == device_type
+
+    @pytest.mark.parametrize("vendor,device_type,command", [
+        ("Cisco (IOS Router/Switch)", "cisco_ios", "show running-config"),
+        ("Juniper (JunOS)", "juniper", "show configuration"),
+        ("MikroTik (RouterOS)", "mikrotik_routeros", "/export"),
+        ("Huawei (OLT)", "huawei_olt", "display current-configuration"),
+        ("Fortinet (FortiGate)", "fortinet", "show"),
+        ("Mikrotik", "mikrotik_routeros", "/export"),
+        ("huawei ce6800", "huawei", "display current-configuration"),
+        ("HPE Aruba AOS-CX 6300", "aruba_aoscx", "show running-config"),
+        ("cisco_nxos", "cisco_nxos", "show running-config"),
+        ("Something Else", "cisco_ios", "show running-config"),
+        (None, "cisco_ios", "show running-config"),
+    ])
+    def test_lookup(self, vendor, device_type, command):
+        profile = profile_for(vendor)
+        assert profile.device_type == device_type
+        assert profile.config_command == command
+
+    def test_fast_mode_only_where_safe(self):
+        assert profile_for("Aruba (AOS-CX Switch)").fast_cli
+        assert profile_for("Juniper (JunOS)").fast_cli
+        assert not profile_for("Cisco (IOS Router/Switch)").fast_cli
+        assert not profile_for("Huawei (OLT)").fast_cli
+
+    def test_big_configs_get_longer_transfer_timeout(self):
+        assert profile_for("Cisco").transfer_timeout == 60
+        assert profile_for("Huawei (OLT)").transfer_timeout > 60
+
+
+class TestOverrides:
+    """Tests for apply_overrides and load."""
+
+    def test_override_fields(self, profiles):
+        apply_overrides({"cisco_ios": {"fast_cli": True, "delay_factor": 2, "paging_cmd": "terminal length 512"}})
+        profile = profile_for("Cisco")
+        assert profile.fast_cli and profile.delay_factor == 2
+        assert profile.prompts.paging_cmd == "terminal length 512"
+        assert profile.idle_timeout == 6
+        # the rest of the dialogue is kept
+        assert profile.prompts.login_timeout == 15
+
+    def test_new_device_type(self, profiles):
+        apply_overrides({"cisco_xr": {"config_command": "show running-config | exclude Building"}})
+        assert profile_for("cisco_xr").config_command == "show running-config | exclude Building"
+
+    def test_unknown_field_is_rejected(self, profiles):
+        with pytest.raises(Exception, match="unknown field"):
+            apply_overrides({"cisco_ios": {"fastcli": True}})
+
+    def test_load_file(self, profiles, tmp_path, monkeypatch):
+        path = tmp_path / "profiles.json"
+        path.write_text(json.dumps({"juniper": {"fast_cli": False}}))
+        monkeypatch.setattr(vendor_profiles.settings, "VENDOR_PROFILES_FILE", str(path))
+        load()
+        assert not profile_for("Juniper (JunOS)").fast_cli
+
+
+class TestTransports:
+    """Profiles in the SSH and Telnet paths."""
+
+    def test_ssh_connect_uses_profile(self, monkeypatch):
+        seen = {}
+
+        class FakeConn:
+            def __init__(self, **kwargs):
+                seen.update(kwargs)
+
+        monkeypatch.setattr(netmiko_worker, "ConnectHandler", FakeConn)
+        netmiko_worker._connect_ssh_normal(
+            vendor="Aruba (AOS-CX Switch)", host="10.0.0.1", username="u", password="p",
+            secret=None, port=22, session_log="",
+        )
+        assert seen["device_type"] == "aruba_aoscx"
+        assert seen["fast_cli"] is True
+        assert seen["global_delay_factor"] == 1.0
+
+    def test_telnet_uses_profile_command_and_paging(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(netmiko_worker.settings, "BACKUP_DIR", str(tmp_path))
+        monkeypatch.setattr(netmiko_worker.session_pool, "max_size", 0)
+        dev = FakeTelnetDevice(prompt=b"user@R1>", outputs={b"show configuration": b"system { host-name R1; }"})
+        netmiko_worker.fetch_running_config(
+            vendor="Juniper (JunOS)", host="127.0.0.1", username="u", password="p",
+            secret=None, protocol="Telnet", port=dev.port,
+        )
+        assert dev.received[:2] == [b"set cli screen-length 0", b"show configuration"]
@@ -149,3 +149,86 @@ export async function apiGetText(path: string, withAuth = true): Promise<string>
 
   return res.text();
 }
+
+// Streaming helper: POST, then hand each NDJSON line to onLine as it arrives
+export async function apiPostStream<TReq, TLine>(
+  path: string,
+  body: TReq,
+  onLine: (line: TLine) => void,
+  withAuth = true,
+): Promise<void> {
+  const headers: Record<string, string> = {
+    "Content-Type": "application/json",
+    Accept: "application/x-ndjson",
+  };
+  if (withAuth) Object.assign(headers, getAuthHeader());
+
+  const res = await fetch(`${API_BASE}${path}`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify(body),
+  });
+
+  if (!res.ok || !res.body) {
+    let errorMessage = `POST ${path} failed (${res.status})`;
+    try {
+      const errorData = await res.json();
+      errorMessage = errorData.detail || errorData.message || errorMessage;
+    } catch (e) {
+      // If JSON parsing fails, keep default message
+    }
+    throw new Error(errorMessage);
+  }
+
+  await readNdjson(res.body, onLine);
+}
+
+// Streaming helper: GET, then hand each NDJSON line to onLine until the server
+// ends the stream or signal aborts it
+export async function apiGetStream<TLine>(
+  path: string,
+  onLine: (line: TLine) => void,
+  signal?: AbortSignal,
+  withAuth = true,
+): Promise<void> {
+  const headers: Record<string, string> = {
+    Accept: "application/x-ndjson",
+  };
+  if (withAuth) Object.assign(headers, getAuthHeader());
+
+  const res = await fetch(`${API_BASE}${path}`, {
+    method: "GET",
+    headers,
+    signal,
+  });
+
+  if (!res.ok || !res.body) {
+    let errorMessage = `GET ${path} failed (${res.status})`;
+    try {
+      const errorData = await res.json();
+      errorMessage = errorData.detail || errorData.message || errorMessage;
+    } catch (e) {
+      // If JSON parsing fails, keep default message
+    }
+    throw new Error(errorMessage);
+  }
+
+  await readNdjson(res.body, onLine);
+}
+
+async function readNdjson<TLine>(body: ReadableStream<Uint8Array>, onLine: (line: TLine) => void) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop() ?? "";
+    for (const line of lines) {
+      if (line.trim()) onLine(JSON.parse(line) as TLine);
+    }
+  }
+  if (buffer.trim()) onLine(JSON.parse(buffer) as TLine);
+}
@@ -1,7 +1,7 @@
 "use client";
 
 import { useState, useEffect } from 'react';
-import { apiGet, apiPost, apiPut, apiDelete } from '@/lib/api';
+import { apiGet, apiPost, apiPut, apiDelete, apiPostStream } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
@@ -25,6 +25,18 @@ interface Device {
   enabled?: boolean;
 }
 
+interface BulkTestLine {
+  device_id?: number;
+  hostname?: string;
+  success?: boolean;
+  message?: string;
+  cached?: boolean;
+  done?: boolean;
+  total?: number;
+  succeeded?: number;
+  failed?: number;
+}
+
 export function DevicesPage() {
   const [devices, setDevices] = useState<Device[]>([]);
   const [searchQuery, setSearchQuery] = useState('');
@@ -45,6 +57,10 @@ export function DevicesPage() {
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [isTestDialogOpen, setIsTestDialogOpen] = useState(false);
   const [testResult, setTestResult] = useState<{ success: boolean; message: string } | null>(null);
+  const [isBulkTestOpen, setIsBulkTestOpen] = useState(false);
+  const [bulkTesting, setBulkTesting] = useState(false);
+  const [bulkResults, setBulkResults] = useState<BulkTestLine[]>([]);
+  const [bulkSummary, setBulkSummary] = useState<BulkTestLine | null>(null);
   const [editingDevice, setEditingDevice] = useState<Device | null>(null);
   const [formData, setFormData] = useState({
     hostname: '',
@@ -224,6 +240,26 @@ export function DevicesPage() {
     }
   };
 
+  // Tests every device currently listed; results stream in as each device finishes
+  const handleBulkTest = async () => {
+    setIsBulkTestOpen(true);
+    setBulkResults([]);
+    setBulkSummary(null);
+    setBulkTesting(true);
+    try {
+      const ids = filteredDevices.map(d => Number(d.id));
+      await apiPostStream<unknown, BulkTestLine>('/devices/test', { device_ids: ids, refresh: true }, (line) => {
+        if (line.done) setBulkSummary(line);
+        else setBulkResults(prev => [...prev, line]);
+      });
+    } catch (err: unknown) {
+      const msg = (err && typeof err === 'object' && 'message' in err) ? (err as { message?: string }).message : String(err);
+      toast.error('Bulk test failed: ' + (msg || 'Unknown error'));
+    } finally {
+      setBulkTesting(false);
+    }
+  };
+
   const fetchDevices = async () => {
     setLoading(true);
     try {
@@ -248,12 +284,20 @@ export function DevicesPage() {
           <h2 className="text-gray-900">Devices</h2>
           <p className="text-gray-500">Manage network devices for backup</p>
         </div>
-        {userRole === 'admin' && (
-          <Button onClick={handleAddDevice} className="gap-2" disabled={loading}>
-            <Plus className="w-4 h-4" />
-            Add Device
-          </Button>
-        )}
+        <div className="flex gap-2">
+          {userRole === 'admin' && (
+            <Button variant="outline" onClick={handleBulkTest} className="gap-2" disabled={loading || bulkTesting || devices.length === 0}>
+              <TestTube className="w-4 h-4" />
+              Test All
+            </Button>
+          )}
+          {userRole === 'admin' && (
+            <Button onClick={handleAddDevice} className="gap-2" disabled={loading}>
+              <Plus className="w-4 h-4" />
+              Add Device
+            </Button>
+          )}
+        </div>
       </div>
 
       {/* Search Box */}
@@ -574,6 +618,48 @@ export function DevicesPage() {
           </DialogFooter>
         </DialogContent>
       </Dialog>
+
+      {/* Bulk Test Dialog */}
+      <Dialog open={isBulkTestOpen} onOpenChange={setIsBulkTestOpen}>
+        <DialogContent className="max-w-2xl">
+          <DialogHeader>
+            <DialogTitle>Testing Devices</DialogTitle>
+          </DialogHeader>
+
+          <div className="py-2 space-y-3">
+            <p className="text-gray-600 text-sm">
+              {bulkSummary
+                ? `${bulkSummary.succeeded}/${bulkSummary.total} devices OK, ${bulkSummary.failed} failed`
+                : `${bulkResults.length}/${filteredDevices.length} tested...`}
+            </p>
+            <div className="max-h-96 overflow-y-auto border rounded-lg divide-y">
+              {bulkResults.map((r) => (
+                <div key={r.device_id} className="flex items-start gap-3 p-2 text-sm">
+                  {r.success ? (
+                    <CheckCircle className="w-4 h-4 mt-0.5 text-green-600 shrink-0" />
+                  ) : (
+                    <XCircle className="w-4 h-4 mt-0.5 text-red-600 shrink-0" />
+                  )}
+                  <span className="font-medium w-40 shrink-0">{r.hostname}</span>
+                  <span className={r.success ? 'text-green-600' : 'text-red-600'}>{r.message}</span>
+                </div>
+              ))}
+              {bulkTesting && (
+                <div className="flex items-center gap-2 p-2 text-sm text-gray-500">
+                  <div className="w-4 h-4 border-2 border-blue-200 border-t-blue-600 rounded-full animate-spin"></div>
+                  Waiting for remaining devices...
+                </div>
+              )}
+            </div>
+          </div>
+
+          <DialogFooter>
+            <Button onClick={() => setIsBulkTestOpen(false)}>
+              Close
+            </Button>
+          </DialogFooter>
+        </DialogContent>
+      </Dialog>
     </div>
   );
 }
\ No newline at end of file
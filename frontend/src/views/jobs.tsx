@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter } from '@/components/ui/dialog';
@@ -8,18 +8,44 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@
 import { Badge } from '@/components/ui/badge';
 import { Play, Eye, X } from 'lucide-react';
 import { toast } from 'sonner';
-import { apiGet, apiPost } from '@/lib/api';
+import { apiGet, apiGetStream, apiPost } from '@/lib/api';
 
 interface Job {
   id: number;
   triggeredBy: string;
   devices: number;
-  status: 'running' | 'success' | 'failed' | 'queued';
+  status: 'running' | 'success' | 'failed' | 'queued' | 'cancelled';
   startedAt: string | null;
   finishedAt: string | null;
   log?: string | null;
+  devicesTotal?: number | null;
+  devicesDone?: number | null;
+  ratePerMin?: number | null;
+  etaS?: number | null;
 }
 
+// Messages of GET /jobs/{id}/events (NDJSON)
+type JobProgress = {
+  status: string;
+  devices_total: number | null;
+  devices_done: number;
+  succeeded: number;
+  rate_per_min: number | null;
+  eta_s: number | null;
+};
+
+type JobStreamMessage =
+  | ({ type: 'snapshot'; log: string[] } & JobProgress)
+  | ({ type: 'progress' | 'done' } & JobProgress)
+  | { type: 'log'; id: number; line: string; timestamp: string };
+
+const isActive = (status: string) => status === 'running' || status === 'queued';
+
+const formatEta = (seconds: number) =>
+  seconds >= 3600
+    ? `${Math.floor(seconds / 3600)}h ${Math.round((seconds % 3600) / 60)}m`
+    : `${Math.floor(seconds / 60)}m ${seconds % 60}s`;
+
   type ApiJob = {
     id: number;
     triggered_by?: string;
@@ -31,6 +57,8 @@ interface Job {
     finished_at?: string;
     finishedAt?: string;
     log?: string;
+    devices_total?: number | null;
+    devices_done?: number | null;
   };
 
 export function JobsPage() {
@@ -43,6 +71,10 @@ export function JobsPage() {
   const [isDetailOpen, setIsDetailOpen] = useState(false);
   const [jobLog, setJobLog] = useState<string[]>([]);
   const [loadingLog, setLoadingLog] = useState(false);
+  // Event streams of the running/queued jobs, by job id
+  const streams = useRef(new Map<number, AbortController>());
+  const selectedId = useRef<number | null>(null);
+  const [followRetry, setFollowRetry] = useState(0);
 
   const [userRole] = useState<'admin' | 'viewer'>(() => {
     try {
@@ -67,6 +99,8 @@ export function JobsPage() {
         startedAt: j.started_at ?? j.startedAt ?? null,
         finishedAt: j.finished_at ?? j.finishedAt ?? null,
         log: j.log ?? null,
+        devicesTotal: j.devices_total ?? null,
+        devicesDone: j.devices_done ?? null,
       }));
       setJobs(mapped);
     } catch (err: unknown) {
@@ -83,12 +117,67 @@ export function JobsPage() {
       if (!mounted) return;
       await fetchJobs();
     })();
-    const interval = setInterval(() => {
-      if (mounted) fetchJobs();
-    }, 5000);
-    return () => { mounted = false; clearInterval(interval); };
+    const open = streams.current;
+    return () => {
+      mounted = false;
+      open.forEach((controller) => controller.abort());
+      open.clear();
+    };
   }, []);
 
+  const applyProgress = (jobId: number, p: JobProgress) => {
+    const update = (job: Job): Job => ({
+      ...job,
+      status: p.status as Job['status'],
+      devices: p.succeeded,
+      devicesTotal: p.devices_total,
+      devicesDone: p.devices_done,
+      ratePerMin: p.rate_per_min,
+      etaS: p.eta_s,
+    });
+    setJobs((prev) => prev.map((job) => (job.id === jobId ? update(job) : job)));
+    setSelectedJob((prev) => (prev && prev.id === jobId ? update(prev) : prev));
+  };
+
+  const followJob = async (jobId: number) => {
+    const controller = new AbortController();
+    streams.current.set(jobId, controller);
+    let dropped = false;
+    try {
+      await apiGetStream<JobStreamMessage>(`/jobs/${jobId}/events`, (msg) => {
+        if (msg.type === 'log') {
+          if (selectedId.current === jobId) setJobLog((prev) => [...prev, msg.line]);
+          return;
+        }
+        applyProgress(jobId, msg);
+        if (msg.type === 'snapshot' && selectedId.current === jobId) {
+          setJobLog(msg.log.filter((line) => line.trim()));
+        }
+      }, controller.signal);
+    } catch {
+      dropped = !controller.signal.aborted;
+    } finally {
+      if (streams.current.get(jobId) === controller) streams.current.delete(jobId);
+    }
+    if (controller.signal.aborted) return;
+    if (dropped) {
+      // Connection lost: follow the job again in a moment
+      await new Promise((resolve) => setTimeout(resolve, 5000));
+      setFollowRetry((n) => n + 1);
+    }
+    // Reload once for finish times and the jobs that start next
+    await fetchJobs();
+  };
+
+  // Follow every running or queued job instead of polling the whole list
+  const activeIds = jobs.filter((job) => isActive(job.status)).map((job) => job.id).join(',');
+  useEffect(() => {
+    for (const id of activeIds ? activeIds.split(',').map(Number) : []) {
+      if (!streams.current.has(id)) followJob(id);
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [activeIds, followRetry]);
+
   const filteredJobs = statusFilter === 'All' 
     ? jobs 
     : jobs.filter(job => job.status === statusFilter.toLowerCase());
@@ -99,12 +188,14 @@ export function JobsPage() {
       failed: 'bg-red-100 text-red-700',
       running: 'bg-yellow-100 text-yellow-700',
       queued: 'bg-blue-100 text-blue-700',
+      cancelled: 'bg-gray-100 text-gray-700',
     };
     const icons = {
       success: '✅',
       failed: '❌',
       running: '🟡',
       queued: '⏳',
+      cancelled: '⏹️',
     };
     return (
       <Badge className={variants[status as keyof typeof variants] || ''}>
@@ -114,6 +205,7 @@ export function JobsPage() {
   };
 
   const handleViewJob = async (job: Job) => {
+    selectedId.current = job.id;
     setSelectedJob(job);
     setIsDetailOpen(true);
     setLoadingLog(true);
@@ -127,6 +219,7 @@ export function JobsPage() {
         started_at: string | null;
         finished_at: string | null;
         devices_count: number;
+        progress: JobProgress;
         log: string;
       }>(`/jobs/${job.id}`);
       
@@ -142,6 +235,10 @@ export function JobsPage() {
         startedAt: jobDetail.started_at,
         finishedAt: jobDetail.finished_at,
         log: jobDetail.log,
+        devicesTotal: jobDetail.progress.devices_total,
+        devicesDone: jobDetail.progress.devices_done,
+        ratePerMin: jobDetail.progress.rate_per_min,
+        etaS: jobDetail.progress.eta_s,
       });
     } catch (err) {
       toast.error(`Failed to fetch job details: ${err}`);
@@ -157,8 +254,12 @@ export function JobsPage() {
 
     setCancellingId(jobId);
     try {
-      await apiPost(`/jobs/${jobId}/cancel`, {});
-      toast.success('Job cancelled successfully');
+      const res = await apiPost<unknown, { ok: boolean; status?: string; detail?: string }>(`/jobs/${jobId}/cancel`, {} as unknown);
+      if (!res.ok) {
+        toast.error('Failed to cancel job: ' + (res.detail || 'Unknown error'));
+        return;
+      }
+      toast.success(res.status === 'cancelling' ? 'Cancelling job: running sessions are being stopped' : 'Job cancelled');
       await fetchJobs();
       setIsDetailOpen(false);
     } catch (err: unknown) {
@@ -220,6 +321,7 @@ export function JobsPage() {
             <SelectItem value="Success">Success</SelectItem>
             <SelectItem value="Failed">Failed</SelectItem>
             <SelectItem value="Queued">Queued</SelectItem>
+            <SelectItem value="Cancelled">Cancelled</SelectItem>
           </SelectContent>
         </Select>
       </div>
@@ -252,7 +354,11 @@ export function JobsPage() {
               <TableRow key={job.id}>
                 <TableCell>{`#${job.id}`}</TableCell>
                 <TableCell>{job.triggeredBy}</TableCell>
-                <TableCell>{job.devices}</TableCell>
+                <TableCell>
+                  {job.status === 'running' && job.devicesTotal
+                    ? `${job.devicesDone ?? 0}/${job.devicesTotal}`
+                    : job.devices}
+                </TableCell>
                 <TableCell>{getStatusBadge(job.status)}</TableCell>
                 <TableCell>{job.startedAt ? new Date(job.startedAt).toLocaleString() : '-'}</TableCell>
                 <TableCell>{job.finishedAt ? new Date(job.finishedAt).toLocaleString() : '-'}</TableCell>
@@ -266,7 +372,7 @@ export function JobsPage() {
                     >
                       <Eye className="w-4 h-4" />
                     </Button>
-                    {job.status === 'running' && userRole === 'admin' && (
+                    {(job.status === 'running' || job.status === 'queued') && userRole === 'admin' && (
                       <Button 
                         variant="outline" 
                         size="sm"
@@ -290,7 +396,13 @@ export function JobsPage() {
       </div>
 
       {/* Job Detail Modal */}
-      <Dialog open={isDetailOpen} onOpenChange={setIsDetailOpen}>
+      <Dialog
+        open={isDetailOpen}
+        onOpenChange={(open) => {
+          setIsDetailOpen(open);
+          if (!open) selectedId.current = null;
+        }}
+      >
         <DialogContent className="max-w-2xl">
           <DialogHeader>
             <DialogTitle>Job {selectedJob?.id} - {selectedJob?.status}</DialogTitle>
@@ -303,6 +415,14 @@ export function JobsPage() {
                 <div className="space-y-1 text-sm">
                   <p><span className="text-gray-600">Triggered by:</span> {selectedJob.triggeredBy}</p>
                   <p><span className="text-gray-600">Devices:</span> {selectedJob.devices}</p>
+                  {selectedJob.status === 'running' && selectedJob.devicesTotal ? (
+                    <p>
+                      <span className="text-gray-600">Progress:</span>{' '}
+                      {selectedJob.devicesDone ?? 0}/{selectedJob.devicesTotal} devices
+                      {selectedJob.ratePerMin ? `, ${selectedJob.ratePerMin}/min` : ''}
+                      {selectedJob.etaS != null ? `, about ${formatEta(selectedJob.etaS)} left` : ''}
+                    </p>
+                  ) : null}
                   <p><span className="text-gray-600">Started:</span> {selectedJob.startedAt ? new Date(selectedJob.startedAt).toLocaleString() : '-'}</p>
                   <p><span className="text-gray-600">Finished:</span> {selectedJob.finishedAt ? new Date(selectedJob.finishedAt).toLocaleString() : '-'}</p>
                 </div>
@@ -329,7 +449,7 @@ export function JobsPage() {
           )}
 
           <DialogFooter>
-            {selectedJob?.status === 'running' && userRole === 'admin' && (
+            {(selectedJob?.status === 'running' || selectedJob?.status === 'queued') && userRole === 'admin' && (
               <Button 
                 variant="destructive" 
                 onClick={() => selectedJob && handleCancelJob(selectedJob.id)}